@@ -0,0 +1,185 @@
+"""Register/recognize throughput and latency on synthetic galleries.
+
+Each gallery size runs in its own process against a fresh SQLite file,
+populated directly through src.db.add_face, so startup, warm-start and
+peak RSS numbers are per size. Results are written as JSON for diffing:
+
+    python benchmarks/bench.py --sizes 100 1000 10000 100000 --output bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+
+
+def summarize(latencies_ms, wall_seconds):
+    """p50/p95/p99/mean latency and throughput for one timed stage"""
+    values = np.asarray(latencies_ms)
+    return {
+        "count": int(values.size),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+        "throughput_per_s": round(values.size / wall_seconds, 2) if wall_seconds > 0 else None
+    }
+
+
+def time_calls(fn, iterations, warmup=2):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - call_start) * 1000)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (Linux/macOS)"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 2)
+    except ImportError:
+        return None
+
+
+def run_size(size, iterations, image_path):
+    """Benchmark one gallery size; expects SIGHTLINE_DB_PATH to point at an empty database"""
+    import cv2
+    from benchmarks.synthetic import make_gallery_features, make_face_image
+    from src.codec import FEATURE_FORMAT, encode_features, decode_features
+    from src.db import add_face, get_face_data
+
+    rss_samples = []
+    result = {"gallery_size": size}
+
+    # Populate through the regular add_face path (one commit per row)
+    names, faces, hists = make_gallery_features(size)
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for name, face, hist in zip(names, faces, hists):
+            add_face(name, encode_features({'face_region': face, 'histogram': hist, 'face_box': (0, 0, 100, 100)}),
+                     FEATURE_FORMAT)
+    elapsed = time.perf_counter() - start
+    result["populate"] = {"rows": size, "seconds": round(elapsed, 3), "rows_per_s": round(size / elapsed, 2)}
+    del faces, hists
+
+    # Import the app, then run the same warm-up the lifespan hook does
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        from src import faces as face_module
+        from src.main import app, get_memory_usage, warm_up, STARTUP_STATS
+        warm_up()
+    result["startup"] = {**STARTUP_STATS, **face_module.GALLERY_STATS}
+    rss_samples.append(get_memory_usage())
+
+    if image_path:
+        with open(image_path, 'rb') as f:
+            image_bytes = f.read()
+    else:
+        image_bytes = cv2.imencode('.jpg', make_face_image(480))[1].tobytes()
+
+    probe = face_module.extract_face_features(image_bytes)
+    stored = decode_features(*get_face_data(names[0]))
+
+    stages = {}
+    stages["extract_face_features"] = time_calls(lambda: face_module.extract_face_features(image_bytes), iterations)
+    stages["compare_faces"] = time_calls(lambda: face_module.compare_faces(probe, stored), iterations * 10)
+    stages["gallery_search"] = time_calls(lambda: face_module.get_index().search(probe), iterations)
+    stages["recognize_faces"] = time_calls(lambda: face_module.recognize_faces(image_bytes), iterations)
+    rss_samples.append(get_memory_usage())
+
+    # HTTP endpoints through an in-process client
+    from fastapi.testclient import TestClient
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        client = TestClient(app)
+        files = {"file": ("probe.jpg", image_bytes, "image/jpeg")}
+        stages["POST /recognize"] = time_calls(lambda: client.post("/recognize", files=files), iterations)
+        stages["POST /register"] = time_calls(
+            lambda: client.post("/register", data={"name": "bench_probe"}, files=files), iterations)
+    rss_samples.append(get_memory_usage())
+
+    result["stages"] = stages
+    result["memory"] = {"peak_rss_mb": peak_rss_mb(), "max_sampled_rss_mb": max(rss_samples)}
+    return result
+
+
+def environment():
+    import cv2
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--image', help='Face photo to use as the probe (default: synthetic drawn face)')
+    parser.add_argument('--output', help='Write JSON results here instead of stdout')
+    parser.add_argument('--single-size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single_size is not None:
+        # Child process: one gallery size, result as the last stdout line
+        result = run_size(args.single_size, args.iterations, args.image)
+        print(json.dumps(result))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='sightline-bench-') as tmp:
+        for size in args.sizes:
+            env = dict(os.environ, SIGHTLINE_DB_PATH=os.path.join(tmp, f'faces_{size}.db'))
+            # Repeated probes would otherwise be answered by the probe cache
+            env.setdefault('SIGHTLINE_PROBE_CACHE_MB', '0')
+            # Never touch a deployment's shared store or snapshot from the benchmark database
+            for name in ('SIGHTLINE_GALLERY_STORE', 'SIGHTLINE_SNAPSHOT_PATH', 'SIGHTLINE_GALLERY_SYNC_SECONDS'):
+                env.pop(name, None)
+            cmd = [sys.executable, os.path.abspath(__file__), '--single-size', str(size),
+                   '--iterations', str(args.iterations)]
+            if args.image:
+                cmd += ['--image', os.path.abspath(args.image)]
+            print(f"Benchmarking gallery of {size} faces...", file=sys.stderr)
+            proc = subprocess.run(cmd, env=env, cwd=ROOT, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(proc.stderr, file=sys.stderr)
+                results.append({"gallery_size": size, "error": proc.stderr.strip().splitlines()[-1:]})
+                continue
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    report = json.dumps({"benchmark": "sightline", "environment": environment(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
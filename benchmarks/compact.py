@@ -0,0 +1,114 @@
+"""Gallery footprint and match agreement of compact feature layouts.
+
+Every layout stores the same synthetic gallery; its scores are compared
+with full-size scores, which mirror compare_faces (checked on a sample of
+pairs and reported as reference_max_error):
+
+    python benchmarks/compact.py --size 2000 --face-sides 100 50 25 20 10 --hist-bits 32 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import features_for, make_faces, make_gallery_features, make_probes  # noqa: E402
+from src.faces import compare_faces  # noqa: E402
+from src.gallery import MATCH_THRESHOLD, FeatureLayout, Gallery  # noqa: E402
+
+
+def build_gallery(names, faces, hists, layout):
+    gallery = Gallery(capacity=len(names), layout=layout)
+    for name, face, hist in zip(names, faces, hists):
+        gallery.add(name, face, hist)
+    return gallery
+
+
+def timed_scores(gallery, probes):
+    """(P x identities scores, per-probe latencies in ms)"""
+    rows, latencies = [], []
+    for features in probes:
+        start = time.perf_counter()
+        rows.append(gallery.score(features)[1])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(rows), np.array(latencies)
+
+
+def reference_error(gallery, probes, faces, hists, pairs, seed=2):
+    """Largest gap between full-size gallery scores and compare_faces over random pairs"""
+    rng = np.random.default_rng(seed)
+    worst = 0.0
+    for _ in range(pairs):
+        p, row = int(rng.integers(len(probes))), int(rng.integers(len(faces)))
+        stored = {'face_region': faces[row], 'histogram': hists[row]}
+        expected = compare_faces(probes[p], stored)
+        worst = max(worst, abs(float(gallery.score(probes[p])[1][row]) - expected))
+    return worst
+
+
+def run(size, probe_count, face_sides, hist_bits, pairs):
+    names, faces, hists = make_gallery_features(size)
+    rows, genuine = make_probes(faces, probe_count)
+    # Impostors are faces that were never enrolled, so agreement covers rejections too
+    impostors = [features_for(face) for face in make_faces(probe_count, seed=7)]
+    probes = genuine + impostors
+
+    full = build_gallery(names, faces, hists, FeatureLayout(100, 32))
+    reference, reference_ms = timed_scores(full, probes)
+    reference_top1 = reference.argmax(axis=1)
+    reference_match = reference >= MATCH_THRESHOLD
+
+    results = []
+    for side in face_sides:
+        for bits in hist_bits:
+            layout = FeatureLayout(side, bits)
+            gallery = build_gallery(names, faces, hists, layout)
+            scores, latencies = timed_scores(gallery, probes)
+            stored_bytes = gallery.faces[:len(gallery)].nbytes + gallery.histograms[:len(gallery)].nbytes
+            top1 = scores.argmax(axis=1)
+            results.append({
+                **layout.stats(),
+                "bytes_per_identity": round(stored_bytes / len(gallery), 1),
+                "compression": round(full.layout.row_bytes / layout.row_bytes, 2),
+                "top1_agreement": round(float(np.mean(top1 == reference_top1)), 4),
+                "decision_agreement": round(float(np.mean((scores >= MATCH_THRESHOLD) == reference_match)), 4),
+                "true_match_top1": round(float(np.mean(top1[:len(rows)] == rows)), 4),
+                "mean_abs_score_error": round(float(np.abs(scores - reference).mean()), 5),
+                "max_abs_score_error": round(float(np.abs(scores - reference).max()), 5),
+                "score_ms_p50": round(float(np.percentile(latencies, 50)), 3)
+            })
+
+    return {
+        "gallery_size": size,
+        "probes": len(probes),
+        "reference_max_error": round(reference_error(full, probes, faces, hists, pairs), 6),
+        "reference_score_ms_p50": round(float(np.percentile(reference_ms, 50)), 3),
+        "layouts": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=2000)
+    parser.add_argument('--probes', type=int, default=100)
+    parser.add_argument('--face-sides', type=int, nargs='+', default=[100, 50, 25, 20, 10])
+    parser.add_argument('--hist-bits', type=int, nargs='+', default=[32, 8])
+    parser.add_argument('--reference-pairs', type=int, default=200)
+    parser.add_argument('--output', help='Write JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    result = run(args.size, args.probes, args.face_sides, args.hist_bits, args.reference_pairs)
+    report = json.dumps({"benchmark": "compact", **result}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Detection latency and hit rate across input sizes and detection-resolution caps.
+
+Each input is detected once at full resolution (the reference) and once per
+cap in --max-sides. Synthetic drawn faces are used unless --images points at
+a directory of photos:
+
+    python benchmarks/detection.py --sizes 480 1024 2048 4096 --max-sides 0 640 1024
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_face_image  # noqa: E402
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = w * h
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def agrees(boxes, reference, threshold=0.5):
+    """Same number of faces as the reference, each overlapping one reference box"""
+    if len(boxes) != len(reference):
+        return False
+    return all(max((iou(box, ref) for ref in reference), default=0.0) >= threshold for box in boxes)
+
+
+def load_inputs(sizes, per_size, images_dir):
+    """[(label, grayscale image, expected face count or None)]"""
+    if images_dir:
+        inputs = []
+        for filename in sorted(os.listdir(images_dir)):
+            img = cv2.imread(os.path.join(images_dir, filename), cv2.IMREAD_GRAYSCALE)
+            if img is not None:
+                inputs.append((f"{img.shape[1]}x{img.shape[0]}", img, None))
+        return inputs
+
+    inputs = []
+    for size in sizes:
+        for seed in range(per_size):
+            faces = 1 + seed % 2
+            img = cv2.cvtColor(make_face_image(size, seed=seed, faces=faces), cv2.COLOR_BGR2GRAY)
+            inputs.append((f"{size}", img, faces))
+    return inputs
+
+
+def run(inputs, max_sides, repeats):
+    from src.faces import _detect_faces
+
+    results = {}
+    for label, img, expected in inputs:
+        reference = [tuple(int(v) for v in box) for box in _detect_faces(img, max_side=0)]
+        for max_side in max_sides:
+            key = (label, max_side)
+            entry = results.setdefault(key, {"latencies": [], "hits": 0, "agreements": 0, "images": 0})
+            for _ in range(repeats):
+                start = time.perf_counter()
+                boxes = _detect_faces(img, max_side=max_side)
+                entry["latencies"].append((time.perf_counter() - start) * 1000)
+            boxes = [tuple(int(v) for v in box) for box in boxes]
+            entry["images"] += 1
+            entry["hits"] += int(len(boxes) == (expected if expected is not None else len(reference)))
+            entry["agreements"] += int(agrees(boxes, reference))
+
+    report = []
+    for (label, max_side), entry in results.items():
+        latencies = np.array(entry["latencies"])
+        report.append({
+            "input": label,
+            "max_side": max_side or "full",
+            "images": entry["images"],
+            "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+            "hit_rate": round(entry["hits"] / entry["images"], 4),
+            "agreement_with_full_res": round(entry["agreements"] / entry["images"], 4)
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[480, 1024, 2048, 4096],
+                        help='Synthetic face tile sizes in pixels')
+    parser.add_argument('--per-size', type=int, default=6, help='Synthetic images per size (1 or 2 faces)')
+    parser.add_argument('--max-sides', type=int, nargs='+', default=[0, 640, 1024],
+                        help='Detection resolution caps to compare (0 = full resolution)')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--images', help='Directory of photos to use instead of synthetic faces')
+    parser.add_argument('--output', help='Write JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    inputs = load_inputs(args.sizes, args.per_size, args.images)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = run(inputs, args.max_sides, args.repeats)
+
+    report = json.dumps({"benchmark": "detection", "results": results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
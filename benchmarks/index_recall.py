@@ -0,0 +1,92 @@
+"""Recall and latency of the approximate IVF index against exact search.
+
+    python benchmarks/index_recall.py --sizes 1000 10000 50000 --probes 100 --top-k 10
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_gallery_features, make_probes  # noqa: E402
+from src.gallery import Gallery  # noqa: E402
+from src.index import ExactIndex, IVFIndex  # noqa: E402
+
+
+def timed_search(index, probes, top_k):
+    results, latencies = [], []
+    for features in probes:
+        start = time.perf_counter()
+        results.append(index.search(features, top_k))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.array(latencies)
+
+
+def run(size, probe_count, top_k, nprobe):
+    names, faces, hists = make_gallery_features(size)
+    gallery = Gallery(capacity=size)
+    for name, face, hist in zip(names, faces, hists):
+        gallery.add(name, face, hist)
+
+    exact = ExactIndex(gallery)
+    ivf = IVFIndex(gallery, nprobe=nprobe)
+
+    start = time.perf_counter()
+    ivf.search(make_probes(faces, 1, seed=99)[1][0], top_k)  # first search trains the lists
+    train_ms = (time.perf_counter() - start) * 1000
+
+    rows, probes = make_probes(faces, probe_count)
+    exact_results, exact_ms = timed_search(exact, probes, top_k)
+    ivf_results, ivf_ms = timed_search(ivf, probes, top_k)
+
+    recall = np.mean([
+        len(set(a_names) & set(e_names)) / max(1, len(e_names))
+        for (a_names, _), (e_names, _) in zip(ivf_results, exact_results)
+    ])
+    top1 = np.mean([
+        bool(a_names) and a_names[0] == e_names[0]
+        for (a_names, _), (e_names, _) in zip(ivf_results, exact_results)
+    ])
+    def true_match_rate(results):
+        return float(np.mean([bool(r_names) and r_names[0] == names[row] for row, (r_names, _) in zip(rows, results)]))
+
+    return {
+        "gallery_size": size,
+        "probes": len(probes),
+        "top_k": top_k,
+        "ivf": {**ivf.stats(), "train_ms": round(train_ms, 2)},
+        f"recall_at_{top_k}": round(float(recall), 4),
+        "top1_agreement": round(float(top1), 4),
+        "exact_true_match_top1": round(true_match_rate(exact_results), 4),
+        "ivf_true_match_top1": round(true_match_rate(ivf_results), 4),
+        "exact_ms": {"p50": round(float(np.percentile(exact_ms, 50)), 3),
+                     "p95": round(float(np.percentile(exact_ms, 95)), 3)},
+        "ivf_ms": {"p50": round(float(np.percentile(ivf_ms, 50)), 3),
+                   "p95": round(float(np.percentile(ivf_ms, 95)), 3)}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--probes', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--nprobe', type=int, default=8)
+    parser.add_argument('--output', help='Write JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    results = [run(size, args.probes, args.top_k, args.nprobe) for size in args.sizes]
+    report = json.dumps({"benchmark": "index_recall", "results": results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
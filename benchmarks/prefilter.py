@@ -0,0 +1,85 @@
+"""Prune rate and latency of the histogram score prefilter against full scoring.
+
+Each probe batch is scored both ways; every identity above the threshold
+must come out with the same score (reported as mismatched_probes):
+
+    python benchmarks/prefilter.py --size 10000 --probes 50 --batch 1 8 --thresholds 0.6 0.7 0.8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_gallery_features, make_probes  # noqa: E402
+from src.gallery import MATCH_THRESHOLD, PREFILTER_PAIRS, Gallery  # noqa: E402
+
+
+def matches(names, scores, threshold):
+    above = np.flatnonzero(scores > threshold)
+    return {names[i]: float(scores[i]) for i in above}
+
+
+def timed(score, batches):
+    results, latencies = [], []
+    for batch in batches:
+        start = time.perf_counter()
+        results.append(score(batch))
+        latencies.append((time.perf_counter() - start) * 1000 / len(batch))
+    return results, np.array(latencies)
+
+
+def run(gallery, probes, batch_size, threshold):
+    batches = [probes[i:i + batch_size] for i in range(0, len(probes), batch_size)]
+    pruned, scored = PREFILTER_PAIRS.value('pruned'), PREFILTER_PAIRS.value('scored')
+    full, full_ms = timed(gallery.score_many, batches)
+    prefiltered, prefiltered_ms = timed(lambda batch: gallery.score_many(batch, threshold), batches)
+    pruned, scored = PREFILTER_PAIRS.value('pruned') - pruned, PREFILTER_PAIRS.value('scored') - scored
+
+    mismatched = sum(
+        matches(names, row_a, threshold) != matches(names, row_b, threshold)
+        for (names, scores_a), (_, scores_b) in zip(full, prefiltered)
+        for row_a, row_b in zip(scores_a, scores_b)
+    )
+    return {
+        "batch": batch_size,
+        "threshold": threshold,
+        "prune_rate": round(pruned / max(1, pruned + scored), 4),
+        "mismatched_probes": int(mismatched),
+        "full_ms_per_probe": {"p50": round(float(np.percentile(full_ms, 50)), 3),
+                              "p95": round(float(np.percentile(full_ms, 95)), 3)},
+        "prefilter_ms_per_probe": {"p50": round(float(np.percentile(prefiltered_ms, 50)), 3),
+                                   "p95": round(float(np.percentile(prefiltered_ms, 95)), 3)}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--probes', type=int, default=50)
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[MATCH_THRESHOLD, 0.7, 0.8])
+    parser.add_argument('--output', help='Write JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    names, faces, hists = make_gallery_features(args.size)
+    gallery = Gallery(capacity=args.size)
+    for name, face, hist in zip(names, faces, hists):
+        gallery.add(name, face, hist)
+    _, probes = make_probes(faces, args.probes)
+
+    results = [run(gallery, probes, batch, threshold) for batch in args.batch for threshold in args.thresholds]
+    report = json.dumps({"benchmark": "prefilter", "gallery_size": args.size, "results": results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
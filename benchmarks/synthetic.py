@@ -0,0 +1,68 @@
+"""Synthetic face features for benchmarks.
+
+Each identity is a smooth random 100x100 "face" (an upsampled 8x8 noise
+patch); probes are noisy, slightly re-lit copies of gallery entries, so
+every probe has one clear true match. make_face_image draws a simple
+cartoon face that the frontal Haar cascade detects, for timing the full
+decode -> detect -> score pipeline without shipping photos.
+"""
+import cv2
+import numpy as np
+
+
+def histogram(face):
+    """Normalized 256-bin histogram, computed like extract_face_features"""
+    hist = cv2.calcHist([face], [0], None, [256], [0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+def features_for(face):
+    return {'face_region': face, 'histogram': histogram(face), 'face_box': (0, 0, 100, 100)}
+
+
+def make_faces(n, seed=0):
+    """Return an (n, 100, 100) uint8 stack of distinct synthetic faces"""
+    rng = np.random.default_rng(seed)
+    patches = rng.integers(0, 256, size=(n, 8, 8), dtype=np.uint8)
+    return np.stack([cv2.resize(p, (100, 100), interpolation=cv2.INTER_CUBIC) for p in patches])
+
+
+def perturb(face, rng, noise=12.0, max_shift=15):
+    """A noisy, re-lit view of face"""
+    shifted = face.astype(np.float32) + rng.integers(-max_shift, max_shift + 1)
+    shifted += rng.normal(0.0, noise, size=face.shape)
+    return np.clip(shifted, 0, 255).astype(np.uint8)
+
+
+def make_gallery_features(n, seed=0):
+    """(names, faces (n, 100, 100) uint8, histograms (n, 256) float32)"""
+    faces = make_faces(n, seed)
+    hists = np.stack([histogram(face) for face in faces]).astype(np.float32)
+    return [f'person_{i:06d}' for i in range(n)], faces, hists
+
+
+def make_probes(faces, count, seed=1):
+    """(true row indices, probe feature dicts) drawn from gallery faces"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(faces), size=min(count, len(faces)), replace=False)
+    return rows, [features_for(perturb(faces[row], rng)) for row in rows]
+
+
+def make_face_image(size=480, seed=0, faces=1):
+    """BGR image of `faces` drawn faces side by side, each roughly size x size"""
+    rng = np.random.default_rng(seed)
+    tiles = []
+    for _ in range(faces):
+        img = np.full((size, size), int(rng.integers(190, 220)), dtype=np.uint8)
+        c, r = size // 2, int(size * 0.3)
+        cv2.ellipse(img, (c, c), (int(r * 0.8), r), 0, 0, 360, int(rng.integers(160, 180)), -1)
+        for dx in (-1, 1):
+            # Brows and eyes
+            cv2.ellipse(img, (c + dx * int(r * 0.35), c - int(r * 0.35)), (int(r * 0.22), int(r * 0.06)), 0, 0, 360, 60, -1)
+            cv2.ellipse(img, (c + dx * int(r * 0.35), c - int(r * 0.18)), (int(r * 0.15), int(r * 0.08)), 0, 0, 360, 40, -1)
+        cv2.ellipse(img, (c, c + int(r * 0.15)), (int(r * 0.08), int(r * 0.2)), 0, 0, 360, 140, -1)
+        cv2.ellipse(img, (c, c + int(r * 0.5)), (int(r * 0.3), int(r * 0.08)), 0, 0, 360, 70, -1)
+        img = cv2.GaussianBlur(img, (0, 0), size / 120)
+        img = np.clip(img + rng.normal(0.0, 2.0, size=img.shape), 0, 255).astype(np.uint8)
+        tiles.append(img)
+    return cv2.cvtColor(np.hstack(tiles), cv2.COLOR_GRAY2BGR)
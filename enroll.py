@@ -0,0 +1,35 @@
+"""Bulk-enroll a directory of face images.
+
+Images directly in DIR are named after their file stem (alice.jpg -> alice);
+images inside a subfolder are named after the folder (bob/1.jpg -> bob).
+
+    python enroll.py photos/ --processes 4 --report enroll.json
+"""
+import argparse
+import json
+import os
+import sys
+
+from src.bulk import BULK_CHUNK_SIZE, BULK_PROCESSES, enroll, iter_directory
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('directory', help='Folder of images to enroll')
+    parser.add_argument('--processes', type=int, default=BULK_PROCESSES, help='Feature extraction processes')
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE, help='Rows per database transaction')
+    parser.add_argument('--report', help='Write the JSON result (including per-item failures) here')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        sys.exit(f"Not a directory: {args.directory}")
+
+    # The API workers pick the faces up from the change feed; loading a gallery here would only cost memory
+    result = enroll(iter_directory(args.directory), processes=args.processes, chunk_size=args.chunk_size,
+                    update_gallery=False)
+    for failure in result["failed"]:
+        print(f"FAILED {failure['entry']}: {failure['error']}", file=sys.stderr)
+    print(result["message"], f"in {result['elapsed_ms']} ms")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(result, f, indent=2)
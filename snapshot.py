@@ -0,0 +1,34 @@
+"""Export, import or inspect gallery snapshots.
+
+export writes the gallery (as loaded from the database) to FILE; import
+gives every face in FILE the snapshot's templates in the database, with no
+image decoding or detection; info verifies FILE and prints its header.
+
+    python snapshot.py export gallery.snap --compress
+    python snapshot.py import gallery.snap
+    python snapshot.py info gallery.snap
+"""
+import argparse
+import json
+import sys
+
+from src.faces import export_snapshot, import_snapshot
+from src.snapshot import SnapshotError, read_snapshot
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=('export', 'import', 'info'))
+    parser.add_argument('file', help='Snapshot file')
+    parser.add_argument('--compress', action='store_true', help='zlib-compress the snapshot (export only)')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'export':
+            result = export_snapshot(args.file, compress=args.compress)
+        elif args.command == 'import':
+            result = import_snapshot(args.file)
+        else:
+            result = read_snapshot(args.file).stats()
+    except (OSError, SnapshotError) as e:
+        sys.exit(f"{args.command} failed: {str(e)}")
+    print(json.dumps(result, indent=2))
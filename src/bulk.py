@@ -0,0 +1,161 @@
+import os
+import tarfile
+import time
+import zipfile
+from itertools import chain, islice
+from pathlib import PurePosixPath
+from .db import add_faces
+from .codec import FEATURE_FORMAT, encode_features
+from .embedding import embed_features
+from .faces import extract_face_features, note_gallery_versions, refresh_gallery_faces
+from .uploads import MAX_UPLOAD_BYTES
+
+# Bulk enrollment settings: extraction processes and rows per transaction
+BULK_PROCESSES = int(os.environ.get('SIGHTLINE_BULK_PROCESSES', os.cpu_count() or 1))
+BULK_CHUNK_SIZE = int(os.environ.get('SIGHTLINE_BULK_CHUNK_SIZE', 64))
+
+# Largest single image accepted from an archive or directory
+BULK_MAX_IMAGE_BYTES = MAX_UPLOAD_BYTES
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff'}
+
+
+def name_for_entry(path):
+    """Identity name for an archive/directory entry: its folder if nested, else the file stem"""
+    parts = PurePosixPath(path.replace('\\', '/')).parts
+    if len(parts) > 1:
+        return parts[-2]
+    return PurePosixPath(parts[-1]).stem
+
+
+def is_image_entry(path):
+    name = PurePosixPath(path).name
+    return not name.startswith('.') and PurePosixPath(name).suffix.lower() in IMAGE_EXTENSIONS
+
+
+def iter_archive(fileobj):
+    """Yield (entry path, bytes) for every image in a zip or (optionally compressed) tar stream"""
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not is_image_entry(info.filename):
+                    continue
+                if info.file_size > BULK_MAX_IMAGE_BYTES:
+                    yield info.filename, None
+                    continue
+                yield info.filename, archive.read(info)
+        return
+
+    fileobj.seek(0)
+    # Stream mode reads each member once, front to back
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive:
+            if not member.isfile() or not is_image_entry(member.name):
+                continue
+            if member.size > BULK_MAX_IMAGE_BYTES:
+                yield member.name, None
+                continue
+            yield member.name, archive.extractfile(member).read()
+
+
+def iter_directory(root):
+    """Yield (relative path, bytes) for every image below root, in sorted order"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            relative = os.path.relpath(path, root)
+            if not is_image_entry(relative):
+                continue
+            if os.path.getsize(path) > BULK_MAX_IMAGE_BYTES:
+                yield relative, None
+                continue
+            with open(path, 'rb') as f:
+                yield relative, f.read()
+
+
+def _extract_batch(items):
+    """Worker: [(source, name, bytes)] -> [(source, name, encoded features or None, error)], embedded in one pass"""
+    extracted = []
+    for source, name, data in items:
+        if data is None:
+            extracted.append((source, name, None, 'Image exceeds the size limit'))
+            continue
+        try:
+            extracted.append((source, name, extract_face_features(data, embed=False), None))
+        except Exception as e:
+            extracted.append((source, name, None, str(e)))
+    
+    try:
+        embed_features([features for _, _, features, _ in extracted if features is not None])
+    except Exception as e:
+        return [(source, name, None, error or f"Embedding failed: {str(e)}") for source, name, _, error in extracted]
+    return [(source, name, encode_features(features) if features is not None else None, error)
+            for source, name, features, error in extracted]
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def enroll(entries, processes=None, chunk_size=None, update_gallery=True):
+    """Register faces from (entry path, bytes) pairs, collecting failures per item"""
+    processes = processes or BULK_PROCESSES
+    chunk_size = chunk_size or BULK_CHUNK_SIZE
+    start = time.perf_counter()
+    total, registered, failed = 0, 0, []
+
+    items = ((source, name_for_entry(source), data) for source, data in entries)
+    pool = None
+    if processes > 1:
+        # Imported here so the API process doesn't load multiprocessing until needed;
+        # spawn keeps the workers independent of this process's threads and locks
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import get_context
+        pool = ProcessPoolExecutor(max_workers=processes, mp_context=get_context('spawn'))
+    try:
+        for chunk in _chunks(items, chunk_size):
+            total += len(chunk)
+            if pool:
+                # One sub-batch per process, so each embeds its share in one pass
+                size = -(-len(chunk) // processes)
+                extracted = chain.from_iterable(pool.map(_extract_batch, _chunks(chunk, size)))
+            else:
+                extracted = _extract_batch(chunk)
+
+            rows = []
+            for source, name, blob, error in extracted:
+                if error is not None:
+                    failed.append({"entry": source, "name": name, "error": error})
+                else:
+                    rows.append((name, blob, FEATURE_FORMAT))
+
+            try:
+                version = add_faces(rows)
+            except Exception as e:
+                failed.extend({"entry": None, "name": name, "error": f"Database error: {str(e)}"} for name, _, _ in rows)
+                continue
+
+            if update_gallery:
+                # Each name gets its stored templates back, after the cap has been applied
+                refresh_gallery_faces(dict.fromkeys(name for name, _, _ in rows))
+                if rows:
+                    note_gallery_versions(version - len(rows) + 1, version)
+            registered += len(rows)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return {
+        "message": f"Registered {registered} of {total} image(s)",
+        "total": total,
+        "registered": registered,
+        "failed": failed,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
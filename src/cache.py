@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from .gallery import FACE_SIZE
+from .metrics import CACHE_REQUESTS
+
+# Probe result cache settings. Cameras resend identical frames, so
+# recognition results are kept for a short while under a byte budget.
+# SIGHTLINE_PROBE_CACHE_MB=0 turns the cache off.
+PROBE_CACHE_MB = float(os.environ.get('SIGHTLINE_PROBE_CACHE_MB', 16))
+PROBE_CACHE_TTL_SECONDS = float(os.environ.get('SIGHTLINE_PROBE_CACHE_TTL_SECONDS', 30))
+
+# Also reuse results for near-duplicate frames whose face crop has the same
+# perceptual hash (detection still runs, scoring is skipped)
+PROBE_CACHE_PHASH = os.environ.get('SIGHTLINE_PROBE_CACHE_PHASH', '0') == '1'
+
+# Rough per-entry bookkeeping cost on top of the stored result
+ENTRY_OVERHEAD_BYTES = 256
+
+# Perceptual hash grid over the face crop (10x10 block means)
+HASH_GRID = 10
+
+
+def average_hash(face_region):
+    """Perceptual hash of a face crop: which 10x10 blocks are brighter than the median"""
+    block = FACE_SIZE[0] // HASH_GRID
+    face = np.asarray(face_region, dtype=np.float32).reshape(HASH_GRID, block, HASH_GRID, block)
+    means = face.mean(axis=(1, 3))
+    return np.packbits(means > np.median(means)).tobytes().hex()
+
+
+class ProbeCache:
+    """LRU cache of JSON-encoded recognition results with a TTL and a byte budget"""
+
+    def __init__(self, max_bytes=int(PROBE_CACHE_MB * 1024 * 1024), ttl=PROBE_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._generation = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, key, cache='probe'):
+        """Return a fresh copy of the cached result for key, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            CACHE_REQUESTS.inc(cache, 'miss')
+            return None
+        CACHE_REQUESTS.inc(cache, 'hit')
+        return json.loads(entry[0])
+
+    def put(self, key, result, generation):
+        """Store result unless the gallery changed since generation was read"""
+        encoded = json.dumps(result)
+        size = len(encoded) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (encoded, time.monotonic() + self.ttl, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def invalidate(self):
+        """Forget every result (called whenever the gallery changes)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._generation += 1
+            self._invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "perceptual_hash": PROBE_CACHE_PHASH,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+                "requests": {
+                    cache: {"hits": CACHE_REQUESTS.value(cache, 'hit'), "misses": CACHE_REQUESTS.value(cache, 'miss')}
+                    for cache in ('probe', 'probe_phash')
+                }
+            }
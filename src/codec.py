@@ -0,0 +1,106 @@
+import json
+import struct
+import numpy as np
+from .db import connection
+
+# image_format tags stored alongside each row
+LEGACY_FORMAT = 'features'      # JSON lists, as written by older releases
+FEATURE_FORMAT = 'features_bin'  # Versioned binary layout below
+
+# Binary layout, little endian:
+#   header     magic, version, crop height, crop width, histogram bins,
+#              face box (x, y, w, h), embedding size
+#   crop       height * width uint8 values
+#   hist       bins float32 values
+#   embedding  embedding size float32 values (version 2 only)
+# The header is padded to 32 bytes so the histogram stays 4-byte aligned
+# for the 100x100 crop, letting np.frombuffer read every array in place.
+# Version 1 records have no embedding and zeros where its size now sits.
+MAGIC = b'SLFB'
+VERSION = 2
+_HEADER = struct.Struct('<4sHHHHiiiiH2x')
+
+
+def encode_features(features):
+    """Serialize extracted face features into the binary storage format"""
+    face = np.ascontiguousarray(features['face_region'], dtype=np.uint8)
+    hist = np.ascontiguousarray(features['histogram'], dtype='<f4').ravel()
+    x, y, w, h = (int(v) for v in features['face_box'])
+    embedding = features.get('embedding')
+    if embedding is None:
+        header = _HEADER.pack(MAGIC, 1, face.shape[0], face.shape[1], hist.size, x, y, w, h, 0)
+        return b''.join((header, face.tobytes(), hist.tobytes()))
+    embedding = np.ascontiguousarray(embedding, dtype='<f4').ravel()
+    header = _HEADER.pack(MAGIC, VERSION, face.shape[0], face.shape[1], hist.size, x, y, w, h, embedding.size)
+    return b''.join((header, face.tobytes(), hist.tobytes(), embedding.tobytes()))
+
+
+def _decode_binary(blob):
+    magic, version, height, width, bins, x, y, w, h, dim = _HEADER.unpack_from(blob, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a binary feature record')
+    if version not in (1, VERSION):
+        raise ValueError(f'Unsupported feature record version {version}')
+
+    offset = _HEADER.size
+    face = np.frombuffer(blob, dtype=np.uint8, count=height * width, offset=offset)
+    offset += height * width
+    hist = np.frombuffer(blob, dtype='<f4', count=bins, offset=offset)
+    features = {
+        'face_region': face.reshape(height, width),
+        'histogram': hist,
+        'face_box': (x, y, w, h)
+    }
+    if version > 1 and dim:
+        offset += bins * 4
+        features['embedding'] = np.frombuffer(blob, dtype='<f4', count=dim, offset=offset)
+    return features
+
+
+def _decode_json(blob):
+    stored_data = json.loads(bytes(blob).decode('utf-8'))
+    return {
+        'face_region': np.array(stored_data['face_region'], dtype=np.uint8),
+        'histogram': np.array(stored_data['histogram'], dtype=np.float32),
+        'face_box': tuple(stored_data['face_box'])
+    }
+
+
+def decode_features(blob, image_format):
+    """Deserialize a stored feature row; binary rows are read without copying"""
+    if image_format == FEATURE_FORMAT:
+        return _decode_binary(blob)
+    if image_format == LEGACY_FORMAT:
+        return _decode_json(blob)
+    raise ValueError(f'Unsupported image format: {image_format}')
+
+
+def is_feature_format(image_format):
+    return image_format in (FEATURE_FORMAT, LEGACY_FORMAT)
+
+
+def migrate_legacy_features():
+    """Rewrite every JSON feature template in the binary format in one transaction; returns how many"""
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT id, image_data FROM face_templates WHERE image_format = ?', (LEGACY_FORMAT,))
+        rows = c.fetchall()
+    if not rows:
+        return 0
+
+    converted = []
+    for template_id, image_data in rows:
+        try:
+            converted.append((encode_features(_decode_json(image_data)), FEATURE_FORMAT, template_id))
+        except Exception as e:
+            print(f"Error converting stored template {template_id}: {str(e)}")
+
+    with connection() as conn:
+        with conn:
+            conn.executemany('UPDATE face_templates SET image_data = ?, image_format = ? WHERE id = ?', converted)
+    print(f"Migrated {len(converted)} of {len(rows)} legacy feature rows")
+    return len(converted)
+
+
+if __name__ == "__main__":
+    migrate_legacy_features()
@@ -1,82 +1,384 @@
 import sqlite3
 import os
+import threading
+import time
+from contextlib import contextmanager
 
-# Use in-memory database for Render deployment to avoid filesystem issues
-DB_PATH = ':memory:'  # In-memory database for cloud deployment
+# SQLite file holding the registered faces. Set SIGHTLINE_DB_PATH=':memory:'
+# for a throwaway database (tests, local experiments).
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'faces.db')
+DB_PATH = os.environ.get('SIGHTLINE_DB_PATH', DEFAULT_DB_PATH)
 
-# Global connection to keep in-memory database alive
-_conn = None
+# Seconds a writer waits on a locked database before failing
+DB_BUSY_TIMEOUT = float(os.environ.get('SIGHTLINE_DB_BUSY_TIMEOUT', 5.0))
 
-def get_connection():
-    global _conn
-    if _conn is None:
-        _conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        # Enable WAL mode for better concurrent access
-        _conn.execute('PRAGMA journal_mode=WAL')
-        # Initialize table
-        c = _conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS faces (
-            name TEXT PRIMARY KEY,
-            image_data BLOB NOT NULL,
-            image_format TEXT NOT NULL DEFAULT 'jpg'
-        )''')
-        _conn.commit()
-        print("Database initialized successfully")
+# File databases get one connection per thread (WAL lets readers run
+# alongside the writer). An in-memory database only exists inside its
+# connection, so that one is shared and serialized with a lock.
+_local = threading.local()
+_shared_conn = None
+_shared_lock = threading.RLock()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+def is_memory_db():
+    return DB_PATH == ':memory:'
+
+# Templates kept per identity. Registering past the cap drops the
+# identity's oldest template (0 = no cap).
+MAX_TEMPLATES = int(os.environ.get('SIGHTLINE_MAX_TEMPLATES', 5))
+
+# Every write to an identity (one of its templates added, its templates
+# replaced, the identity deleted) takes the next version from one counter
+# shared with the tombstones of deleted faces, so get_face_changes(since_version)
+# can hand caches exactly the identities that changed after they last looked.
+def _create_schema(conn):
+    c = conn.cursor()
+    c.execute('BEGIN IMMEDIATE')
+    # Older releases kept one image per name directly in faces
+    columns = {row[1] for row in c.execute('PRAGMA table_info(faces)')}
+    single_template = 'image_data' in columns
+    if single_template:
+        c.execute('ALTER TABLE faces RENAME TO faces_single')
+        c.execute('DROP INDEX IF EXISTS faces_version')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS faces (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        version INTEGER NOT NULL,
+        created_at REAL,
+        updated_at REAL
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS faces_version ON faces (version)')
+    c.execute('''CREATE TABLE IF NOT EXISTS face_templates (
+        id INTEGER PRIMARY KEY,
+        face_id INTEGER NOT NULL REFERENCES faces (id),
+        image_data BLOB NOT NULL,
+        image_format TEXT NOT NULL DEFAULT 'jpg',
+        created_at REAL
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS face_templates_face ON face_templates (face_id, id)')
+    c.execute('''CREATE TABLE IF NOT EXISTS face_tombstones (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        deleted_at REAL NOT NULL
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS face_tombstones_version ON face_tombstones (version)')
     
-    return _conn
+    if single_template:
+        # Each old row becomes an identity (same rowid, also its version) with one template
+        c.execute('''INSERT INTO faces (id, name, version)
+            SELECT rowid, name, rowid FROM faces_single''')
+        c.execute('''INSERT INTO face_templates (face_id, image_data, image_format)
+            SELECT rowid, image_data, image_format FROM faces_single ORDER BY rowid''')
+        c.execute('DROP TABLE faces_single')
+        print(f"Moved {c.execute('SELECT COUNT(*) FROM faces').fetchone()[0]} face(s) to the templates table")
+    conn.commit()
+
+def _open_connection():
+    if not is_memory_db():
+        os.makedirs(os.path.dirname(os.path.abspath(DB_PATH)), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=DB_BUSY_TIMEOUT)
+    if not is_memory_db():
+        # WAL only applies to file databases; NORMAL sync is durable in WAL mode
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def get_connection():
+    """Return the calling thread's connection, opening it on first use"""
+    global _shared_conn, _schema_ready
+    if is_memory_db():
+        with _shared_lock:
+            if _shared_conn is None:
+                _shared_conn = _open_connection()
+                _create_schema(_shared_conn)
+                print("Database initialized successfully (in-memory)")
+        return _shared_conn
+
+    # Connections are not carried across fork (gunicorn --preload)
+    pid = os.getpid()
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != pid:
+        conn = _open_connection()
+        _local.conn, _local.pid = conn, pid
+        if not _schema_ready:
+            with _schema_lock:
+                if not _schema_ready:
+                    _create_schema(conn)
+                    _schema_ready = True
+                    print(f"Database initialized successfully ({DB_PATH})")
+    return conn
+
+@contextmanager
+def connection():
+    """Yield a connection, serializing access when it is the shared in-memory one"""
+    conn = get_connection()
+    if is_memory_db():
+        with _shared_lock:
+            yield conn
+    else:
+        yield conn
+
+@contextmanager
+def write_transaction():
+    """Yield a connection inside BEGIN IMMEDIATE, so versions are handed out one writer at a time"""
+    with connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+def _last_version(conn):
+    return conn.execute('''SELECT MAX(version) FROM (
+        SELECT MAX(version) AS version FROM faces UNION ALL SELECT MAX(version) FROM face_tombstones
+    )''').fetchone()[0] or 0
+
+def _touch_identities(conn, versions, now):
+    """Create or re-version the identity of each (name, version), the last one listed winning; returns {name: id}"""
+    conn.executemany('''INSERT INTO faces (name, version, created_at, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET version = excluded.version, updated_at = excluded.updated_at''',
+                     [(name, version, now, now) for name, version in versions])
+    names = list(dict.fromkeys(name for name, _ in versions))
+    conn.executemany('DELETE FROM face_tombstones WHERE name = ?', [(name,) for name in names])
+    face_ids = {}
+    for start in range(0, len(names), _IN_BATCH):
+        batch = names[start:start + _IN_BATCH]
+        face_ids.update(conn.execute(f'''SELECT name, id FROM faces
+            WHERE name IN ({', '.join('?' * len(batch))})''', batch))
+    return face_ids
+
+def _touch_identity(conn, name, version, now):
+    """Create name's identity or give it a new version; returns its id"""
+    return _touch_identities(conn, [(name, version)], now)[name]
+
+def _insert_templates(conn, rows, now):
+    """Add (face_id, image_data, image_format) templates, then apply MAX_TEMPLATES once per identity"""
+    conn.executemany('INSERT INTO face_templates (face_id, image_data, image_format, created_at) VALUES (?, ?, ?, ?)',
+                     [(face_id, image_data, image_format, now) for face_id, image_data, image_format in rows])
+    if MAX_TEMPLATES > 0:
+        conn.executemany('''DELETE FROM face_templates WHERE face_id = ? AND id NOT IN (
+            SELECT id FROM face_templates WHERE face_id = ? ORDER BY id DESC LIMIT ?)''',
+                         [(face_id, face_id, MAX_TEMPLATES) for face_id in dict.fromkeys(row[0] for row in rows)])
+
+def _write_faces(conn, rows):
+    """Add (name, image_data, image_format) templates with consecutive versions; returns the last one"""
+    first = _last_version(conn) + 1
+    now = time.time()
+    face_ids = _touch_identities(conn, [(name, first + i) for i, (name, _, _) in enumerate(rows)], now)
+    _insert_templates(conn, [(face_ids[name], image_data, image_format) for name, image_data, image_format in rows], now)
+    return first + len(rows) - 1
 
 # Initialize database and create table if not exists
 def init_db():
     get_connection()  # This will create the table
 
-# Add a face to the database (store image as BLOB)
+# Add a face template to the database (store image as BLOB)
 def add_face(name, image_data, image_format='jpg'):
+    """Add a template to name (registering it if new), returning the version of the change"""
     try:
-        conn = get_connection()
-        c = conn.cursor()
-        c.execute('REPLACE INTO faces (name, image_data, image_format) VALUES (?, ?, ?)', 
-                  (name, image_data, image_format))
-        conn.commit()
+        with write_transaction() as conn:
+            version = _write_faces(conn, [(name, image_data, image_format)])
         print(f"Successfully added face: {name}")
+        return version
     except Exception as e:
         print(f"Error adding face {name}: {str(e)}")
         raise
 
+# Add many face templates in one transaction (bulk enrollment)
+def add_faces(rows):
+    """Add (name, image_data, image_format) rows as templates at consecutive versions; returns the last (0 if none)"""
+    rows = list(rows)
+    if not rows:
+        return 0
+    try:
+        with write_transaction() as conn:
+            version = _write_faces(conn, rows)
+        print(f"Successfully added {len(rows)} faces")
+        return version
+    except Exception as e:
+        print(f"Error adding {len(rows)} faces: {str(e)}")
+        raise
+
+# Replace every template of a face (updates and compaction)
+def replace_face_templates(name, templates):
+    """templates: list of (image_data, image_format). Returns the version of the change"""
+    try:
+        with write_transaction() as conn:
+            version = _last_version(conn) + 1
+            now = time.time()
+            face_id = _touch_identity(conn, name, version, now)
+            conn.execute('DELETE FROM face_templates WHERE face_id = ?', (face_id,))
+            _insert_templates(conn, [(face_id, image_data, image_format) for image_data, image_format in templates], now)
+        print(f"Successfully replaced {len(templates)} template(s) of face: {name}")
+        return version
+    except Exception as e:
+        print(f"Error replacing templates of face {name}: {str(e)}")
+        raise
+
+# Replace the templates of many faces in one transaction (snapshot import)
+def replace_faces(faces):
+    """Replace the templates of (name, [(image_data, image_format), ...]) faces at consecutive versions; returns the last"""
+    faces = list(faces)
+    if not faces:
+        return 0
+    try:
+        with write_transaction() as conn:
+            version = _last_version(conn)
+            now = time.time()
+            for name, templates in faces:
+                version += 1
+                face_id = _touch_identity(conn, name, version, now)
+                conn.execute('DELETE FROM face_templates WHERE face_id = ?', (face_id,))
+                _insert_templates(conn, [(face_id, image_data, image_format) for image_data, image_format in templates],
+                                  now)
+        print(f"Successfully replaced the templates of {len(faces)} faces")
+        return version
+    except Exception as e:
+        print(f"Error replacing the templates of {len(faces)} faces: {str(e)}")
+        raise
+
+# Rewrite stored templates in place (format migrations, embedding backfill)
+def update_templates(rows):
+    """rows: iterable of (template_id, image_data, image_format). No new versions are taken"""
+    with connection() as conn:
+        with conn:
+            conn.executemany('UPDATE face_templates SET image_data = ?, image_format = ? WHERE id = ?',
+                             [(image_data, image_format, template_id) for template_id, image_data, image_format in rows])
+
+# Delete a face and its templates, leaving a tombstone for the change feed
+def delete_face(name):
+    """Returns the version of the deletion, or None if name wasn't registered"""
+    try:
+        with write_transaction() as conn:
+            # Taken before the delete, which may remove the current maximum
+            version = _last_version(conn) + 1
+            row = conn.execute('SELECT id FROM faces WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('DELETE FROM face_templates WHERE face_id = ?', row)
+            conn.execute('DELETE FROM faces WHERE id = ?', row)
+            conn.execute('REPLACE INTO face_tombstones (name, version, deleted_at) VALUES (?, ?, ?)',
+                         (name, version, time.time()))
+        print(f"Successfully deleted face: {name}")
+        return version
+    except Exception as e:
+        print(f"Error deleting face {name}: {str(e)}")
+        raise
+
+# Latest version written to the faces table (0 for an empty database)
+def get_version():
+    with connection() as conn:
+        return _last_version(conn)
+
+# Largest number of bound parameters put in one IN (...) list
+_IN_BATCH = 500
+
+# Faces changed since a version (incremental cache and index updates)
+def get_face_changes(since_version=0, limit=None, with_data=True):
+    """Return the latest (version, name, templates) of each identity written after since_version, oldest first"""
+    query = '''SELECT version, id, name FROM faces WHERE version > ?
+        UNION ALL SELECT version, NULL, name FROM face_tombstones WHERE version > ?
+        ORDER BY version'''
+    params = (since_version, since_version)
+    if limit is not None:
+        query += ' LIMIT ?'
+        params += (limit,)
+    templates = {}
+    with connection() as conn:
+        changes = conn.execute(query, params).fetchall()
+        face_ids = [face_id for _, face_id, _ in changes if face_id is not None]
+        for start in range(0, len(face_ids) if with_data else 0, _IN_BATCH):
+            batch = face_ids[start:start + _IN_BATCH]
+            rows = conn.execute(f'''SELECT face_id, image_data, image_format FROM face_templates
+                WHERE face_id IN ({', '.join('?' * len(batch))}) ORDER BY id''', batch)
+            for face_id, image_data, image_format in rows:
+                templates.setdefault(face_id, []).append((image_data, image_format))
+    # templates is None for a deleted face, and empty for every face with with_data=False
+    return [(version, name, None if face_id is None else templates.get(face_id, []))
+            for version, face_id, name in changes]
+
 # Get all faces from the database
 def get_all_faces():
     try:
-        conn = get_connection()
-        c = conn.cursor()
-        c.execute('SELECT name FROM faces')
-        faces = c.fetchall()
+        with connection() as conn:
+            c = conn.cursor()
+            c.execute('SELECT name FROM faces')
+            faces = c.fetchall()
         return [face[0] for face in faces]
     except Exception as e:
         print(f"Error getting all faces: {str(e)}")
         return []
 
-# Get face image data by name
+# Count registered identities
+def count_faces():
+    with connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM faces').fetchone()[0]
+
+# Count stored templates across every identity (used to size the gallery on warm start)
+def count_templates():
+    with connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM face_templates').fetchone()[0]
+
+# Get the latest template of a face by name
 def get_face_data(name):
     try:
-        conn = get_connection()
-        c = conn.cursor()
-        c.execute('SELECT image_data, image_format FROM faces WHERE name = ?', (name,))
-        result = c.fetchone()
+        with connection() as conn:
+            c = conn.cursor()
+            c.execute('''SELECT t.image_data, t.image_format FROM face_templates t JOIN faces f ON f.id = t.face_id
+                WHERE f.name = ? ORDER BY t.id DESC LIMIT 1''', (name,))
+            result = c.fetchone()
         return result if result else None
     except Exception as e:
         print(f"Error getting face data for {name}: {str(e)}")
         return None
 
-# Get all face data (for recognition)
+# Get every template of a face, oldest first
+def get_face_templates(name):
+    """Returns a list of (template_id, image_data, image_format), empty for unknown names"""
+    with connection() as conn:
+        return conn.execute('''SELECT t.id, t.image_data, t.image_format FROM face_templates t
+            JOIN faces f ON f.id = t.face_id WHERE f.name = ? ORDER BY t.id''', (name,)).fetchall()
+
+# Get templates by id (batched rewrites of selected templates)
+def get_templates(template_ids):
+    """Returns (template_id, image_data, image_format) for the ids that still exist"""
+    rows = []
+    with connection() as conn:
+        for start in range(0, len(template_ids), _IN_BATCH):
+            batch = list(template_ids[start:start + _IN_BATCH])
+            rows += conn.execute(f'''SELECT id, image_data, image_format FROM face_templates
+                WHERE id IN ({', '.join('?' * len(batch))})''', batch).fetchall()
+    return rows
+
+# Get all face data (for recognition), one row per template
 def get_all_face_data():
     try:
-        conn = get_connection()
-        c = conn.cursor()
-        c.execute('SELECT name, image_data, image_format FROM faces')
-        return c.fetchall()
+        with connection() as conn:
+            c = conn.cursor()
+            c.execute('''SELECT f.name, t.image_data, t.image_format FROM face_templates t
+                JOIN faces f ON f.id = t.face_id ORDER BY t.face_id, t.id''')
+            return c.fetchall()
     except Exception as e:
         print(f"Error getting all face data: {str(e)}")
         return []
 
+# Stream every template in batches (warm start without holding every BLOB at once)
+def iter_templates(batch_size=256):
+    """Yield (template_id, name, image_data, image_format), each identity's templates together"""
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('''SELECT t.id, f.name, t.image_data, t.image_format FROM face_templates t
+            JOIN faces f ON f.id = t.face_id ORDER BY t.face_id, t.id''')
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
 # Get image path for a given name (backward compatibility)
 def get_face_path(name):
     # This function is for backward compatibility
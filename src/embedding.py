@@ -0,0 +1,143 @@
+import os
+import threading
+import cv2
+import numpy as np
+from .gallery import MATCH_THRESHOLD
+from .metrics import span, CACHE_REQUESTS
+
+# Feature backend: 'histogram' scores the grayscale crop and its histogram
+# like compare_faces; 'dnn' runs a face embedding network through cv2.dnn
+# and compares embeddings by cosine similarity
+EMBEDDING_BACKEND = os.environ.get('SIGHTLINE_EMBEDDING_BACKEND', 'histogram')
+
+# DNN backend settings. The defaults suit OpenCV's SFace model
+# (face_recognition_sface_2021dec.onnx); for ArcFace-style models use
+# MEAN=127.5 and SCALE=0.0078125. Set BATCH_SIZE=1 for models exported
+# with a fixed batch dimension.
+EMBEDDING_MODEL = os.environ.get('SIGHTLINE_EMBEDDING_MODEL', '')
+EMBEDDING_INPUT_SIZE = int(os.environ.get('SIGHTLINE_EMBEDDING_INPUT_SIZE', 112))
+EMBEDDING_MEAN = float(os.environ.get('SIGHTLINE_EMBEDDING_MEAN', 0.0))
+EMBEDDING_SCALE = float(os.environ.get('SIGHTLINE_EMBEDDING_SCALE', 1.0))
+EMBEDDING_SWAP_RB = os.environ.get('SIGHTLINE_EMBEDDING_SWAP_RB', '1') == '1'
+EMBEDDING_THRESHOLD = float(os.environ.get('SIGHTLINE_EMBEDDING_THRESHOLD', 0.363))
+EMBEDDING_BATCH_SIZE = int(os.environ.get('SIGHTLINE_EMBEDDING_BATCH_SIZE', 32))
+
+
+class HistogramExtractor:
+    """Default backend: no embedding, rows are scored on the crop and its histogram"""
+
+    name = 'histogram'
+    dim = 0
+    match_threshold = MATCH_THRESHOLD
+
+    def warm(self):
+        pass
+
+    def prepare(self, crop):
+        return None
+
+    def embed(self, inputs):
+        return np.empty((len(inputs), 0), dtype=np.float32)
+
+    def stats(self):
+        return {"backend": self.name, "dim": self.dim, "match_threshold": self.match_threshold}
+
+
+class DNNExtractor:
+    """L2-normalized face embeddings from a cv2.dnn network, loaded once per thread and run in batches"""
+
+    name = 'dnn'
+    match_threshold = EMBEDDING_THRESHOLD
+
+    def __init__(self, model=EMBEDDING_MODEL, input_size=EMBEDDING_INPUT_SIZE, batch_size=EMBEDDING_BATCH_SIZE):
+        if not model or not os.path.exists(model):
+            raise RuntimeError(f"Embedding model not found: '{model}' (set SIGHTLINE_EMBEDDING_MODEL)")
+        self.model = model
+        self.input_size = input_size
+        self.batch_size = max(1, batch_size)
+        self._local = threading.local()
+        # Run one blank crop through the network to learn the embedding size
+        self.dim = 0
+        self.dim = self.embed([np.zeros((input_size, input_size, 3), dtype=np.uint8)]).shape[1]
+
+    def _net(self):
+        net = getattr(self._local, 'net', None)
+        if net is not None:
+            CACHE_REQUESTS.inc('embedding_net', 'hit')
+            return net
+        CACHE_REQUESTS.inc('embedding_net', 'miss')
+        net = cv2.dnn.readNet(self.model)
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self._local.net = net
+        return net
+
+    def warm(self):
+        """Load this thread's copy of the network"""
+        self._net()
+
+    def prepare(self, crop):
+        """Resize a face crop (BGR or grayscale) to the network input"""
+        if crop.ndim == 2:
+            crop = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR)
+        elif crop.shape[2] == 4:
+            crop = cv2.cvtColor(crop, cv2.COLOR_BGRA2BGR)
+        return cv2.resize(crop, (self.input_size, self.input_size), interpolation=cv2.INTER_AREA)
+
+    def embed(self, inputs):
+        """Embed prepared crops, returning (n, dim) unit float32 rows"""
+        if not len(inputs):
+            return np.empty((0, self.dim), dtype=np.float32)
+        net = self._net()
+        size = (self.input_size, self.input_size)
+        outputs = []
+        with span('embed'):
+            for start in range(0, len(inputs), self.batch_size):
+                batch = list(inputs[start:start + self.batch_size])
+                blob = cv2.dnn.blobFromImages(batch, EMBEDDING_SCALE, size, (EMBEDDING_MEAN,) * 3,
+                                              swapRB=EMBEDDING_SWAP_RB, crop=False)
+                net.setInput(blob)
+                outputs.append(net.forward().reshape(len(batch), -1))
+        embeddings = np.vstack(outputs).astype(np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return np.divide(embeddings, norms, out=np.zeros_like(embeddings), where=norms > 0)
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "model": self.model,
+            "dim": self.dim,
+            "input_size": self.input_size,
+            "batch_size": self.batch_size,
+            "match_threshold": self.match_threshold
+        }
+
+
+EMBEDDING_BACKENDS = {backend.name: backend for backend in (HistogramExtractor, DNNExtractor)}
+
+_extractor = None
+_extractor_lock = threading.Lock()
+
+
+def get_extractor():
+    """Return the configured feature extractor, loading it once"""
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                if EMBEDDING_BACKEND not in EMBEDDING_BACKENDS:
+                    raise ValueError(f"Unknown embedding backend '{EMBEDDING_BACKEND}', "
+                                     f"expected one of {', '.join(EMBEDDING_BACKENDS)}")
+                _extractor = EMBEDDING_BACKENDS[EMBEDDING_BACKEND]()
+    return _extractor
+
+
+def embed_features(features_list):
+    """Replace each crop's 'embedding_input' with its embedding, in one batched pass"""
+    pending = [features for features in features_list if 'embedding_input' in features]
+    if not pending:
+        return features_list
+    embeddings = get_extractor().embed([features.pop('embedding_input') for features in pending])
+    for features, embedding in zip(pending, embeddings):
+        features['embedding'] = embedding
+    return features_list
@@ -0,0 +1,152 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import STAGE_SECONDS
+
+# Face work pool settings. OpenCV detection and the NumPy scoring kernels
+# release the GIL, so a small thread pool runs them in parallel while the
+# resident gallery stays shared.
+POOL_WORKERS = int(os.environ.get('SIGHTLINE_POOL_WORKERS', 2))
+POOL_QUEUE_SIZE = int(os.environ.get('SIGHTLINE_POOL_QUEUE_SIZE', 8))
+RETRY_AFTER_SECONDS = int(os.environ.get('SIGHTLINE_RETRY_AFTER_SECONDS', 1))
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the face work queue has no free slot"""
+
+
+class BoundedExecutor:
+    """Thread pool admitting at most max_workers + queue_size jobs; others get QueueFullError"""
+
+    def __init__(self, max_workers=POOL_WORKERS, queue_size=POOL_QUEUE_SIZE):
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sightline-face')
+        self._slots = threading.BoundedSemaphore(max_workers + queue_size)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+
+    def _release(self, future):
+        # A job cancelled before it started never ran its own bookkeeping
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn on the pool and return a concurrent.futures.Future"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise QueueFullError('Face processing queue is full')
+
+        submitted = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+
+        # Run in the caller's context so request-scoped timings follow the job
+        context = contextvars.copy_context()
+
+        def job():
+            wait = time.perf_counter() - submitted
+            STAGE_SECONDS.observe(wait, 'queue_wait')
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._wait_total += wait
+                self._wait_last = wait
+                self._wait_max = max(self._wait_max, wait)
+            try:
+                return context.run(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+
+        try:
+            future = self._pool.submit(job)
+        except Exception:
+            with self._lock:
+                self._queued -= 1
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def warm(self, fn, timeout=30):
+        """Run fn once on every worker thread, e.g. to load per-thread state at startup"""
+        barrier = threading.Barrier(self.max_workers)
+        
+        def job():
+            try:
+                return fn()
+            finally:
+                # Hold each thread until all have started, so every worker gets one call
+                barrier.wait(timeout)
+        
+        futures = [self._pool.submit(job) for _ in range(self.max_workers)]
+        return [future.result() for future in futures]
+
+    def map(self, fn, items):
+        """Map fn over items from inside a pool job; idle workers help, so the pool's bound still holds"""
+        items = list(items)
+        results = [None] * len(items)
+        pending = iter(range(len(items)))
+        lock = threading.Lock()
+
+        def drain():
+            while True:
+                with lock:
+                    i = next(pending, None)
+                if i is None:
+                    return
+                results[i] = fn(items[i])
+
+        helpers = []
+        for _ in range(min(len(items), self.max_workers) - 1):
+            with self._lock:
+                idle = self._queued + self._running < self.max_workers
+            if not idle:
+                break
+            try:
+                helpers.append(self.submit(drain))
+            except QueueFullError:
+                break
+        drain()
+        for helper in helpers:
+            # A helper still waiting for a thread has nothing left to do
+            if not helper.cancel():
+                helper.result()
+        return results
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn on the pool without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self):
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "workers": self.max_workers,
+                "queue_size": self.queue_size,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "last_wait_ms": round(self._wait_last * 1000, 2),
+                "avg_wait_ms": round(self._wait_total / started * 1000, 2) if started else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 2)
+            }
+
+
+# Shared pool for register/recognize work
+face_pool = BoundedExecutor()
@@ -1,30 +1,566 @@
 import os
 import cv2
 import numpy as np
-from PIL import Image
-import base64
 import hashlib
-from .db import init_db, add_face, get_all_faces, get_all_face_data
+import threading
+import time
+from .executor import face_pool
+from .db import (add_face, delete_face, replace_face_templates, replace_faces, update_templates, get_all_faces,
+                 count_faces, count_templates, get_face_data, get_face_templates, get_templates, iter_templates,
+                 is_memory_db, get_version, get_face_changes, MAX_TEMPLATES)
+from .gallery import Gallery, FeatureLayout
+from .embedding import get_extractor, embed_features, EMBEDDING_BATCH_SIZE
+from .store import SharedGallery, GALLERY_STORE
+from .index import INDEX_TYPES
+from .metrics import span, CACHE_REQUESTS
+from .cache import ProbeCache, PROBE_CACHE_PHASH, average_hash
+from .codec import FEATURE_FORMAT, encode_features, decode_features, is_feature_format, migrate_legacy_features
+from .snapshot import (read_snapshot, write_snapshot, SnapshotError, SNAPSHOT_PATH, SNAPSHOT_COMPRESS,
+                       SNAPSHOT_INTERVAL_SECONDS)
 
-# Initialize the database
-init_db()
+# Face detector settings
+CASCADE_PATH = os.environ.get(
+    'SIGHTLINE_CASCADE_PATH', cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+)
+DETECT_SCALE_FACTOR = float(os.environ.get('SIGHTLINE_DETECT_SCALE_FACTOR', 1.1))
+DETECT_MIN_NEIGHBORS = int(os.environ.get('SIGHTLINE_DETECT_MIN_NEIGHBORS', 4))
 
-def extract_face_features(image_path):
-    """Extract simple face features using OpenCV Haar cascades"""
+# Detection runs on a copy downscaled so its longest side is at most this
+# many pixels (0 = full resolution); features are still cropped from the
+# full-resolution image
+DETECT_MAX_SIDE = int(os.environ.get('SIGHTLINE_DETECT_MAX_SIDE', 1024))
+
+# Smallest and largest face to look for, in pixels of the uploaded image
+# (0 = no limit)
+DETECT_MIN_FACE = int(os.environ.get('SIGHTLINE_DETECT_MIN_FACE', 0))
+DETECT_MAX_FACE = int(os.environ.get('SIGHTLINE_DETECT_MAX_FACE', 0))
+
+# Upper bound on faces scored per image in multi-face recognition
+MAX_FACES = int(os.environ.get('SIGHTLINE_MAX_FACES', 10))
+
+# One classifier per thread, OpenCV cascades are not safe to share
+_detectors = threading.local()
+_detector_stats_lock = threading.Lock()
+DETECTOR_STATS = {
+    'cascade_path': CASCADE_PATH,
+    'startup_init_ms': None,
+    'total_init_ms': 0.0,
+    'instances': 0
+}
+
+def get_detector():
+    """Return this thread's face cascade, parsing the XML only on first use"""
+    detector = getattr(_detectors, 'cascade', None)
+    if detector is not None:
+        CACHE_REQUESTS.inc('detector', 'hit')
+    else:
+        CACHE_REQUESTS.inc('detector', 'miss')
+        start = time.perf_counter()
+        detector = cv2.CascadeClassifier(CASCADE_PATH)
+        if detector.empty():
+            raise RuntimeError(f"Failed to load face cascade from {CASCADE_PATH}")
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 2)
+        
+        with _detector_stats_lock:
+            if DETECTOR_STATS['startup_init_ms'] is None:
+                DETECTOR_STATS['startup_init_ms'] = elapsed_ms
+            DETECTOR_STATS['total_init_ms'] = round(DETECTOR_STATS['total_init_ms'] + elapsed_ms, 2)
+            DETECTOR_STATS['instances'] += 1
+        _detectors.cascade = detector
+    return detector
+
+# Per-thread scratch buffer for the grayscale conversion, reused across
+# requests instead of allocating a fresh frame-sized array each time.
+# Every pool thread keeps one, so it is capped at the detection size (1 MB
+# by default); larger images get a one-off allocation.
+GRAY_BUFFER_MAX_PIXELS = int(os.environ.get('SIGHTLINE_GRAY_BUFFER_MAX_PIXELS', (DETECT_MAX_SIDE or 1024) ** 2))
+_buffers = threading.local()
+
+def _gray_buffer(shape):
+    """Return a (height, width) uint8 view of this thread's scratch buffer"""
+    pixels = shape[0] * shape[1]
+    if pixels > GRAY_BUFFER_MAX_PIXELS:
+        return None
+    buf = getattr(_buffers, 'gray', None)
+    if buf is None or buf.size < pixels:
+        buf = _buffers.gray = np.empty(pixels, dtype=np.uint8)
+    return buf[:pixels].reshape(shape)
+
+# Recognition results for recently seen probe images
+probe_cache = ProbeCache()
+
+# Resident gallery, rebuilt from the database at startup
+_gallery = None
+_gallery_lock = threading.Lock()
+GALLERY_STATS = {'warm_start_ms': None, 'loaded_faces': 0, 'loaded_templates': 0, 'synced_changes': 0}
+
+# Seconds between polls of the database change feed, which brings in faces
+# added or deleted by other processes (other workers, the enroll CLI)
+# without reloading the gallery. 0 polls on every request and a negative
+# value turns polling off. With the shared store, the first worker to see a
+# change writes it to the store and advances its version, so the others'
+# polls come back empty.
+GALLERY_SYNC_SECONDS = float(os.environ.get('SIGHTLINE_GALLERY_SYNC_SECONDS', 1.0))
+_sync_lock = threading.Lock()
+_next_sync = 0.0
+
+# What registering a face that already has MAX_TEMPLATES templates does:
+# 'oldest' drops its oldest template, 'compact' merges the ones it has into
+# a centroid template before adding the new one
+TEMPLATE_OVERFLOW = os.environ.get('SIGHTLINE_TEMPLATE_OVERFLOW', 'oldest')
+
+# Serializes this process's template writes with the gallery updates that
+# read them back, and with change feed updates, so concurrent changes of one
+# name land in order. Take the gallery with get_gallery() before the lock.
+_templates_lock = threading.Lock()
+
+# Snapshot this worker started from and the last one it wrote.
+# source_version is the database version when it last wrote (or loaded) one.
+SNAPSHOT_STATS = {'path': SNAPSHOT_PATH or None, 'loaded': None, 'written': None, 'source_version': None}
+
+# Faces written to the database per transaction when importing a snapshot
+SNAPSHOT_IMPORT_CHUNK = 500
+
+def _load_gallery():
+    """Build the in-memory gallery from every stored feature row"""
+    start = time.perf_counter()
+    with span('gallery_load'):
+        gallery = _read_gallery()
+    
+    GALLERY_STATS['warm_start_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    GALLERY_STATS['loaded_faces'] = gallery.identities
+    GALLERY_STATS['loaded_templates'] = len(gallery)
+    print(f"Gallery loaded {len(gallery)} template(s) of {gallery.identities} face(s) "
+          f"in {GALLERY_STATS['warm_start_ms']} ms")
+    return gallery
+
+def _stored_features(embedding_dim=0):
+    """Yield (name, face_region, histogram, embedding) for every usable stored template"""
+    for _, name, feature_data, format_type in iter_templates():
+        if not is_feature_format(format_type):
+            continue  # Skip non-feature data
+        try:
+            stored = decode_features(feature_data, format_type)
+        except Exception as e:
+            print(f"Error loading stored face {name}: {str(e)}")
+            continue
+        embedding = stored.get('embedding')
+        if embedding_dim and (embedding is None or embedding.size != embedding_dim):
+            print(f"Skipping stored face {name}: no {embedding_dim}-d embedding")
+            continue
+        yield name, stored['face_region'], stored['histogram'], embedding
+
+def _backfill_embeddings(extractor):
+    """Embed stored templates that lack an embedding of the current size, from their stored crop"""
+    if not extractor.dim:
+        return 0
+    stale = []
+    for template_id, _, feature_data, format_type in iter_templates():
+        if not is_feature_format(format_type):
+            continue
+        try:
+            embedding = decode_features(feature_data, format_type).get('embedding')
+        except Exception:
+            continue
+        if embedding is None or embedding.size != extractor.dim:
+            stale.append(template_id)
+    
+    for start in range(0, len(stale), EMBEDDING_BATCH_SIZE):
+        batch = []
+        for template_id, feature_data, format_type in get_templates(stale[start:start + EMBEDDING_BATCH_SIZE]):
+            stored = dict(decode_features(feature_data, format_type))
+            stored['embedding_input'] = extractor.prepare(stored['face_region'])
+            batch.append((template_id, stored))
+        embed_features([features for _, features in batch])
+        update_templates([(template_id, encode_features(features), FEATURE_FORMAT) for template_id, features in batch])
+    if stale:
+        print(f"Embedded {len(stale)} stored template(s) with the {extractor.name} backend")
+    return len(stale)
+
+def _read_gallery():
+    # Rewrite any JSON rows left by older releases once, so loads stay zero-copy
+    migrate_legacy_features()
+    extractor = get_extractor()
+    _backfill_embeddings(extractor)
+    
+    if GALLERY_STORE and not is_memory_db():
+        if SNAPSHOT_PATH and os.path.exists(SNAPSHOT_PATH) and not count_faces():
+            # A fresh deployment gets its faces back from the snapshot first,
+            # so the store below is rebuilt from the restored rows
+            _restore_store_database(extractor)
+        # Every worker maps the same feature files; the first one to start
+        # rebuilds them if they don't match the database. A store that is
+        # only behind (written to while no worker ran) catches up from the feed.
+        gallery = SharedGallery(GALLERY_STORE, embedding_dim=extractor.dim)
+        if gallery.attach(count_templates(), get_version(), lambda: _stored_features(extractor.dim)):
+            print(f"Rebuilt shared gallery store in {GALLERY_STORE}")
+        changes = get_face_changes(gallery.version)
+        _apply_changes(gallery, gallery.version, changes)
+        if changes:
+            print(f"Caught up the shared gallery store with {len(changes)} change(s)")
+        return gallery
+    
+    if SNAPSHOT_PATH and os.path.exists(SNAPSHOT_PATH):
+        gallery = _gallery_from_snapshot(extractor)
+        if gallery is not None:
+            return gallery
+    
+    # Rows written while loading are replayed by the first sync
+    version = get_version()
+    gallery = Gallery(capacity=max(64, count_templates()), embedding_dim=extractor.dim)
+    for name, face_region, histogram, embedding in _stored_features(extractor.dim):
+        gallery.add(name, face_region, histogram, embedding)
+    gallery.advance(1, version)
+    return gallery
+
+def get_gallery():
+    """Return the resident gallery, loading it from the database once"""
+    global _gallery
+    if _gallery is None:
+        with _gallery_lock:
+            if _gallery is None:
+                _gallery = _load_gallery()
+                # Any gallery change makes cached recognition results stale
+                _gallery.subscribe(lambda row, face, hist: probe_cache.invalidate())
+    if GALLERY_SYNC_SECONDS >= 0 and time.monotonic() >= _next_sync:
+        sync_gallery()
+        if isinstance(_gallery, SharedGallery):
+            # Rows other workers applied first still invalidate cached results here
+            _gallery.refresh()
+    return _gallery
+
+def sync_gallery():
+    """Apply faces changed in the database since the gallery last saw them; returns how many"""
+    global _next_sync
+    if not _sync_lock.acquire(blocking=False):
+        return 0
+    try:
+        _next_sync = time.monotonic() + GALLERY_SYNC_SECONDS
+        since = _gallery.version
+        changes = get_face_changes(since)
+        _apply_changes(_gallery, since, changes)
+        GALLERY_STATS['synced_changes'] += len(changes)
+        return len(changes)
+    finally:
+        _sync_lock.release()
+
+def _apply_changes(gallery, since, changes):
+    """Apply change feed rows read after version since to gallery, advancing its version behind them"""
+    for version, name, templates in changes:
+        with _templates_lock:
+            if templates is None:
+                gallery.remove(name, version)
+            else:
+                try:
+                    gallery.set_templates(name, _gallery_templates(name, templates), version)
+                except Exception as e:
+                    print(f"Error applying change to stored face {name}: {str(e)}")
+        gallery.advance(since + 1, version)
+
+def note_gallery_versions(first, last):
+    """Record database versions first..last as applied, if first follows the gallery's version"""
+    get_gallery().advance(first, last)
+
+def _decode_templates(name, templates):
+    """Decode stored (image_data, image_format) templates, skipping rows that aren't features"""
+    decoded = []
+    for feature_data, format_type in templates:
+        if not is_feature_format(format_type):
+            continue
+        try:
+            decoded.append(decode_features(feature_data, format_type))
+        except Exception as e:
+            print(f"Error loading stored template of {name}: {str(e)}")
+    return decoded
+
+def _gallery_templates(name, templates):
+    """Stored templates as (face_region, histogram, embedding) tuples for Gallery.set_templates"""
+    return [(stored['face_region'], stored['histogram'], stored.get('embedding'))
+            for stored in _decode_templates(name, templates)]
+
+def _stored_templates(name):
+    return [(feature_data, format_type) for _, feature_data, format_type in get_face_templates(name)]
+
+def refresh_gallery_faces(names):
+    """Load the stored templates of names into the gallery, after this process wrote them"""
+    gallery = get_gallery()
+    for name in names:
+        with _templates_lock:
+            # Read first: the templates are at least this new
+            version = get_version()
+            gallery.set_templates(name, _gallery_templates(name, _stored_templates(name)), version)
+
+def _snapshot_faces(snapshot):
+    """A snapshot's rows as (name, [(encoded features, format), ...]) in first-appearance order"""
+    if snapshot.layout != FeatureLayout(100, 32):
+        raise SnapshotError("Only snapshots of full-size rows can be written back to the database")
+    faces = {}
+    for row, name in enumerate(snapshot.names):
+        features = {
+            'face_region': snapshot.faces[row].reshape(snapshot.layout.face_shape),
+            'histogram': snapshot.histograms[row],
+            'face_box': (0, 0, 0, 0)
+        }
+        if snapshot.embedding_dim:
+            features['embedding'] = snapshot.embeddings[row]
+        faces.setdefault(name, []).append((encode_features(features), FEATURE_FORMAT))
+    return list(faces.items())
+
+def _restore_snapshot(snapshot):
+    """Replace the stored templates of every face in a snapshot with its rows; returns (first, last) version"""
+    faces = _snapshot_faces(snapshot)
+    first, last = None, 0
+    for start in range(0, len(faces), SNAPSHOT_IMPORT_CHUNK):
+        chunk = faces[start:start + SNAPSHOT_IMPORT_CHUNK]
+        last = replace_faces(chunk)
+        if first is None:
+            first = last - len(chunk) + 1
+    return first, last
+
+def _read_snapshot_file(extractor):
+    """SNAPSHOT_PATH, read for this worker's embedding backend; None (saying why) when it can't be used"""
+    try:
+        snapshot = read_snapshot(SNAPSHOT_PATH)
+    except (OSError, SnapshotError) as e:
+        print(f"Ignoring gallery snapshot {SNAPSHOT_PATH}: {str(e)}")
+        return None
+    if snapshot.embedding_dim != extractor.dim:
+        print(f"Ignoring gallery snapshot {SNAPSHOT_PATH}: written for another embedding size")
+        return None
+    return snapshot
+
+def _restore_database(snapshot):
+    """Give an empty database a snapshot's faces back; returns the version after them, None when it failed"""
     try:
-        # Read image
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError('Image not found or unreadable')
+        return _restore_snapshot(snapshot)[1]
+    except Exception as e:
+        print(f"Could not restore faces from gallery snapshot {SNAPSHOT_PATH}: {str(e)}")
+        return None
+
+def _restore_store_database(extractor):
+    """Restore an empty database's faces from SNAPSHOT_PATH before the shared store is built from it"""
+    start = time.perf_counter()
+    snapshot = _read_snapshot_file(extractor)
+    if snapshot is None or not len(snapshot) or _restore_database(snapshot) is None:
+        return
+    SNAPSHOT_STATS['loaded'] = {
+        **snapshot.stats(),
+        "restored": True,
+        "caught_up_changes": 0,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
+    SNAPSHOT_STATS['source_version'] = get_version()
+    print(f"Restored {len(snapshot)} template(s) from gallery snapshot {SNAPSHOT_PATH} "
+          f"in {SNAPSHOT_STATS['loaded']['elapsed_ms']} ms")
+
+def _gallery_from_snapshot(extractor):
+    """Map the gallery from SNAPSHOT_PATH and catch it up from the change feed; None when it doesn't match the database"""
+    start = time.perf_counter()
+    snapshot = _read_snapshot_file(extractor)
+    if snapshot is None:
+        return None
+    layout = FeatureLayout()
+    if snapshot.layout != layout:
+        print(f"Ignoring gallery snapshot {SNAPSHOT_PATH}: written for another row layout")
+        return None
+    
+    since = snapshot.version
+    restored = False
+    # An empty (fresh or in-memory) database gets the snapshot's templates back
+    if len(snapshot) and not count_faces():
+        since = _restore_database(snapshot)
+        if since is None:
+            return None
+        restored = True
+    elif get_version() < snapshot.version:
+        print(f"Ignoring gallery snapshot {SNAPSHOT_PATH}: newer than the database")
+        return None
+    
+    gallery = Gallery(embedding_dim=extractor.dim, layout=layout)
+    gallery.adopt(snapshot.names, snapshot.faces, snapshot.histograms, snapshot.embeddings)
+    gallery.advance(1, since)
+    changes = get_face_changes(since)
+    _apply_changes(gallery, since, changes)
+    if gallery.identities != count_faces() or (restored and len(gallery) != count_templates()):
+        print(f"Ignoring gallery snapshot {SNAPSHOT_PATH}: it doesn't match the database")
+        return None
+    
+    SNAPSHOT_STATS['loaded'] = {
+        **snapshot.stats(),
+        "restored": restored,
+        "caught_up_changes": len(changes),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
+    SNAPSHOT_STATS['source_version'] = get_version()
+    print(f"Gallery mapped from snapshot {SNAPSHOT_PATH} ({len(snapshot)} rows, "
+          f"{len(changes)} change(s) since) in {SNAPSHOT_STATS['loaded']['elapsed_ms']} ms")
+    return gallery
+
+# Write the resident gallery to a snapshot file
+def export_snapshot(path=None, compress=None):
+    """Write the resident gallery's rows, names and database version to path (default SNAPSHOT_PATH)"""
+    path = path or SNAPSHOT_PATH
+    if not path:
+        raise ValueError("No snapshot path given and SIGHTLINE_SNAPSHOT_PATH is not set")
+    compress = SNAPSHOT_COMPRESS if compress is None else compress
+    gallery = get_gallery()
+    source_version = get_version()
+    # Read before the rows: every change the rows might be missing (or
+    # caught mid-write) has a later version, so loading replays it
+    version = gallery.version
+    with span('snapshot_write'):
+        result = gallery.read(lambda names, faces, hists, embeddings, _: write_snapshot(
+            path, names, faces, hists, embeddings, gallery.layout, version, compress))
+    SNAPSHOT_STATS['written'] = {**result, "created_at": time.time()}
+    SNAPSHOT_STATS['source_version'] = source_version
+    return result
+
+def snapshot_if_changed():
+    """Write SNAPSHOT_PATH if the database moved and no other worker rewrote it this interval"""
+    if get_version() == SNAPSHOT_STATS['source_version']:
+        return None
+    try:
+        if time.time() - os.path.getmtime(SNAPSHOT_PATH) < SNAPSHOT_INTERVAL_SECONDS:
+            return None
+    except FileNotFoundError:
+        pass
+    return export_snapshot()
+
+# Restore faces from a snapshot file into the database and the gallery
+def import_snapshot(source):
+    """Replace the templates of every face in the snapshot (a path or seekable file) with its rows"""
+    start = time.perf_counter()
+    snapshot = read_snapshot(source)
+    extractor = get_extractor()
+    if snapshot.embedding_dim != extractor.dim:
+        raise SnapshotError(f"Snapshot has {snapshot.embedding_dim}-d embeddings, the {extractor.name} backend uses {extractor.dim}")
+    with span('snapshot_import'):
+        first, last = _restore_snapshot(snapshot)
+    names = list(dict.fromkeys(snapshot.names))
+    refresh_gallery_faces(names)
+    if names:
+        note_gallery_versions(first, last)
+    return {
+        "message": f"Imported {len(snapshot)} template(s) of {len(names)} face(s)",
+        "faces": len(names),
+        "templates": len(snapshot),
+        "version": last,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
+
+# Search indexes over the gallery, created on first use of each mode
+INDEX_MODE = os.environ.get('SIGHTLINE_INDEX_MODE', 'exact')
+SEARCH_MODES = tuple(INDEX_TYPES)
+_indexes = {}
+
+def get_index(mode=None):
+    """Return the search index for mode ('exact' or 'ivf')"""
+    mode = mode or INDEX_MODE
+    if mode not in INDEX_TYPES:
+        raise ValueError(f"Unknown search mode '{mode}', expected one of {', '.join(SEARCH_MODES)}")
+    index = _indexes.get(mode)
+    if index is None:
+        gallery = get_gallery()
+        with _gallery_lock:
+            index = _indexes.get(mode)
+            if index is None:
+                index = _indexes[mode] = INDEX_TYPES[mode](gallery)
+    return index
+
+def load_image(image):
+    """Decode an image given as a file path, encoded bytes or an ndarray"""
+    if isinstance(image, np.ndarray):
+        if image.ndim == 1:
+            # Encoded file contents already wrapped in an array
+            return cv2.imdecode(image, cv2.IMREAD_COLOR)
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return cv2.imread(os.fspath(image))
+
+def _load_gray(image):
+    """Decode an image input and return (gray, decoded); gray may be this thread's scratch buffer"""
+    with span('decode'):
+        img = load_image(image)
+    if img is None or img.size == 0:
+        raise ValueError('Image not found or unreadable')
+    if img.ndim == 2:
+        return img, img
+    with span('grayscale'):
+        code = cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        dst = _gray_buffer(img.shape[:2])
+        if dst is None:
+            return cv2.cvtColor(img, code), img
+        return cv2.cvtColor(img, code, dst=dst), img
+
+def _face_size_limit(pixels, scale):
+    """A face size setting in upload pixels, as a (w, h) tuple at detection scale"""
+    if pixels <= 0:
+        return (0, 0)
+    side = max(1, int(round(pixels * scale)))
+    return (side, side)
+
+def _detect_faces(gray, max_side=None):
+    """Run this thread's cascade over gray, downscaled to max_side; boxes are in gray's coordinates"""
+    detector = get_detector()
+    max_side = DETECT_MAX_SIDE if max_side is None else max_side
+    height, width = gray.shape[:2]
+    
+    scale = 1.0
+    image = gray
+    if max_side and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        with span('downscale'):
+            size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+            image = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    
+    with span('detect'):
+        boxes = detector.detectMultiScale(
+            image, scaleFactor=DETECT_SCALE_FACTOR, minNeighbors=DETECT_MIN_NEIGHBORS,
+            minSize=_face_size_limit(DETECT_MIN_FACE, scale), maxSize=_face_size_limit(DETECT_MAX_FACE, scale)
+        )
+    if scale == 1.0 or len(boxes) == 0:
+        return boxes
+    
+    # Map boxes back to full-resolution coordinates
+    boxes = np.round(np.asarray(boxes, dtype=np.float64) / scale).astype(np.int32)
+    boxes[:, 0] = np.clip(boxes[:, 0], 0, width - 1)
+    boxes[:, 1] = np.clip(boxes[:, 1], 0, height - 1)
+    boxes[:, 2] = np.minimum(boxes[:, 2], width - boxes[:, 0])
+    boxes[:, 3] = np.minimum(boxes[:, 3], height - boxes[:, 1])
+    return boxes
+
+def _features_from_box(gray, box, image=None):
+    """Crop, resize and histogram one detected face, leaving its embedding input for embed_features"""
+    x, y, w, h = (int(v) for v in box)
+    with span('features'):
+        face_roi = gray[y:y+h, x:x+w]
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Resize face to standard size for comparison
+        face_resized = cv2.resize(face_roi, (100, 100))
         
-        # Load Haar cascade for face detection
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        # Calculate histogram as simple feature
+        hist = cv2.calcHist([face_resized], [0], None, [256], [0, 256])
         
-        # Detect faces
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+        # Normalize histogram
+        hist = cv2.normalize(hist, hist).flatten()
+    
+    features = {
+        'face_region': face_resized,
+        'histogram': hist,
+        'face_box': (x, y, w, h)
+    }
+    extractor = get_extractor()
+    if extractor.dim:
+        source = gray if image is None else image
+        features['embedding_input'] = extractor.prepare(source[y:y+h, x:x+w])
+    return features
+
+def extract_face_features(image, embed=True):
+    """Extract simple face features using OpenCV Haar cascades"""
+    try:
+        gray, img = _load_gray(image)
+        faces = _detect_faces(gray)
         
         if len(faces) == 0:
             raise ValueError('No face found in the image')
@@ -33,23 +569,28 @@ def extract_face_features(image_path):
             raise ValueError('Multiple faces found. Please use an image with only one face.')
         
         # Get the first (and only) face
-        x, y, w, h = faces[0]
-        face_roi = gray[y:y+h, x:x+w]
+        features = _features_from_box(gray, faces[0], img)
+        if embed:
+            embed_features([features])
+        return features
         
-        # Resize face to standard size for comparison
-        face_resized = cv2.resize(face_roi, (100, 100))
-        
-        # Calculate histogram as simple feature
-        hist = cv2.calcHist([face_resized], [0], None, [256], [0, 256])
+    except Exception as e:
+        raise ValueError(f"Face extraction failed: {str(e)}")
+
+def extract_all_face_features(image, max_faces=None):
+    """Return (features_list, detected_count) for at most max_faces detected faces, largest first"""
+    max_faces = MAX_FACES if max_faces is None else max(1, min(max_faces, MAX_FACES))
+    try:
+        gray, img = _load_gray(image)
+        faces = _detect_faces(gray)
         
-        # Normalize histogram
-        hist = cv2.normalize(hist, hist).flatten()
+        if len(faces) == 0:
+            raise ValueError('No face found in the image')
         
-        return {
-            'face_region': face_resized,
-            'histogram': hist,
-            'face_box': (x, y, w, h)
-        }
+        boxes = sorted(faces, key=lambda box: int(box[2]) * int(box[3]), reverse=True)
+        features_list = [_features_from_box(gray, box, img) for box in boxes[:max_faces]]
+        # Every face in the image goes through the network as one batch
+        return embed_features(features_list), len(faces)
         
     except Exception as e:
         raise ValueError(f"Face extraction failed: {str(e)}")
@@ -57,6 +598,11 @@ def extract_face_features(image_path):
 def compare_faces(features1, features2):
     """Compare two face feature sets and return similarity score"""
     try:
+        # Embedding backends compare by cosine similarity
+        embedding1, embedding2 = features1.get('embedding'), features2.get('embedding')
+        if embedding1 is not None and embedding2 is not None and embedding1.size and embedding1.size == embedding2.size:
+            return float(np.clip(np.dot(embedding1, embedding2), 0, 1))
+        
         # Compare histograms using correlation
         hist_corr = cv2.compareHist(features1['histogram'], features2['histogram'], cv2.HISTCMP_CORREL)
         
@@ -80,103 +626,350 @@ def compare_faces(features1, features2):
         print(f"Face comparison error: {str(e)}")
         return 0.0
 
-# Register a new face
-def register_face(name: str, image_path: str):
+def centroid_features(features_list):
+    """Merge several templates of one face into a single centroid template"""
+    face = np.mean([np.asarray(f['face_region'], dtype=np.float32) for f in features_list], axis=0)
+    hist = np.mean([np.ravel(f['histogram']) for f in features_list], axis=0).astype(np.float32)
+    centroid = {
+        'face_region': np.round(face).astype(np.uint8),
+        'histogram': cv2.normalize(hist, hist).flatten(),
+        'face_box': features_list[-1]['face_box']
+    }
+    embeddings = [f.get('embedding') for f in features_list]
+    if all(e is not None for e in embeddings) and len({e.size for e in embeddings}) == 1:
+        embedding = np.mean(embeddings, axis=0).astype(np.float32)
+        norm = np.linalg.norm(embedding)
+        centroid['embedding'] = embedding / norm if norm > 0 else embedding
+    return centroid
+
+def _add_template(name, feature_bytes, replace=False):
+    """Store one more template for name (or make it the only one), returning the version"""
+    if replace:
+        return replace_face_templates(name, [(feature_bytes, FEATURE_FORMAT)])
+    if TEMPLATE_OVERFLOW == 'compact' and MAX_TEMPLATES > 1:
+        stored = _stored_templates(name)
+        if len(stored) >= MAX_TEMPLATES:
+            templates = _decode_templates(name, stored)
+            if len(templates) == len(stored):
+                centroid = encode_features(centroid_features(templates))
+                return replace_face_templates(name, [(centroid, FEATURE_FORMAT), (feature_bytes, FEATURE_FORMAT)])
+    return add_face(name, feature_bytes, FEATURE_FORMAT)
+
+# Register a new face, or add another template to a registered one
+def register_face(name: str, image, replace=False):
     try:
-        # Extract face features
-        features = extract_face_features(image_path)
-        
-        # Serialize features for storage
-        face_data = {
-            'face_region': features['face_region'].tolist(),
-            'histogram': features['histogram'].tolist(),
-            'face_box': features['face_box']
-        }
+        # Extract face features (path, encoded bytes or ndarray)
+        features = extract_face_features(image)
         
-        # Convert to bytes for database storage
-        import json
-        feature_bytes = json.dumps(face_data).encode('utf-8')
+        # Serialize features in the compact binary format
+        with span('serialize'):
+            feature_bytes = encode_features(features)
         
-        # Store in database
-        add_face(name, feature_bytes, 'features')
+        # Store in database and keep the resident gallery in sync; the
+        # templates are read back so the gallery sees what the cap kept
+        gallery = get_gallery()
+        with _templates_lock:
+            with span('db_write'):
+                version = _add_template(name, feature_bytes, replace)
+                stored = _stored_templates(name)
+            with span('gallery_update'):
+                gallery.set_templates(name, _gallery_templates(name, stored), version)
+        note_gallery_versions(version, version)
         
-        return {"name": name, "status": "registered", "message": f"Face for {name} registered successfully"}
+        return {"name": name, "status": "registered", "version": version, "templates": len(stored),
+                "message": f"Face for {name} registered successfully"}
     
     except Exception as e:
         return {"name": name, "status": "error", "message": f"Registration failed: {str(e)}"}
 
+# Replace every template of an already registered face with a new one
+def update_face(name: str, image):
+    if get_face_data(name) is None:
+        return {"name": name, "status": "not_found", "message": f"No face registered for {name}"}
+    result = register_face(name, image, replace=True)
+    if result["status"] == "registered":
+        result.update(status="updated", message=f"Face for {name} updated successfully")
+    return result
+
+# Merge each face's templates into one centroid template
+def compact_faces(name=None):
+    """Compact one face, or every face with more than one template when name is None"""
+    names = get_all_faces() if name is None else [name]
+    gallery = get_gallery()
+    compacted = []
+    for face_name in names:
+        with _templates_lock:
+            stored = _stored_templates(face_name)
+            if name is not None and not stored:
+                return {"name": name, "status": "not_found", "message": f"No face registered for {name}"}
+            templates = _decode_templates(face_name, stored)
+            # Faces with templates that don't decode are left alone rather than losing them
+            if len(stored) < 2 or len(templates) != len(stored):
+                continue
+            centroid = centroid_features(templates)
+            with span('db_write'):
+                version = replace_face_templates(face_name, [(encode_features(centroid), FEATURE_FORMAT)])
+            with span('gallery_update'):
+                gallery.set_templates(face_name, [
+                    (centroid['face_region'], centroid['histogram'], centroid.get('embedding'))
+                ], version)
+        note_gallery_versions(version, version)
+        compacted.append({"name": face_name, "templates": len(stored), "version": version})
+    
+    return {
+        "message": f"Compacted {len(compacted)} face(s)",
+        "compacted": compacted,
+        "total_templates": count_templates()
+    }
+
+# Remove a registered face
+def unregister_face(name: str):
+    try:
+        gallery = get_gallery()
+        with _templates_lock:
+            with span('db_write'):
+                version = delete_face(name)
+            if version is None:
+                return {"name": name, "status": "not_found", "message": f"No face registered for {name}"}
+            with span('gallery_update'):
+                gallery.remove(name, version)
+        note_gallery_versions(version, version)
+        
+        return {"name": name, "status": "deleted", "version": version,
+                "message": f"Face for {name} deleted successfully"}
+    
+    except Exception as e:
+        return {"name": name, "status": "error", "message": f"Deletion failed: {str(e)}"}
+
+def _match_result(names, similarities):
+    """Turn one row of per-identity similarities into the /recognize response"""
+    threshold = get_extractor().match_threshold
+    # Scores are already aggregated over each identity's templates, so every name appears once
+    matches = np.flatnonzero(similarities > threshold)  # Threshold for match
+    matches = matches[np.argsort(-similarities[matches], kind='stable')]
+    results = [{"name": names[i], "confidence": round(float(similarities[i]), 3)} for i in matches]
+    
+    if results:
+        return {"message": f"Found {len(results)} matching face(s)", "matches": results}
+    else:
+        return {"message": "No matching faces found", "matches": []}
+
+def _probe_key(image, params):
+    """Decode image and return (decoded image, cache key); the key is None when it can't be decoded"""
+    with span('decode'):
+        img = load_image(image)
+    if img is None or img.size == 0:
+        return image, None
+    with span('probe_hash'):
+        digest = hashlib.blake2b(np.ascontiguousarray(img).data, digest_size=16)
+        digest.update(repr((img.shape, params)).encode())
+    return img, ('image', digest.hexdigest())
+
 # Recognize faces in an image
-def recognize_faces(image_path: str):
+def recognize_faces(image, multi_face=False, max_faces=None, mode=None, top_k=None):
+    """Recognize faces, answering repeated frames from the probe cache"""
+    if not probe_cache.enabled:
+        return _recognize_faces(image, multi_face, max_faces, mode, top_k)
+    
+    # Polls the change feed first, so a hit never outlives a change it has seen
+    get_gallery()
+    generation = probe_cache.generation
+    image, key = _probe_key(image, (multi_face, max_faces, mode, top_k))
+    if key is not None:
+        cached = probe_cache.get(key)
+        if cached is not None:
+            return cached
+    
+    result = _recognize_faces(image, multi_face, max_faces, mode, top_k)
+    if key is not None and "error" not in result:
+        probe_cache.put(key, result, generation)
+    return result
+
+def _recognize_faces(image, multi_face=False, max_faces=None, mode=None, top_k=None):
+    if multi_face:
+        return recognize_all_faces(image, max_faces, mode, top_k)
     try:
-        # Extract features from input image
-        input_features = extract_face_features(image_path)
+        generation = probe_cache.generation
+        
+        # Extract features from input image (path, encoded bytes or ndarray)
+        input_features = extract_face_features(image)
+        
+        # Near-duplicate frames share a face crop hash and skip scoring
+        phash_key = None
+        if PROBE_CACHE_PHASH and probe_cache.enabled:
+            phash_key = ('face', average_hash(input_features['face_region']), mode, top_k)
+            cached = probe_cache.get(phash_key, 'probe_phash')
+            if cached is not None:
+                return cached
         
         # Get registered faces
         try:
-            registered_faces = get_all_face_data()
+            gallery = get_gallery()
         except Exception as e:
             print(f"Error accessing database: {str(e)}")
             return {"message": "Database error", "matches": []}
         
-        if not registered_faces:
+        if not len(gallery):
             return {"message": "No faces registered yet", "matches": []}
         
-        results = []
-        
-        # Compare with all registered faces
-        for name, feature_data, format_type in registered_faces:
-            if format_type != 'features':
-                continue  # Skip non-feature data
+        # Compare against the gallery through the selected index; only scores
+        # above the match threshold have to be exact, so the rest may be pruned
+        with span('score'):
+            names, similarities = get_index(mode).search(input_features, top_k, get_extractor().match_threshold)
+        result = _match_result(names, similarities)
+        if phash_key is not None:
+            probe_cache.put(phash_key, result, generation)
+        return result
             
-            try:
-                # Deserialize stored features
-                import json
-                stored_data = json.loads(feature_data.decode('utf-8'))
-                
-                # Reconstruct features
-                stored_features = {
-                    'face_region': np.array(stored_data['face_region'], dtype=np.uint8),
-                    'histogram': np.array(stored_data['histogram'], dtype=np.float32),
-                    'face_box': stored_data['face_box']
-                }
-                
-                # Compare faces
-                similarity = compare_faces(input_features, stored_features)
-                
-                # If similarity is above threshold
-                if similarity > 0.6:  # Threshold for match
-                    confidence = round(similarity, 3)
-                    results.append({
-                        "name": name,
-                        "confidence": confidence
-                    })
-                
-            except Exception as e:
-                print(f"Error processing stored face {name}: {str(e)}")
-                continue
+    except Exception as e:
+        print(f"Critical error in recognize_faces: {str(e)}")
+        return {"message": "Recognition failed", "matches": [], "error": str(e)}
+
+# Recognize every face in an image (group photos)
+def recognize_all_faces(image, max_faces=None, mode=None, top_k=None):
+    try:
+        probes, detected = extract_all_face_features(image, max_faces)
+        
+        try:
+            gallery = get_gallery()
+        except Exception as e:
+            print(f"Error accessing database: {str(e)}")
+            return {"message": "Database error", "faces": []}
+        
+        if not len(gallery):
+            return {"message": "No faces registered yet", "faces": []}
+        
+        # Exact mode scores all detected faces as one probes-by-gallery matrix
+        with span('score'):
+            searches = get_index(mode).search_many(probes, top_k, get_extractor().match_threshold)
         
-        if results:
-            # Sort by confidence (highest first) and remove duplicates
-            unique_results = {}
-            for result in results:
-                name = result["name"]
-                if name not in unique_results or result["confidence"] > unique_results[name]["confidence"]:
-                    unique_results[name] = result
+        faces = []
+        for features, (names, similarities) in zip(probes, searches):
+            result = _match_result(names, similarities)
+            result["face_box"] = list(features['face_box'])
+            faces.append(result)
+        
+        return {
+            "message": f"Recognized {len(faces)} of {detected} detected face(s)",
+            "detected_faces": detected,
+            "faces": faces
+        }
             
-            final_results = list(unique_results.values())
-            final_results.sort(key=lambda x: x['confidence'], reverse=True)
-            return {"message": f"Found {len(final_results)} matching face(s)", "matches": final_results}
+    except Exception as e:
+        print(f"Critical error in recognize_all_faces: {str(e)}")
+        return {"message": "Recognition failed", "faces": [], "error": str(e)}
+
+# Recognize the faces in one frame of a video stream
+def recognize_frame(image, tracker, mode=None):
+    """Detect faces, follow them with tracker and match only the tracks that are due"""
+    gray, img = _load_gray(image)
+    boxes = _detect_faces(gray)
+    boxes = sorted(boxes, key=lambda box: int(box[2]) * int(box[3]), reverse=True)[:MAX_FACES]
+    now = time.monotonic()
+    with span('track'):
+        tracker.update(boxes)
+
+    gallery = get_gallery()
+    # Reading the size brings a shared gallery up to date, so the generation
+    # below already reflects changes made by other processes
+    registered = len(gallery)
+    due = tracker.due(now, probe_cache.generation)
+    if due:
+        probes = embed_features([_features_from_box(gray, track.box, img) for track in due])
+        if registered:
+            with span('score'):
+                searches = get_index(mode).search_many(probes, 1, get_extractor().match_threshold)
         else:
-            return {"message": "No matching faces found", "matches": []}
-            
+            searches = [([], np.empty(0))] * len(due)
+        for track, (names, similarities) in zip(due, searches):
+            matches = _match_result(names, similarities)["matches"]
+            track.identify(matches[0] if matches else None, now)
+
+    return {
+        "detected_faces": len(boxes),
+        "tracks": [track.to_dict() for track in tracker.visible()],
+        "matched_tracks": [track.id for track in due]
+    }
+
+def _timed_extract(image):
+    """Extract features for one batch image, returning (features, error, elapsed ms)"""
+    start = time.perf_counter()
+    try:
+        features, error = extract_face_features(image, embed=False), None
     except Exception as e:
-        print(f"Critical error in recognize_faces: {str(e)}")
-        return {"message": "Recognition failed", "matches": [], "error": str(e)}
+        features, error = None, str(e)
+    return features, error, round((time.perf_counter() - start) * 1000, 2)
+
+# Recognize one face in each of several images
+def recognize_faces_batch(images):
+    """Detect in parallel across images, then score every probe against the gallery at once"""
+    start = time.perf_counter()
+    extracted = face_pool.map(_timed_extract, images)
+    extract_ms = round((time.perf_counter() - start) * 1000, 2)
+    
+    probes = [features for features, _, _ in extracted if features is not None]
+    embed_start = time.perf_counter()
+    try:
+        # One batched network pass for every probe, after parallel detection
+        embed_features(probes)
+    except Exception as e:
+        print(f"Critical error in recognize_faces_batch: {str(e)}")
+        return {"message": "Recognition failed", "results": [], "error": str(e)}
+    embed_ms = round((time.perf_counter() - embed_start) * 1000, 2)
+    
+    score_start = time.perf_counter()
+    try:
+        gallery = get_gallery()
+        with span('score'):
+            names, similarities = gallery.score_many(probes, get_extractor().match_threshold)
+    except Exception as e:
+        print(f"Critical error in recognize_faces_batch: {str(e)}")
+        return {"message": "Recognition failed", "results": [], "error": str(e)}
+    scoring_ms = round((time.perf_counter() - score_start) * 1000, 2)
+    
+    results = []
+    row = 0
+    for features, error, elapsed_ms in extracted:
+        if error is not None:
+            result = {"message": "Recognition failed", "matches": [], "error": error}
+        elif not names:
+            result = {"message": "No faces registered yet", "matches": []}
+            row += 1
+        else:
+            result = _match_result(names, similarities[row])
+            row += 1
+        result["timing_ms"] = {"extract": elapsed_ms}
+        results.append(result)
+    
+    return {
+        "message": f"Processed {len(results)} image(s)",
+        "results": results,
+        "timing_ms": {
+            "extract": extract_ms,
+            "embed": embed_ms,
+            "scoring": scoring_ms,
+            "total": round((time.perf_counter() - start) * 1000, 2)
+        }
+    }
 
 # List all registered faces
 def list_faces():
     faces = get_all_faces()
     return {
         "total_faces": len(faces),
+        "total_templates": count_templates(),
         "registered_faces": faces
     }
+
+# Names added, updated or deleted after a version
+def list_face_changes(since_version=0, limit=None):
+    changes = get_face_changes(since_version, limit, with_data=False)
+    return {
+        "since_version": since_version,
+        # Pass this back as since_version to page through long feeds
+        "version": changes[-1][0] if changes else max(since_version, get_version()),
+        "changes": [
+            {"version": version, "name": name, "deleted": templates is None}
+            for version, name, templates in changes
+        ]
+    }
@@ -0,0 +1,509 @@
+import math
+import os
+import threading
+import numpy as np
+from .metrics import Counter
+
+# Feature layout produced by extract_face_features
+FACE_SIZE = (100, 100)
+FACE_PIXELS = FACE_SIZE[0] * FACE_SIZE[1]
+HIST_BINS = 256
+
+# Score weights and match threshold (must stay in line with compare_faces)
+HIST_WEIGHT = 0.6
+PIXEL_WEIGHT = 0.4
+MATCH_THRESHOLD = 0.6
+
+# How an identity's template scores combine into its score: 'max' (best
+# template) or 'mean'
+TEMPLATE_AGGREGATION = os.environ.get('SIGHTLINE_TEMPLATE_AGGREGATION', 'max')
+TEMPLATE_AGGREGATIONS = ('max', 'mean')
+
+# Rows per absdiff/correlation chunk, bounds the temporary buffers to a few MB
+SCORE_CHUNK_ROWS = 512
+HIST_CHUNK_ROWS = 4096
+
+# Compact gallery rows trade match agreement for memory: crops are stored
+# as GALLERY_FACE_SIDE x GALLERY_FACE_SIDE block means (a divisor of 100;
+# 100 keeps them whole) and histograms as 8-bit codes when
+# GALLERY_HIST_BITS is 8 (32 keeps float32). benchmarks/compact.py reports
+# bytes per identity and agreement with full-size scores for each setting.
+GALLERY_FACE_SIDE = int(os.environ.get('SIGHTLINE_GALLERY_FACE_SIDE', FACE_SIZE[0]))
+GALLERY_HIST_BITS = int(os.environ.get('SIGHTLINE_GALLERY_HIST_BITS', 32))
+HIST_DTYPES = {32: np.float32, 8: np.uint8}
+
+# Thresholded searches correlate histograms against every row first and
+# compare crops only for identities that can still clear the threshold
+# (see prefilter_scores); matches are the same as with full scoring
+SCORE_PREFILTER = os.environ.get('SIGHTLINE_SCORE_PREFILTER', '1').lower() in ('1', 'true', 'yes')
+
+PREFILTER_PAIRS = Counter('sightline_score_prefilter_pairs_total',
+                          'Probe x gallery row pairs seen by the score prefilter, by outcome', ('result',))
+
+
+def histogram_correlation_matrix(probe_hists, hists):
+    """cv2.HISTCMP_CORREL of every probe histogram against every row of hists, (P, N)"""
+    h1 = np.asarray(probe_hists, dtype=np.float64).reshape(len(probe_hists), -1)
+    hists = np.asarray(hists)
+    scale = 1.0 / h1.shape[1]
+
+    s1 = h1.sum(axis=1)[:, None]
+    s11 = np.einsum('ij,ij->i', h1, h1)[:, None]
+    corr = np.empty((h1.shape[0], hists.shape[0]), dtype=np.float64)
+    for start in range(0, hists.shape[0], HIST_CHUNK_ROWS):
+        h2 = hists[start:start + HIST_CHUNK_ROWS].astype(np.float64)
+        s2 = h2.sum(axis=1)[None, :]
+        s22 = np.einsum('ij,ij->i', h2, h2)[None, :]
+        s12 = h1 @ h2.T
+
+        num = s12 - s1 * s2 * scale
+        denom2 = (s11 - s1 * s1 * scale) * (s22 - s2 * s2 * scale)
+        flat = np.abs(denom2) <= np.finfo(np.float64).eps
+        with np.errstate(divide='ignore', invalid='ignore'):
+            block = num / np.sqrt(denom2)
+        block[flat] = 1.0
+        corr[:, start:start + h2.shape[0]] = block
+    return corr
+
+
+def compact_face(face_region, side):
+    """A FACE_SIZE crop reduced to side x side block means (side must divide FACE_SIZE)"""
+    face = np.asarray(face_region, dtype=np.uint8).reshape(FACE_SIZE)
+    if side == FACE_SIZE[0]:
+        return face
+    block = FACE_SIZE[0] // side
+    means = face.reshape(side, block, side, block).mean(axis=(1, 3), dtype=np.float32)
+    return np.rint(means).astype(np.uint8)
+
+
+def quantize_histogram(histogram):
+    """8-bit codes for a histogram, scaled so its largest bin is 255 (correlation ignores the scale)"""
+    hist = np.asarray(histogram, dtype=np.float32).ravel()
+    peak = hist.max(initial=0.0)
+    if peak <= 0:
+        return np.zeros(hist.shape, dtype=np.uint8)
+    return np.rint(hist * (255.0 / peak)).astype(np.uint8)
+
+
+class FeatureLayout:
+    """How gallery rows store a template: crop side and histogram precision"""
+
+    def __init__(self, face_side=GALLERY_FACE_SIDE, hist_bits=GALLERY_HIST_BITS):
+        if face_side < 1 or FACE_SIZE[0] % face_side:
+            raise ValueError(f"Gallery face side must divide {FACE_SIZE[0]}, got {face_side}")
+        if hist_bits not in HIST_DTYPES:
+            raise ValueError(f"Gallery histogram bits must be one of {', '.join(map(str, HIST_DTYPES))}, got {hist_bits}")
+        self.face_side = face_side
+        self.face_shape = (face_side, face_side)
+        self.face_pixels = face_side * face_side
+        self.hist_bits = hist_bits
+        self.hist_dtype = np.dtype(HIST_DTYPES[hist_bits])
+
+    def __eq__(self, other):
+        return isinstance(other, FeatureLayout) and (self.face_side, self.hist_bits) == (other.face_side, other.hist_bits)
+
+    @property
+    def row_bytes(self):
+        """Bytes of crop and histogram per row (embeddings not included)"""
+        return self.face_pixels + HIST_BINS * self.hist_dtype.itemsize
+
+    def pack_face(self, face_region):
+        return compact_face(face_region, self.face_side)
+
+    def pack_histogram(self, histogram):
+        if self.hist_bits == 8:
+            return quantize_histogram(histogram)
+        return np.asarray(histogram, dtype=np.float32).ravel()
+
+    def stats(self):
+        return {"face_side": self.face_side, "hist_bits": self.hist_bits, "row_bytes": self.row_bytes}
+
+
+def mean_absdiff_matrix(probe_faces, faces):
+    """Mean absolute pixel difference of every probe crop against every row of faces, (P, N)"""
+    probes = np.asarray(probe_faces, dtype=np.uint8).reshape(len(probe_faces), -1)
+    p, n = probes.shape[0], faces.shape[0]
+    out = np.empty((p, n), dtype=np.float64)
+
+    # Keep each broadcast block around SCORE_CHUNK_ROWS crops
+    rows = max(1, SCORE_CHUNK_ROWS // p)
+    for start in range(0, n, rows):
+        block = faces[start:start + rows][None, :, :]
+        # |a - b| without widening: max(a, b) - min(a, b) stays in uint8
+        diff = np.maximum(block, probes[:, None, :])
+        diff -= np.minimum(block, probes[:, None, :])
+        out[:, start:start + block.shape[1]] = diff.sum(axis=2, dtype=np.uint32)
+
+    out /= probes.shape[1]
+    return out
+
+
+def mean_absdiff_masked(probe_faces, faces, keep):
+    """mean_absdiff_matrix for the (probe, row) pairs set in keep, (P, N); most others are left at 0"""
+    probes = np.asarray(probe_faces, dtype=np.uint8).reshape(len(probe_faces), -1)
+    out = np.zeros(keep.shape, dtype=np.float64)
+    # Blocks shrink with the batch like mean_absdiff_matrix's, but not so far
+    # that per-probe overhead dominates
+    step = max(64, SCORE_CHUNK_ROWS // len(probes))
+    for start in range(0, faces.shape[0], step):
+        block_keep = keep[:, start:start + step]
+        live = np.flatnonzero(block_keep.any(axis=0))
+        # Gather the block's wanted rows once; mostly-wanted blocks are compared whole
+        if _mostly(len(live), block_keep.shape[1]):
+            live = np.arange(block_keep.shape[1])
+            block = faces[start:start + len(live)]
+        elif len(live):
+            block = faces[start + live]
+        else:
+            continue
+        for p, probe in enumerate(probes):
+            cols = np.flatnonzero(block_keep[p, live])
+            if _mostly(len(cols), len(live)):
+                cols, rows = slice(None), block
+            elif len(cols):
+                rows = block[cols]
+            else:
+                continue
+            diff = np.maximum(rows, probe)
+            diff -= np.minimum(rows, probe)
+            out[p, start + live[cols]] = diff.sum(axis=1, dtype=np.uint32)
+
+    out /= probes.shape[1]
+    return out
+
+
+def _mostly(part, whole):
+    return part * 4 >= whole * 3
+
+
+def score_features_matrix(features_list, faces, hists):
+    """Similarity of every probe against every gallery row, (P, N), same scale as compare_faces"""
+    hist_corr = histogram_correlation_matrix([f['histogram'] for f in features_list], hists)
+    return _combine_scores(hist_corr, mean_absdiff_matrix(_probe_faces(features_list, faces), faces))
+
+
+def _probe_faces(features_list, faces):
+    side = math.isqrt(faces.shape[1])
+    return [compact_face(f['face_region'], side) for f in features_list]
+
+
+def _combine_scores(hist_corr, absdiff):
+    structural_sim = 1.0 - (absdiff / 255.0)
+    similarity = (hist_corr * HIST_WEIGHT) + (structural_sim * PIXEL_WEIGHT)
+    return np.clip(similarity, 0.0, 1.0)
+
+
+def prefilter_scores(features_list, faces, hists, threshold, groups, how=None):
+    """score_features_matrix in two stages, exact wherever an identity can score above threshold"""
+    hist_corr = histogram_correlation_matrix([f['histogram'] for f in features_list], hists)
+    # A crop matches at best perfectly, which bounds each row's score; rounding
+    # is monotonic, so the bound is never below the exact score
+    bounds = _combine_scores(hist_corr, np.zeros_like(hist_corr))
+    keep = bounds > threshold
+    if (how or TEMPLATE_AGGREGATION) == 'mean' and not groups.single:
+        # Identities are kept or pruned whole on their aggregated bound
+        keep = (groups.aggregate(bounds, 'mean') > threshold)[:, groups.inverse]
+
+    scored = int(np.count_nonzero(keep))
+    PREFILTER_PAIRS.inc('pruned', amount=keep.size - scored)
+    PREFILTER_PAIRS.inc('scored', amount=scored)
+    probe_faces = _probe_faces(features_list, faces)
+    if scored == keep.size:
+        return _combine_scores(hist_corr, mean_absdiff_matrix(probe_faces, faces))
+    # Pruned pairs left at an absdiff of 0 score at their bound; any that
+    # were compared anyway score exactly, which is no higher
+    return _combine_scores(hist_corr, mean_absdiff_masked(probe_faces, faces, keep))
+
+
+def prefilter_stats():
+    pruned, scored = PREFILTER_PAIRS.value('pruned'), PREFILTER_PAIRS.value('scored')
+    return {
+        "enabled": SCORE_PREFILTER,
+        "pruned": pruned,
+        "scored": scored,
+        "prune_rate": round(pruned / (pruned + scored), 4) if pruned + scored else None
+    }
+
+
+def cosine_similarity_matrix(probe_embeddings, embeddings):
+    """Cosine similarity of unit-length probe embeddings against every gallery row, (P, N), clipped to 0..1"""
+    probes = np.asarray(probe_embeddings, dtype=np.float32).reshape(len(probe_embeddings), -1)
+    return np.clip(probes @ embeddings.T, 0.0, 1.0).astype(np.float64)
+
+
+def score_probes(features_list, faces, hists, embeddings, threshold=None, groups=None):
+    """Score probes against gallery rows, by cosine when they carry embeddings; with a threshold, low scores may be upper bounds"""
+    if embeddings.shape[1]:
+        return cosine_similarity_matrix([f['embedding'] for f in features_list], embeddings)
+    if threshold is not None and groups is not None and SCORE_PREFILTER:
+        return prefilter_scores(features_list, faces, hists, threshold, groups)
+    return score_features_matrix(features_list, faces, hists)
+
+
+class IdentityGroups:
+    """Which gallery rows hold templates of which identity"""
+
+    def __init__(self, row_names):
+        ids = {}
+        inverse = np.fromiter((ids.setdefault(name, len(ids)) for name in row_names), dtype=np.intp,
+                              count=len(row_names))
+        self.names = list(ids)
+        self.inverse = inverse
+        # One template per identity needs no reduction at all
+        self.single = len(self.names) == len(inverse)
+        if not self.single:
+            self._order = np.argsort(inverse, kind='stable')
+            self._counts = np.bincount(inverse, minlength=len(self.names))
+            self._starts = np.concatenate(([0], np.cumsum(self._counts)[:-1]))
+
+    def __len__(self):
+        return len(self.names)
+
+    def aggregate(self, scores, how=None):
+        """Per-identity scores, (P, identities), from per-row scores, (P, rows)"""
+        how = how or TEMPLATE_AGGREGATION
+        if how not in TEMPLATE_AGGREGATIONS:
+            raise ValueError(f"Unknown template aggregation '{how}', expected one of {', '.join(TEMPLATE_AGGREGATIONS)}")
+        if self.single:
+            return scores
+        ordered = scores[:, self._order]
+        if how == 'mean':
+            return np.add.reduceat(ordered, self._starts, axis=1) / self._counts
+        return np.maximum.reduceat(ordered, self._starts, axis=1)
+
+
+class Gallery:
+    """Resident copy of every stored template as contiguous feature matrices"""
+
+    def __init__(self, capacity=64, embedding_dim=0, layout=None):
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._rows = {}
+        self._groups = None
+        self._version = 0
+        # Database version of each identity's last versioned change, deletions included
+        self._versions = {}
+        # Bumped before and after every row change, so read() can tell a
+        # pass overlapped one
+        self._changes = 0
+        self.names = []
+        self.embedding_dim = embedding_dim
+        self.layout = layout or FeatureLayout()
+        self.faces = np.empty((capacity, self.layout.face_pixels), dtype=np.uint8)
+        self.histograms = np.empty((capacity, HIST_BINS), dtype=self.layout.hist_dtype)
+        self.embeddings = np.empty((capacity, embedding_dim), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def identities(self):
+        return len(self._rows)
+
+    @property
+    def version(self):
+        """Database version the rows are complete up to"""
+        return self._version
+
+    def advance(self, first, last):
+        """Record that database changes first..last are in the rows, if first follows the current version"""
+        with self._lock:
+            if first <= self._version + 1 and last > self._version:
+                self._version = last
+
+    def _grow(self, needed):
+        capacity = self.faces.shape[0]
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        faces = np.empty((capacity, self.layout.face_pixels), dtype=np.uint8)
+        hists = np.empty((capacity, HIST_BINS), dtype=self.layout.hist_dtype)
+        embeddings = np.empty((capacity, self.embedding_dim), dtype=np.float32)
+        size = len(self.names)
+        faces[:size] = self.faces[:size]
+        hists[:size] = self.histograms[:size]
+        embeddings[:size] = self.embeddings[:size]
+        self.faces, self.histograms, self.embeddings = faces, hists, embeddings
+
+    def _validate(self, face_region, histogram, embedding=None):
+        """Check a template's features and pack them into the gallery's layout"""
+        face = np.asarray(face_region, dtype=np.uint8)
+        if face.shape != FACE_SIZE:
+            raise ValueError(f"Face region must be {FACE_SIZE}, got {face.shape}")
+        hist = np.asarray(histogram, dtype=np.float32).ravel()
+        if hist.size != HIST_BINS:
+            raise ValueError(f"Histogram must have {HIST_BINS} bins, got {hist.size}")
+        face, hist = self.layout.pack_face(face), self.layout.pack_histogram(hist)
+        if not self.embedding_dim:
+            return face, hist, None
+        if embedding is None:
+            raise ValueError("An embedding is required for this gallery")
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        if embedding.size != self.embedding_dim:
+            raise ValueError(f"Embedding must have {self.embedding_dim} values, got {embedding.size}")
+        return face, hist, embedding
+
+    # Row primitives, called with the lock held. SharedGallery overrides
+    # _write and journals _assign/_pop_last so other workers can replay them.
+    def _write(self, row, face, hist, embedding):
+        self.faces[row] = face.ravel()
+        self.histograms[row] = hist
+        if embedding is not None:
+            self.embeddings[row] = embedding
+
+    def _assign(self, row, name):
+        """Give row to name, appending it when row is one past the end"""
+        if row == len(self.names):
+            self.names.append(name)
+        elif self.names[row] == name:
+            return
+        else:
+            self._release(row, self.names[row])
+            self.names[row] = name
+        self._rows.setdefault(name, []).append(row)
+        self._groups = None
+
+    def _pop_last(self):
+        row = len(self.names) - 1
+        self._release(row, self.names.pop())
+        self._groups = None
+
+    def _release(self, row, name):
+        rows = self._rows[name]
+        rows.remove(row)
+        if not rows:
+            del self._rows[name]
+
+    def _replace(self, name, templates):
+        """Make validated templates the rows of name; returns the rows touched"""
+        rows = sorted(self._rows.get(name, ()))
+        size = len(self.names)
+        targets = rows[:len(templates)] + list(range(size, size + len(templates) - len(rows)))
+        self._grow(size + len(templates) - len(rows))
+        for row, template in zip(targets, templates):
+            self._write(row, *template)
+            self._assign(row, name)
+        changed = list(targets)
+        # Surplus rows are filled from the end, highest first, so the moved row never belongs to name
+        for row in reversed(rows[len(templates):]):
+            last = len(self.names) - 1
+            if row != last:
+                self._write(row, self.faces[last], self.histograms[last], self.embeddings[last])
+                self._assign(row, self.names[last])
+                changed.append(row)
+            self._pop_last()
+            changed.append(last)
+        return changed
+
+    def _append(self, name, template):
+        row = len(self.names)
+        self._grow(row + 1)
+        self._write(row, *template)
+        self._assign(row, name)
+        return [row]
+
+    def _versioned(self, name, version, templates):
+        """_replace, unless name already has a change at least as new as version"""
+        if version is not None:
+            if version <= self._versions.get(name, 0):
+                return []
+            self._set_version(name, version)
+        return self._replace(name, templates)
+
+    def _set_version(self, name, version):
+        self._versions[name] = version
+
+    def _apply(self, change, *args):
+        """Run a row change under the lock, tell the listeners and return the rows touched"""
+        with self._lock:
+            self._changes += 1
+            try:
+                touched = change(*args)
+            finally:
+                self._changes += 1
+        self._notify(list(dict.fromkeys(touched)))
+        return touched
+
+    def _notify(self, rows):
+        for row in rows:
+            if row >= len(self.names):
+                face, hist = None, None
+            else:
+                face, hist = self.faces[row].reshape(self.layout.face_shape), self.histograms[row]
+            for listener in self._listeners:
+                listener(row, face, hist)
+
+    def add(self, name, face_region, histogram, embedding=None):
+        """Append a template for name"""
+        self._apply(self._append, name, self._validate(face_region, histogram, embedding))
+
+    def set_templates(self, name, templates, version=None):
+        """Replace name's templates, unless name already has a change newer than version"""
+        validated = [self._validate(*template) for template in templates]
+        self._apply(self._versioned, name, version, validated)
+
+    def remove(self, name, version=None):
+        """Drop every row of name; returns False for unknown names (or a stale version)"""
+        return bool(self._apply(self._versioned, name, version, []))
+
+    def adopt(self, names, faces, histograms, embeddings):
+        """Make rows already in this gallery's layout the whole gallery, without copying them"""
+        if (faces.shape[1] != self.layout.face_pixels or histograms.dtype != self.layout.hist_dtype
+                or embeddings.shape[1] != self.embedding_dim):
+            raise ValueError("Rows are not in this gallery's layout")
+        with self._lock:
+            self._changes += 2
+            dropped = range(len(names), len(self.names))
+            self.names = []
+            self._rows = {}
+            self._groups = None
+            self.faces, self.histograms, self.embeddings = faces, histograms, embeddings
+            for row, name in enumerate(names):
+                self._assign(row, name)
+        self._notify(list(range(len(names))) + list(dropped))
+
+    def subscribe(self, listener):
+        """Call listener(row, face_region, histogram) after every row change, with None for a dropped row"""
+        self._listeners.append(listener)
+
+    def _snapshot_locked(self):
+        size = len(self.names)
+        if self._groups is None:
+            self._groups = IdentityGroups(self.names)
+        return list(self.names), self.faces[:size], self.histograms[:size], self.embeddings[:size], self._groups
+
+    def _snapshot(self):
+        """(stamp, rows): rows are views that no change rewrote for as long as _changed(stamp) is False"""
+        with self._lock:
+            return self._changes, self._snapshot_locked()
+
+    def _changed(self, stamp):
+        return self._changes != stamp
+
+    def _read_locked(self, reader):
+        """Run reader on the current rows with every writer held off"""
+        with self._lock:
+            return reader(*self._snapshot_locked())
+
+    def read(self, reader):
+        """Return reader(names, faces, histograms, embeddings, groups), re-run if a change overlapped it"""
+        stamp, rows = self._snapshot()
+        result = reader(*rows)
+        if not self._changed(stamp):
+            return result
+        # Rows are rewritten in place, so the pass may have paired a name with
+        # another identity's row; run it again with writers held off
+        return self._read_locked(reader)
+
+    def score(self, features, threshold=None):
+        """Return (names, similarities) of a probe against every identity; see score_many"""
+        names, similarities = self.score_many([features], threshold)
+        return names, similarities[0]
+
+    def score_many(self, features_list, threshold=None):
+        """Score several probes in one pass, returning (identity names, P x identities similarities)"""
+        def score(names, faces, hists, embeddings, groups):
+            if not names or not features_list:
+                return groups.names, np.empty((len(features_list), len(groups)), dtype=np.float64)
+            return groups.names, groups.aggregate(score_probes(features_list, faces, hists, embeddings, threshold, groups))
+        return self.read(score)
@@ -0,0 +1,205 @@
+import math
+import os
+import threading
+import numpy as np
+from .gallery import HIST_WEIGHT, PIXEL_WEIGHT, IdentityGroups, compact_face, score_probes
+
+# IVF settings: number of coarse lists scanned per query, smallest gallery
+# worth clustering, and how much the gallery may grow before re-training
+IVF_NPROBE = int(os.environ.get('SIGHTLINE_IVF_NPROBE', 8))
+IVF_MIN_TRAIN = int(os.environ.get('SIGHTLINE_IVF_MIN_TRAIN', 256))
+IVF_RETRAIN_GROWTH = float(os.environ.get('SIGHTLINE_IVF_RETRAIN_GROWTH', 2.0))
+IVF_TRAIN_SAMPLE = 20000
+IVF_TRAIN_ITERATIONS = 10
+
+# Downsampled crop used in the coarse vectors (10x10 block means, fewer
+# when a compact gallery's crop side isn't a multiple of 10)
+COARSE_GRID = 10
+
+
+def _top_k(names, scores, top_k):
+    """Sort candidates by score and keep the best top_k (all when top_k is None)"""
+    order = np.argsort(-scores, kind='stable')
+    if top_k is not None:
+        order = order[:top_k]
+    return [names[i] for i in order], scores[order]
+
+
+def coarse_vectors(faces, hists):
+    """Map gallery rows to short float32 vectors whose L2 distance tracks the compare_faces score"""
+    h = np.asarray(hists, dtype=np.float32).reshape(len(hists), -1)
+    h = h - h.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(h, axis=1, keepdims=True)
+    h = np.divide(h, norms, out=np.zeros_like(h), where=norms > 0)
+
+    f = np.asarray(faces, dtype=np.float32).reshape(len(faces), -1)
+    side = math.isqrt(f.shape[1])
+    grid = math.gcd(side, COARSE_GRID)
+    block = side // grid
+    f = f.reshape(len(faces), grid, block, grid, block).mean(axis=(2, 4)).reshape(len(faces), -1) / (255.0 * grid)
+
+    return np.hstack((h * np.sqrt(HIST_WEIGHT), f * np.sqrt(PIXEL_WEIGHT))).astype(np.float32)
+
+
+def index_vectors(faces, hists, embeddings):
+    """Vectors the IVF lists are built on: the embeddings themselves when rows have them"""
+    if embeddings.shape[1]:
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+    return coarse_vectors(faces, hists)
+
+
+def _probe_vector(features, layout):
+    if features.get('embedding') is not None:
+        return np.asarray(features['embedding'], dtype=np.float32).ravel()
+    face = compact_face(features['face_region'], layout.face_side)
+    return coarse_vectors([face], [features['histogram']])[0]
+
+
+def kmeans(vectors, k, iterations=IVF_TRAIN_ITERATIONS, seed=0):
+    """Plain Lloyd's k-means, returns (k, d) centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest(vectors, centroids)
+        for j in range(k):
+            members = vectors[labels == j]
+            if len(members):
+                centroids[j] = members.mean(axis=0)
+            else:
+                # Re-seed empty lists from a random point
+                centroids[j] = vectors[rng.integers(len(vectors))]
+    return centroids
+
+
+def _nearest(vectors, centroids):
+    """Index of the closest centroid for each vector"""
+    dist = (np.einsum('ij,ij->i', centroids, centroids)[None, :] - 2.0 * (vectors @ centroids.T))
+    return np.argmin(dist, axis=1)
+
+
+class ExactIndex:
+    """Brute-force baseline: scores every gallery row, one result per identity"""
+
+    mode = 'exact'
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+
+    def search(self, features, top_k=None, threshold=None):
+        """Return (names, scores) of the best gallery rows, highest first; below threshold they may be upper bounds"""
+        names, scores = self.gallery.score(features, threshold)
+        return _top_k(names, scores, top_k)
+
+    def search_many(self, features_list, top_k=None, threshold=None):
+        names, scores = self.gallery.score_many(features_list, threshold)
+        return [_top_k(names, row, top_k) for row in scores]
+
+    def stats(self):
+        return {"mode": self.mode, "size": len(self.gallery)}
+
+
+class IVFIndex:
+    """Inverted-file index: k-means lists over coarse vectors (or embeddings), exact scores on a few lists"""
+
+    mode = 'ivf'
+
+    def __init__(self, gallery, nprobe=IVF_NPROBE):
+        self.gallery = gallery
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._centroids = None
+        self._lists = []
+        self._row_list = {}
+        self._trained_size = 0
+        gallery.subscribe(self._on_change)
+
+    def _on_change(self, row, face_region, histogram):
+        with self._lock:
+            if self._centroids is None:
+                return
+            if face_region is None:
+                previous = self._row_list.pop(row, None)
+                if previous is not None:
+                    self._lists[previous].remove(row)
+                return
+            vector = index_vectors([face_region], [histogram], self.gallery.embeddings[row:row + 1])
+            target = int(_nearest(vector, self._centroids)[0])
+            previous = self._row_list.get(row)
+            if previous == target:
+                return
+            if previous is not None:
+                self._lists[previous].remove(row)
+            self._lists[target].append(row)
+            self._row_list[row] = target
+
+    def _train(self, faces, hists, embeddings):
+        vectors = index_vectors(faces, hists, embeddings)
+        sample = vectors
+        if len(vectors) > IVF_TRAIN_SAMPLE:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(len(vectors), size=IVF_TRAIN_SAMPLE, replace=False)]
+
+        k = max(1, int(np.sqrt(len(vectors))))
+        centroids = kmeans(sample, k)
+        labels = _nearest(vectors, centroids)
+
+        self._centroids = centroids
+        self._lists = [list(np.flatnonzero(labels == j)) for j in range(k)]
+        self._row_list = {row: int(label) for row, label in enumerate(labels)}
+        self._trained_size = len(vectors)
+
+    def _ensure_trained(self, faces, hists, embeddings):
+        size = len(faces)
+        if size < IVF_MIN_TRAIN:
+            return False
+        if self._centroids is None or size >= self._trained_size * IVF_RETRAIN_GROWTH:
+            self._train(faces, hists, embeddings)
+        return True
+
+    def _candidates(self, features):
+        probe = _probe_vector(features, self.gallery.layout)[None, :]
+        dist = (np.einsum('ij,ij->i', self._centroids, self._centroids) - 2.0 * (self._centroids @ probe[0]))
+        lists = np.argsort(dist)[:self.nprobe]
+        rows = [row for j in lists for row in self._lists[j]]
+        return np.array(sorted(rows), dtype=np.intp)
+
+    def search(self, features, top_k=None, threshold=None):
+        """Return (names, scores) of the best rows among the nprobe closest lists"""
+        return self.search_many([features], top_k, threshold)[0]
+
+    def search_many(self, features_list, top_k=None, threshold=None):
+        return self.gallery.read(lambda *rows: self._search_rows(features_list, top_k, threshold, *rows))
+
+    def _search_rows(self, features_list, top_k, threshold, names, faces, hists, embeddings, groups):
+        if not names:
+            return [([], np.empty(0)) for _ in features_list]
+
+        with self._lock:
+            if not self._ensure_trained(faces, hists, embeddings):
+                scores = groups.aggregate(score_probes(features_list, faces, hists, embeddings, threshold, groups))
+                return [_top_k(groups.names, row, top_k) for row in scores]
+            candidates = [self._candidates(features) for features in features_list]
+
+        results = []
+        for features, rows in zip(features_list, candidates):
+            rows = rows[rows < len(names)]
+            # Identities are scored on the templates that made it into the probed lists
+            candidate_groups = IdentityGroups([names[i] for i in rows])
+            scores = score_probes([features], faces[rows], hists[rows], embeddings[rows], threshold, candidate_groups)
+            results.append(_top_k(candidate_groups.names, candidate_groups.aggregate(scores)[0], top_k))
+        return results
+
+    def stats(self):
+        # Sized outside the lock: a shared gallery may refresh, which waits for a locked search
+        size = len(self.gallery)
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "size": size,
+                "trained_size": self._trained_size,
+                "lists": len(self._lists),
+                "nprobe": self.nprobe
+            }
+
+
+INDEX_TYPES = {index.mode: index for index in (ExactIndex, IVFIndex)}
@@ -1,8 +1,34 @@
+import time
+_IMPORT_START = time.perf_counter()
+
 import os
 import gc
+import io
+import asyncio
 import logging
-from fastapi import FastAPI, UploadFile, File, Form
-from .faces import register_face, recognize_faces, list_faces
+import threading
+import zipfile
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, Form, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+from .db import init_db
+from .faces import (register_face, update_face, unregister_face, compact_faces, export_snapshot, import_snapshot,
+                    snapshot_if_changed, recognize_faces, recognize_faces_batch, recognize_frame, list_faces,
+                    list_face_changes, get_gallery, get_index, get_detector, SEARCH_MODES, DETECTOR_STATS,
+                    GALLERY_STATS, SNAPSHOT_STATS, probe_cache)
+from . import bulk
+from .store import SharedGallery
+from .executor import face_pool, QueueFullError, RETRY_AFTER_SECONDS
+from .embedding import get_extractor
+from .uploads import (read_upload, read_uploads, hold_upload, upload_budget, UploadTooLarge, UnsupportedUpload,
+                      RequestTooLarge, BodyLimitMiddleware, MAX_UPLOAD_BYTES, MAX_ARCHIVE_BYTES,
+                      MULTIPART_OVERHEAD_BYTES, sniff_image_type)
+from .snapshot import SnapshotError, SNAPSHOT_PATH, SNAPSHOT_INTERVAL_SECONDS
+from .gallery import prefilter_stats
+from .stream import IoUTracker, LatestFrame, STREAM_DETECT_EVERY, STREAM_FRAMES, STREAM_STATS
+from . import metrics
+from .metrics import span
 
 # Configure logging for memory tracking
 logging.basicConfig(level=logging.INFO)
@@ -34,14 +60,151 @@ except ImportError:
     def log_memory_usage(endpoint: str):
         return 0
 
+# Most images accepted by one /recognize/batch call (after unpacking zips)
+BATCH_MAX_IMAGES = int(os.environ.get('SIGHTLINE_BATCH_MAX_IMAGES', 32))
+
+# Full collections only run when RSS crosses this threshold, at most once per interval
+GC_RSS_THRESHOLD_MB = float(os.environ.get('SIGHTLINE_GC_RSS_THRESHOLD_MB', 320))
+GC_MIN_INTERVAL_SECONDS = float(os.environ.get('SIGHTLINE_GC_MIN_INTERVAL_SECONDS', 10))
+_last_gc = 0.0
+
+def maybe_collect(memory_mb):
+    """Run gc.collect() only when memory is actually high, instead of on every request"""
+    global _last_gc
+    if not MEMORY_MONITORING or memory_mb < GC_RSS_THRESHOLD_MB:
+        return False
+    now = time.monotonic()
+    if now - _last_gc < GC_MIN_INTERVAL_SECONDS:
+        return False
+    _last_gc = now
+    with span('gc'):
+        collected = gc.collect()
+    logger.info(f"RSS {memory_mb} MB over {GC_RSS_THRESHOLD_MB} MB, collected {collected} objects")
+    return True
+
+def too_large_response(error, key="matches"):
+    return JSONResponse(status_code=413, content={"message": str(error), key: []})
+
+def upload_error_response(error, content):
+    """413 for an oversized upload, 415 for one that isn't an image"""
+    return JSONResponse(status_code=415 if isinstance(error, UnsupportedUpload) else 413, content=content)
+
+def request_body_limit(method, path):
+    """Largest body an upload endpoint can legitimately receive, or None"""
+    if (method == "POST" and path in ("/register", "/recognize")) or \
+            (method == "PUT" and path.startswith("/faces/")):
+        return MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES
+    if method == "POST" and path == "/recognize/batch":
+        return BATCH_MAX_IMAGES * (MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES)
+    if method == "POST" and path in ("/register/bulk", "/snapshot/import"):
+        return MAX_ARCHIVE_BYTES + MULTIPART_OVERHEAD_BYTES
+    return None
+
+# Startup breakdown for /healthz. import_ms is the module import (paid once
+# in the gunicorn master with --preload); the steps run in each worker.
+STARTUP_STATS = {
+    "ready": False,
+    "import_ms": None,
+    "steps_ms": {},
+    "warm_up_ms": None,
+    "process_to_ready_ms": None
+}
+
+def warm_up():
+    """Open the database, load every pool thread's cascade (and network) and the gallery before taking traffic"""
+    start = time.perf_counter()
+    steps = (
+        ("db_init", init_db),
+        ("detector", lambda: face_pool.warm(get_detector)),
+        ("embedding", lambda: face_pool.warm(get_extractor().warm)),
+        ("gallery", get_gallery),
+        ("index", get_index)
+    )
+    for step, fn in steps:
+        step_start = time.perf_counter()
+        fn()
+        STARTUP_STATS["steps_ms"][step] = round((time.perf_counter() - step_start) * 1000, 2)
+    
+    STARTUP_STATS["warm_up_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    if MEMORY_MONITORING:
+        started = psutil.Process(os.getpid()).create_time()
+        STARTUP_STATS["process_to_ready_ms"] = round((time.time() - started) * 1000, 2)
+    STARTUP_STATS["ready"] = True
+    logger.info(f"Worker ready in {STARTUP_STATS['warm_up_ms']} ms: {STARTUP_STATS['steps_ms']}")
+
+async def snapshot_loop():
+    """Write a gallery snapshot every SNAPSHOT_INTERVAL_SECONDS when faces changed"""
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL_SECONDS)
+        try:
+            result = await face_pool.run(snapshot_if_changed)
+            if result:
+                logger.info(f"Gallery snapshot of {result['rows']} row(s) written to {result['path']} in {result['elapsed_ms']} ms")
+        except QueueFullError:
+            # Busy serving requests; the next interval picks the changes up
+            logger.info("Background snapshot skipped, face queue full")
+        except Exception as e:
+            logger.error(f"Background snapshot failed: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in each worker after fork, before the first request is accepted
+    warm_up()
+    snapshots = None
+    if SNAPSHOT_PATH and SNAPSHOT_INTERVAL_SECONDS > 0:
+        snapshots = asyncio.create_task(snapshot_loop())
+    yield
+    if snapshots is not None:
+        snapshots.cancel()
+
 app = FastAPI(
     title="Sightline - Facial Recognition API",
     description="A powerful facial recognition service using DeepFace and OpenCV. Register faces and recognize them in images.",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
+# Scrape-time gauges for /metrics
+metrics.Gauge('sightline_gallery_faces', 'Faces in the resident gallery', lambda: get_gallery().identities)
+metrics.Gauge('sightline_gallery_templates', 'Face templates in the resident gallery', lambda: len(get_gallery()))
+metrics.Gauge('sightline_memory_rss_bytes', 'Resident set size of this worker',
+              lambda: int(get_memory_usage() * 1024 * 1024) if MEMORY_MONITORING else None)
+metrics.Gauge('sightline_pool_queue_depth', 'Face jobs waiting for a worker thread', lambda: face_pool.stats()['queue_depth'])
+metrics.Gauge('sightline_pool_running', 'Face jobs currently running', lambda: face_pool.stats()['running'])
+metrics.Gauge('sightline_pool_rejected_total', 'Face jobs rejected because the queue was full',
+              lambda: face_pool.stats()['rejected'], kind='counter')
+metrics.Gauge('sightline_upload_bytes_in_flight', 'Upload bytes held in memory by running requests',
+              lambda: upload_budget.in_flight)
+metrics.Gauge('sightline_probe_cache_bytes', 'Bytes held by the probe result cache', lambda: probe_cache.stats()['bytes'])
+metrics.Gauge('sightline_detector_instances', 'Cascade classifiers loaded (one per thread)', lambda: DETECTOR_STATS['instances'])
+
+# Oversized uploads are refused while they arrive, before the multipart body is spooled
+app.add_middleware(BodyLimitMiddleware, limit_for=request_body_limit)
+
+@app.exception_handler(RequestTooLarge)
+async def request_too_large(request: Request, exc: RequestTooLarge):
+    return JSONResponse(status_code=413, content={"message": exc.detail})
+
+# Registered last so it wraps every other middleware and times their responses too
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """Record request latency and optionally report stage spans via Server-Timing"""
+    timings = metrics.start_request_timings()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    
+    route = request.scope.get("route")
+    metrics.REQUEST_SECONDS.observe(
+        elapsed, request.method, route.path if route is not None else "unmatched", str(response.status_code)
+    )
+    if metrics.SERVER_TIMING or request.headers.get("x-sightline-timing") == "1":
+        timings.append(("total", elapsed))
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+    return response
+
 @app.get("/")
 def read_root():
     return {
@@ -49,73 +212,279 @@ def read_root():
         "version": "1.0.0",
         "docs": "/docs",
         "endpoints": {
-            "register": "POST /register - Register a new face",
+            "register": "POST /register - Register a new face or add a template to one",
             "recognize": "POST /recognize - Recognize faces in an image", 
+            "recognize_batch": "POST /recognize/batch - Recognize faces in several images or a zip",
+            "recognize_stream": "WS /ws/recognize - Track and recognize faces in a stream of frames",
+            "register_bulk": "POST /register/bulk - Enroll many faces from a zip or tar archive",
             "faces": "GET /faces - List all registered faces",
-            "health": "GET /healthz - Health check"
+            "snapshot": "POST /snapshot, GET /snapshot, POST /snapshot/import - Write, download or restore a gallery snapshot",
+            "health": "GET /healthz - Health check",
+            "metrics": "GET /metrics - Prometheus metrics"
         }
     }
 
 @app.get("/healthz")
 def health_check():
     memory_mb = get_memory_usage()
+    gallery = get_gallery()
+    gallery_stats = {"faces": gallery.identities, "templates": len(gallery), "layout": gallery.layout.stats(),
+                     "version": gallery.version, **GALLERY_STATS}
+    if isinstance(gallery, SharedGallery):
+        gallery_stats["store"] = gallery.stats()
     return {
-        "status": "healthy", 
+        "status": "healthy" if STARTUP_STATS["ready"] else "starting",
         "service": "sightline-facial-recognition", 
         "version": "1.0.0",
         "memory_usage_mb": memory_mb,
-        "memory_monitoring": MEMORY_MONITORING
+        "memory_monitoring": MEMORY_MONITORING,
+        "detector": DETECTOR_STATS,
+        "embedding": get_extractor().stats(),
+        "gallery": gallery_stats,
+        "startup": STARTUP_STATS,
+        "face_pool": face_pool.stats(),
+        "uploads": upload_budget.stats(),
+        "probe_cache": probe_cache.stats(),
+        "score_prefilter": prefilter_stats(),
+        "snapshot": SNAPSHOT_STATS,
+        "streams": STREAM_STATS
     }
 
+def busy_response():
+    """503 returned when the face work queue is full"""
+    return JSONResponse(
+        status_code=503,
+        content={"message": "Server busy, please retry", "retry_after_seconds": RETRY_AFTER_SECONDS},
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
+async def process_upload(file, endpoint, fn):
+    """Run fn(contents) on the face pool for one uploaded image, then log memory use"""
+    # Decode straight from the upload buffer, no temp file, and collect only under memory pressure
+    async with read_upload(file) as contents:
+        result = await face_pool.run(fn, contents)
+    maybe_collect(log_memory_usage(endpoint))
+    return result
+
 @app.post("/register")
 async def register(name: str = Form(...), file: UploadFile = File(...)):
     try:
-        temp_path = f"/tmp/{file.filename}"
-        with open(temp_path, "wb") as f:
-            f.write(await file.read())
-        
-        result = register_face(name, temp_path)
-        
-        # Clean up
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        
-        # Force garbage collection to free memory
-        gc.collect()
-        log_memory_usage("register")
-        
-        return result
+        return await process_upload(file, "register", lambda contents: register_face(name, contents))
+    except (UploadTooLarge, UnsupportedUpload) as e:
+        return upload_error_response(e, {"name": name, "status": "error", "message": str(e)})
+    except QueueFullError:
+        logger.warning("Registration rejected, face queue or upload budget full")
+        return busy_response()
     except Exception as e:
-        # Clean up on error
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.remove(temp_path)
         logger.error(f"Registration error: {str(e)}")
         raise e
+    finally:
+        await file.close()
+
+# Only one bulk enrollment runs at a time; it already uses every extraction process
+_bulk_lock = threading.Lock()
+
+def _enroll_archive(fileobj):
+    if not _bulk_lock.acquire(blocking=False):
+        raise QueueFullError("A bulk enrollment is already running")
+    try:
+        return bulk.enroll(bulk.iter_archive(fileobj))
+    finally:
+        _bulk_lock.release()
+
+@app.post("/register/bulk")
+async def register_bulk(file: UploadFile = File(...)):
+    """Enroll every image in a zip/tar archive; entries are named by folder or file stem"""
+    try:
+        # Entries are streamed from the parser's spool file, one chunk of images in memory at a time
+        held = min(file.size or MAX_ARCHIVE_BYTES, bulk.BULK_CHUNK_SIZE * bulk.BULK_MAX_IMAGE_BYTES)
+        async with hold_upload(file, held) as fileobj:
+            result = await face_pool.run(_enroll_archive, fileobj)
+        maybe_collect(log_memory_usage("register_bulk"))
+        return result
+    except UploadTooLarge as e:
+        return upload_error_response(e, {"message": str(e), "failed": []})
+    except QueueFullError:
+        logger.warning("Bulk enrollment rejected, face queue full or another one is running")
+        return busy_response()
+    except (zipfile.BadZipFile, bulk.tarfile.TarError) as e:
+        return JSONResponse(status_code=400, content={"message": f"Unreadable archive: {str(e)}", "failed": []})
+    except Exception as e:
+        logger.error(f"Bulk enrollment error: {str(e)}")
+        raise e
+    finally:
+        await file.close()
 
 @app.post("/recognize")
-async def recognize(file: UploadFile = File(...)):
+async def recognize(
+    file: UploadFile = File(...),
+    multi_face: bool = False,
+    max_faces: Optional[int] = None,
+    mode: Optional[str] = Query(None, description="Search mode: exact or ivf"),
+    top_k: Optional[int] = Query(None, ge=1)
+):
     try:
-        temp_path = f"/tmp/{file.filename}"
-        with open(temp_path, "wb") as f:
-            f.write(await file.read())
-        
-        result = recognize_faces(temp_path)
-        
-        # Clean up
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        
-        # Force garbage collection to free memory
-        gc.collect()
-        log_memory_usage("recognize")
+        if mode is not None and mode not in SEARCH_MODES:
+            return JSONResponse(status_code=400, content={"message": f"Unknown search mode '{mode}'", "matches": []})
+        return await process_upload(
+            file, "recognize", lambda contents: recognize_faces(contents, multi_face, max_faces, mode, top_k)
+        )
+    except (UploadTooLarge, UnsupportedUpload) as e:
+        return upload_error_response(e, {"message": str(e), "matches": []})
+    except QueueFullError:
+        logger.warning("Recognition rejected, face queue or upload budget full")
+        return busy_response()
+    except Exception as e:
+        logger.error(f"Recognition error: {str(e)}")
+        raise e
+    finally:
+        await file.close()
+
+def expand_batch_uploads(uploads):
+    """Return (filename, bytes, error) triples with zip archives unpacked; non-images get bytes None"""
+    images = []
+    for filename, contents in uploads:
+        if isinstance(contents, UnsupportedUpload):
+            images.append((filename, None, str(contents)))
+            continue
+        if not zipfile.is_zipfile(io.BytesIO(contents)):
+            images.append((filename, contents, None))
+            continue
+        with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                if len(images) >= BATCH_MAX_IMAGES:
+                    raise ValueError(f"Batch exceeds {BATCH_MAX_IMAGES} images")
+                if info.file_size > MAX_UPLOAD_BYTES:
+                    raise ValueError(f"Archive entry {info.filename} exceeds the upload size limit")
+                data = archive.read(info)
+                if sniff_image_type(data) is None:
+                    images.append((info.filename, None, f"{info.filename} is not a supported image"))
+                else:
+                    images.append((info.filename, data, None))
+    if len(images) > BATCH_MAX_IMAGES:
+        raise ValueError(f"Batch exceeds {BATCH_MAX_IMAGES} images")
+    return images
+
+@app.post("/recognize/batch")
+async def recognize_batch(files: List[UploadFile] = File(...)):
+    try:
+        async with read_uploads(files, archives=True, per_file_errors=True) as contents:
+            try:
+                images = expand_batch_uploads([(file.filename, data) for file, data in zip(files, contents)])
+            except ValueError as e:
+                return too_large_response(e, "results")
+            
+            result = await face_pool.run(recognize_faces_batch, [data for _, data, error in images if error is None])
+        if "error" not in result:
+            # Files that weren't images get the same per-file error result as images that don't decode
+            scored = iter(result["results"])
+            result["results"] = [
+                next(scored) if error is None else {"message": "Recognition failed", "matches": [], "error": error}
+                for _, _, error in images
+            ]
+            result["message"] = f"Processed {len(images)} image(s)"
+            for (filename, _, _), item in zip(images, result["results"]):
+                item["filename"] = filename
         
+        maybe_collect(log_memory_usage("recognize_batch"))
         return result
+    except (UploadTooLarge, UnsupportedUpload) as e:
+        return upload_error_response(e, {"message": str(e), "results": []})
+    except QueueFullError:
+        logger.warning("Batch recognition rejected, face queue or upload budget full")
+        return busy_response()
     except Exception as e:
-        # Clean up on error
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.remove(temp_path)
-        logger.error(f"Recognition error: {str(e)}")
+        logger.error(f"Batch recognition error: {str(e)}")
         raise e
+    finally:
+        for file in files:
+            await file.close()
+
+def stream_frame_error(data):
+    """Why a stream message can't be processed as a frame, or None"""
+    if data is None:
+        return "Frames must be sent as binary messages"
+    if len(data) > MAX_UPLOAD_BYTES:
+        return f"Frame exceeds the {MAX_UPLOAD_BYTES} byte limit"
+    if sniff_image_type(data) is None:
+        return "Frame is not a supported image"
+    return None
+
+@app.websocket("/ws/recognize")
+async def recognize_stream(websocket: WebSocket, mode: Optional[str] = None):
+    """Track and recognize faces in binary frame messages, skipping ahead to the newest frame when behind"""
+    if mode is not None and mode not in SEARCH_MODES:
+        await websocket.close(code=1008, reason=f"Unknown search mode '{mode}'")
+        return
+    await websocket.accept()
+    STREAM_STATS['open'] += 1
+    STREAM_STATS['opened'] += 1
+    frames = LatestFrame()
+    tracker = IoUTracker()
+    
+    async def read_frames():
+        sequence = 0
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                sequence += 1
+                frames.put((sequence, message.get("bytes")))
+        finally:
+            frames.close()
+    
+    reader = asyncio.create_task(read_frames())
+    taken = 0
+    try:
+        while True:
+            item = await frames.get()
+            if item is None:
+                break
+            sequence, data = item
+            error = stream_frame_error(data)
+            if error is not None:
+                STREAM_FRAMES.inc('rejected')
+                await websocket.send_json({"frame": sequence, "error": error})
+                continue
+            
+            taken += 1
+            start = time.perf_counter()
+            if (taken - 1) % STREAM_DETECT_EVERY:
+                # Between detections the tracks are reported as they stand
+                STREAM_FRAMES.inc('skipped')
+                result = {"detected": False, "tracks": [track.to_dict() for track in tracker.visible()], "matched_tracks": []}
+            else:
+                try:
+                    result = await face_pool.run(recognize_frame, data, tracker, mode)
+                except QueueFullError:
+                    frames.drop()
+                    continue
+                except ValueError as e:
+                    STREAM_FRAMES.inc('rejected')
+                    await websocket.send_json({"frame": sequence, "error": str(e)})
+                    continue
+                STREAM_FRAMES.inc('processed')
+                result = {"detected": True, **result}
+            
+            await websocket.send_json({
+                "frame": sequence,
+                **result,
+                "dropped_frames": frames.dropped,
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+            })
+    except WebSocketDisconnect:
+        pass
+    finally:
+        STREAM_STATS['open'] -= 1
+        reader.cancel()
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Stage latency histograms, cache counters and gauges in Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/memory")
 def memory_status():
@@ -146,3 +515,105 @@ def faces():
     except Exception as e:
         logger.error(f"List faces error: {str(e)}")
         return {"total_faces": 0, "registered_faces": [], "error": str(e)}
+
+@app.get("/faces/changes")
+def face_changes(since_version: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=10000)):
+    """Faces added, updated or deleted after since_version; pass `version` back to continue"""
+    return list_face_changes(since_version, limit)
+
+@app.put("/faces/{name}")
+async def update(name: str, file: UploadFile = File(...)):
+    try:
+        result = await process_upload(file, "update", lambda contents: update_face(name, contents))
+        if result["status"] == "not_found":
+            return JSONResponse(status_code=404, content=result)
+        return result
+    except (UploadTooLarge, UnsupportedUpload) as e:
+        return upload_error_response(e, {"name": name, "status": "error", "message": str(e)})
+    except QueueFullError:
+        logger.warning("Update rejected, face queue or upload budget full")
+        return busy_response()
+    except Exception as e:
+        logger.error(f"Update error: {str(e)}")
+        raise e
+    finally:
+        await file.close()
+
+@app.delete("/faces/{name}")
+async def delete(name: str):
+    try:
+        result = await face_pool.run(unregister_face, name)
+    except QueueFullError:
+        return busy_response()
+    if result["status"] == "not_found":
+        return JSONResponse(status_code=404, content=result)
+    return result
+
+@app.post("/faces/compact")
+async def compact_all():
+    """Merge the templates of every face into one centroid template each"""
+    try:
+        return await face_pool.run(compact_faces)
+    except QueueFullError:
+        return busy_response()
+
+@app.post("/faces/{name}/compact")
+async def compact(name: str):
+    try:
+        result = await face_pool.run(compact_faces, name)
+    except QueueFullError:
+        return busy_response()
+    if result.get("status") == "not_found":
+        return JSONResponse(status_code=404, content=result)
+    return result
+
+@app.post("/snapshot")
+async def create_snapshot(compress: Optional[bool] = None):
+    """Write the resident gallery to SIGHTLINE_SNAPSHOT_PATH"""
+    if not SNAPSHOT_PATH:
+        return JSONResponse(status_code=400, content={"message": "SIGHTLINE_SNAPSHOT_PATH is not set"})
+    try:
+        return await face_pool.run(export_snapshot, None, compress)
+    except QueueFullError:
+        return busy_response()
+
+@app.get("/snapshot")
+def download_snapshot():
+    """Download the last snapshot written to SIGHTLINE_SNAPSHOT_PATH"""
+    if not SNAPSHOT_PATH or not os.path.exists(SNAPSHOT_PATH):
+        return JSONResponse(status_code=404, content={"message": "No gallery snapshot has been written"})
+    return FileResponse(SNAPSHOT_PATH, media_type="application/octet-stream",
+                        filename=os.path.basename(SNAPSHOT_PATH))
+
+def _import_snapshot(fileobj):
+    if not _bulk_lock.acquire(blocking=False):
+        raise QueueFullError("A bulk enrollment or import is already running")
+    try:
+        return import_snapshot(fileobj)
+    finally:
+        _bulk_lock.release()
+
+@app.post("/snapshot/import")
+async def restore_snapshot(file: UploadFile = File(...)):
+    """Restore faces from an uploaded snapshot: each face in it gets the snapshot's templates"""
+    try:
+        # Read from the parser's spool file, but the snapshot is loaded into memory whole
+        async with hold_upload(file, file.size or MAX_ARCHIVE_BYTES) as fileobj:
+            result = await face_pool.run(_import_snapshot, fileobj)
+        maybe_collect(log_memory_usage("snapshot_import"))
+        return result
+    except UploadTooLarge as e:
+        return upload_error_response(e, {"message": str(e)})
+    except QueueFullError:
+        logger.warning("Snapshot import rejected, face queue full or a bulk enrollment or import is running")
+        return busy_response()
+    except SnapshotError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    except Exception as e:
+        logger.error(f"Snapshot import error: {str(e)}")
+        raise e
+    finally:
+        await file.close()
+
+# Everything above runs at import time
+STARTUP_STATS["import_ms"] = round((time.perf_counter() - _IMPORT_START) * 1000, 2)
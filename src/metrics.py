@@ -0,0 +1,166 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Always attach a Server-Timing header (otherwise only when the client
+# sends "X-Sightline-Timing: 1")
+SERVER_TIMING = os.environ.get('SIGHTLINE_SERVER_TIMING', '0') == '1'
+
+# Latency buckets in seconds, from sub-millisecond stages up to slow uploads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label combination"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for label_values, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, label_values, ('le', _format_value(bound)))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class Counter:
+    """Monotonic counter, one series per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield f'{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}'
+
+
+class Gauge:
+    """Value read from a callback at scrape time (kind='counter' for running totals kept elsewhere)"""
+
+    def __init__(self, name, documentation, read, kind='gauge'):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self._read = read
+        _registry.append(self)
+
+    def samples(self):
+        try:
+            value = self._read()
+        except Exception:
+            return
+        if value is not None:
+            yield f'{self.name} {_format_value(value)}'
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+# Shared metrics
+STAGE_SECONDS = Histogram('sightline_stage_duration_seconds', 'Time spent in each processing stage', ('stage',))
+REQUEST_SECONDS = Histogram('sightline_request_duration_seconds', 'End-to-end request latency', ('method', 'route', 'status'))
+CACHE_REQUESTS = Counter('sightline_cache_requests_total', 'Cache lookups by cache and result', ('cache', 'result'))
+
+# Stage timings of the current request, for the Server-Timing header
+_request_timings = contextvars.ContextVar('sightline_request_timings', default=None)
+
+
+def start_request_timings():
+    """Collect span timings for the current request; returns the list they land in"""
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def span(stage):
+    """Time a block into the stage histogram (and the request's Server-Timing list)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def server_timing_header(timings):
+    """Format collected spans as a Server-Timing header value (durations in ms)"""
+    totals = {}
+    for stage, elapsed in timings:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ', '.join(f'{stage};dur={elapsed * 1000:.2f}' for stage, elapsed in totals.items())
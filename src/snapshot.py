@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import struct
+import time
+import zlib
+import numpy as np
+from .gallery import FeatureLayout, HIST_BINS
+
+# Gallery snapshot file. When set, a worker starts from this file (mapped,
+# no feature decoding) and catches up from the database change feed; see
+# faces.export_snapshot for writing it.
+SNAPSHOT_PATH = os.environ.get('SIGHTLINE_SNAPSHOT_PATH', '')
+
+# Seconds between background snapshots to SNAPSHOT_PATH (0 = off); a
+# snapshot is only written when the gallery changed since the last one
+SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get('SIGHTLINE_SNAPSHOT_INTERVAL_SECONDS', 0))
+
+# zlib-compress snapshot sections. Compressed snapshots are smaller but are
+# inflated into memory at load; uncompressed ones are mapped in place.
+SNAPSHOT_COMPRESS = os.environ.get('SIGHTLINE_SNAPSHOT_COMPRESS', '0').lower() in ('1', 'true', 'yes')
+
+MAGIC = b'SLSN'
+VERSION = 1
+FLAG_COMPRESSED = 1
+
+# Header: magic, version, flags, embedding size, crop side, histogram bits,
+# rows, database version the rows include, creation time, checksum, then
+# (offset, stored bytes, raw bytes) for each section in SECTIONS order. The
+# checksum is a blake2b digest of the header (checksum zeroed) and of the
+# digest of everything after it.
+_HEADER = struct.Struct('<4sHHIHHQQd32s')
+_SECTION = struct.Struct('<QQQ')
+SECTIONS = ('names', 'faces', 'hists', 'embeds')
+HEADER_SIZE = _HEADER.size + _SECTION.size * len(SECTIONS)
+
+# Sections start on this boundary so mapped matrices are aligned
+SECTION_ALIGN = 64
+CHUNK_BYTES = 4 * 1024 * 1024
+
+
+def _checksum(head, payload_digest):
+    head = bytearray(head)
+    head[_HEADER.size - 32:_HEADER.size] = bytes(32)
+    return hashlib.blake2b(bytes(head) + payload_digest, digest_size=32).digest()
+
+
+class SnapshotError(ValueError):
+    """Raised for a snapshot file that is truncated, corrupt or of an unknown format"""
+
+
+class Snapshot:
+    """Gallery rows read from a snapshot file: names plus the matrices in the snapshot's layout"""
+
+    def __init__(self, names, faces, histograms, embeddings, layout, version, created_at, compressed):
+        self.names = names
+        self.faces = faces
+        self.histograms = histograms
+        self.embeddings = embeddings
+        self.layout = layout
+        self.embedding_dim = embeddings.shape[1]
+        self.version = version
+        self.created_at = created_at
+        self.compressed = compressed
+
+    def __len__(self):
+        return len(self.names)
+
+    def stats(self):
+        return {
+            "rows": len(self.names),
+            "version": self.version,
+            "created_at": self.created_at,
+            "compressed": self.compressed,
+            "embedding_dim": self.embedding_dim,
+            **self.layout.stats()
+        }
+
+
+def _section_chunks(data):
+    """Raw bytes of a section in pieces of about CHUNK_BYTES"""
+    if isinstance(data, bytes):
+        yield data
+        return
+    rows = max(1, CHUNK_BYTES // max(1, data.strides[0]))
+    for start in range(0, len(data), rows):
+        yield np.ascontiguousarray(data[start:start + rows]).tobytes()
+
+
+def write_snapshot(path, names, faces, histograms, embeddings, layout, version, compress=False):
+    """Write gallery rows to path atomically (via a rename); returns the snapshot's summary"""
+    start = time.perf_counter()
+    sections = {
+        'names': json.dumps(list(names)).encode('utf-8'),
+        'faces': faces,
+        'hists': histograms,
+        'embeds': embeddings
+    }
+    digest = hashlib.blake2b(digest_size=32)
+    table = []
+    tmp = f'{path}.tmp-{os.getpid()}'
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(b'\0' * HEADER_SIZE)
+            offset = HEADER_SIZE
+            for kind in SECTIONS:
+                padding = -offset % SECTION_ALIGN
+                f.write(b'\0' * padding)
+                digest.update(b'\0' * padding)
+                offset += padding
+                stored, raw = 0, 0
+                compressor = zlib.compressobj(6) if compress else None
+                for chunk in _section_chunks(sections[kind]):
+                    raw += len(chunk)
+                    if compressor is not None:
+                        chunk = compressor.compress(chunk)
+                    f.write(chunk)
+                    digest.update(chunk)
+                    stored += len(chunk)
+                if compressor is not None:
+                    chunk = compressor.flush()
+                    f.write(chunk)
+                    digest.update(chunk)
+                    stored += len(chunk)
+                table.append((offset, stored, raw))
+                offset += stored
+
+            head = bytearray(_HEADER.pack(MAGIC, VERSION, FLAG_COMPRESSED if compress else 0, embeddings.shape[1],
+                                          layout.face_side, layout.hist_bits, len(names), version, time.time(),
+                                          bytes(32)))
+            for entry in table:
+                head += _SECTION.pack(*entry)
+            head[_HEADER.size - 32:_HEADER.size] = _checksum(head, digest.digest())
+            f.seek(0)
+            f.write(head)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return {
+        "path": path,
+        "rows": len(names),
+        "version": version,
+        "bytes": offset,
+        "compressed": bool(compress),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise SnapshotError("Snapshot is truncated")
+    return data
+
+
+def _read_header(f):
+    f.seek(0)
+    head = _read_exact(f, HEADER_SIZE)
+    magic, version, flags, embedding_dim, face_side, hist_bits, rows, db_version, created_at, digest = \
+        _HEADER.unpack_from(head)
+    if magic != MAGIC or version != VERSION:
+        raise SnapshotError("Not a gallery snapshot, or one of an unsupported version")
+    table = dict(zip(SECTIONS, (_SECTION.unpack_from(head, _HEADER.size + i * _SECTION.size)
+                                for i in range(len(SECTIONS)))))
+    try:
+        layout = FeatureLayout(face_side, hist_bits)
+    except ValueError as e:
+        raise SnapshotError(str(e))
+    return {
+        "flags": flags,
+        "embedding_dim": embedding_dim,
+        "layout": layout,
+        "rows": rows,
+        "version": db_version,
+        "created_at": created_at,
+        "digest": digest,
+        "head": head,
+        "sections": table
+    }
+
+
+def _verify(f, header):
+    """Check the checksum over the header and everything after it, read chunk by chunk"""
+    f.seek(HEADER_SIZE)
+    digest = hashlib.blake2b(digest_size=32)
+    while True:
+        chunk = f.read(CHUNK_BYTES)
+        if not chunk:
+            break
+        digest.update(chunk)
+    if _checksum(header["head"], digest.digest()) != header["digest"]:
+        raise SnapshotError("Snapshot checksum mismatch")
+
+
+def _read_section(f, path, header, kind, dtype, width):
+    """One section as an array: mapped copy-on-write when possible, else read (and inflated) into memory"""
+    offset, stored, raw = header["sections"][kind]
+    count = raw // (np.dtype(dtype).itemsize * width) if width else header["rows"]
+    if raw != count * np.dtype(dtype).itemsize * width:
+        raise SnapshotError(f"Snapshot {kind} section has the wrong size")
+    if not raw:
+        return np.empty((count, width), dtype=dtype)
+    if header["flags"] & FLAG_COMPRESSED:
+        out = bytearray(raw)
+        view = memoryview(out)
+        inflater = zlib.decompressobj()
+        f.seek(offset)
+        filled, remaining = 0, stored
+        while remaining:
+            chunk = _read_exact(f, min(CHUNK_BYTES, remaining))
+            remaining -= len(chunk)
+            data = inflater.decompress(chunk)
+            view[filled:filled + len(data)] = data
+            filled += len(data)
+        data = inflater.flush()
+        view[filled:filled + len(data)] = data
+        filled += len(data)
+        if filled != raw:
+            raise SnapshotError(f"Snapshot {kind} section inflates to the wrong size")
+        return np.frombuffer(out, dtype=dtype).reshape(count, width)
+    if path is not None:
+        # Copy-on-write: pages are shared with the page cache until the gallery writes to them
+        return np.memmap(path, dtype=dtype, mode='c', offset=offset, shape=(count, width))
+    out = np.empty((count, width), dtype=dtype)
+    f.seek(offset)
+    f.readinto(memoryview(out).cast('B'))
+    return out
+
+
+def read_snapshot(source, verify=True):
+    """Read a snapshot from a path, memory-mapped when uncompressed, or a seekable binary file"""
+    path = os.fspath(source) if isinstance(source, (str, os.PathLike)) else None
+    f = open(path, 'rb') if path is not None else source
+    try:
+        header = _read_header(f)
+        if verify:
+            _verify(f, header)
+        offset, stored, raw = header["sections"]['names']
+        f.seek(offset)
+        blob = _read_exact(f, stored)
+        if header["flags"] & FLAG_COMPRESSED:
+            blob = zlib.decompress(blob)
+        names = json.loads(blob.decode('utf-8'))
+        layout = header["layout"]
+        faces = _read_section(f, path, header, 'faces', np.uint8, layout.face_pixels)
+        histograms = _read_section(f, path, header, 'hists', layout.hist_dtype, HIST_BINS)
+        embeddings = _read_section(f, path, header, 'embeds', np.float32, header["embedding_dim"])
+    except (zlib.error, ValueError, UnicodeDecodeError) as e:
+        if isinstance(e, SnapshotError):
+            raise
+        raise SnapshotError(f"Unreadable snapshot: {str(e)}")
+    finally:
+        if path is not None:
+            f.close()
+
+    if not (len(names) == header["rows"] == len(faces) == len(histograms) == len(embeddings)):
+        raise SnapshotError("Snapshot sections disagree on the number of rows")
+    return Snapshot(names, faces, histograms, embeddings, layout, header["version"], header["created_at"],
+                    bool(header["flags"] & FLAG_COMPRESSED))
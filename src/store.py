@@ -0,0 +1,347 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+import numpy as np
+from .gallery import Gallery, HIST_BINS
+
+# Directory of the shared gallery store. When set, every worker maps the same
+# feature files read-only instead of holding a private copy of the gallery.
+GALLERY_STORE = os.environ.get('SIGHTLINE_GALLERY_STORE', '')
+
+MAGIC = b'SLGS'
+VERSION = 1
+
+# Header of the meta file: magic, version, embedding size (0 without an
+# embedding backend), epoch, committed rows, generation, committed journal
+# bytes, database rows skipped at rebuild, crop side and histogram bits of
+# the rows, and the database version the rows are complete up to
+_HEADER = struct.Struct('<4sHHQQQQQHHQ')
+_GENERATION = struct.Struct('<Q')
+_GENERATION_OFFSET = 24
+_DB_VERSION = struct.Struct('<Q')
+_DB_VERSION_OFFSET = 52
+
+# Rows allocated up front; data files double when they fill up
+MIN_CAPACITY = 64
+
+
+# Each epoch of the store is a set of fixed-stride row files (faces, hists,
+# embeds) that every worker maps read-only, plus names-<epoch>.jsonl, the
+# journal of row writes the workers replay. Writers hold flock on the meta
+# file and bump the header generation before and after each change.
+class SharedGallery(Gallery):
+    """Gallery backed by memory-mapped files shared by every worker process"""
+
+    def __init__(self, path, embedding_dim=0, layout=None):
+        super().__init__(capacity=0, embedding_dim=embedding_dim, layout=layout)
+        self.path = path
+        self._embed_stride = embedding_dim * 4
+        os.makedirs(path, exist_ok=True)
+        self._epoch = None
+        self._generation = None
+        self._journal_offset = 0
+        self._mapped_rows = 0
+        # Journal entries recorded by the change in progress, None outside one
+        self._journal = None
+
+        with self._flock(fcntl.LOCK_EX) as fd:
+            size = os.fstat(fd).st_size
+            if size < _HEADER.size:
+                os.pwrite(fd, _HEADER.pack(MAGIC, VERSION, 0, 0, 0, 0, 0, 0, 0, 0, 0), 0)
+
+        # Mapped through its own descriptor: mmap keeps a dup of it, which
+        # would otherwise hold on to the flock
+        fd = os.open(os.path.join(path, 'meta'), os.O_RDWR)
+        try:
+            self._meta = mmap.mmap(fd, _HEADER.size)
+        finally:
+            os.close(fd)
+        magic, version = self._read_header()[:2]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Unsupported gallery store in {path}")
+
+    def _file(self, kind, epoch):
+        hists = 'u8' if self.layout.hist_bits == 8 else 'f32'
+        suffix = {'faces': 'u8', 'hists': hists, 'embeds': 'f32', 'names': 'jsonl'}[kind]
+        return os.path.join(self.path, f'{kind}-{epoch}.{suffix}')
+
+    @contextmanager
+    def _flock(self, operation):
+        # A fresh descriptor per lock keeps flock working across fork
+        fd = os.open(os.path.join(self.path, 'meta'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, operation)
+            yield fd
+        finally:
+            os.close(fd)
+
+    def _read_header(self):
+        return _HEADER.unpack_from(self._meta)
+
+    def _write_header(self, epoch, rows, generation, journal_bytes, skipped, version):
+        self._meta[:_HEADER.size] = _HEADER.pack(MAGIC, VERSION, self.embedding_dim, epoch, rows, generation,
+                                                 journal_bytes, skipped, self.layout.face_side, self.layout.hist_bits,
+                                                 version)
+
+    @property
+    def version(self):
+        """Database version the store's rows are complete up to, shared by every worker"""
+        return _DB_VERSION.unpack_from(self._meta, _DB_VERSION_OFFSET)[0]
+
+    def advance(self, first, last):
+        with self._lock:
+            with self._flock(fcntl.LOCK_EX):
+                version = self.version
+                if first <= version + 1 and last > version:
+                    _DB_VERSION.pack_into(self._meta, _DB_VERSION_OFFSET, last)
+
+    def _kinds(self):
+        """(kind, stride) of every fixed-stride data file"""
+        kinds = [('faces', self.layout.face_pixels), ('hists', HIST_BINS * self.layout.hist_dtype.itemsize)]
+        if self.embedding_dim:
+            kinds.append(('embeds', self._embed_stride))
+        return kinds
+
+    def _map(self, kind, stride, dtype, width):
+        fd = os.open(self._file(kind, self._epoch), os.O_RDONLY)
+        try:
+            capacity = os.fstat(fd).st_size // stride
+            buffer = mmap.mmap(fd, capacity * stride, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        return np.frombuffer(buffer, dtype=dtype).reshape(capacity, width)
+
+    def _sync(self):
+        """Apply journal entries written since the last sync and return the rows they touched (locks held)"""
+        _, _, _, epoch, rows, generation, journal_bytes, _, _, _, _ = self._read_header()
+        if generation == self._generation:
+            return []
+
+        if epoch != self._epoch:
+            # The store was rebuilt: start over on the new files
+            self._epoch = epoch
+            self._journal_offset = 0
+            self._mapped_rows = 0
+            self._rows = {}
+            self._groups = None
+            self._versions = {}
+            self.names = []
+
+        changed = []
+        if journal_bytes > self._journal_offset:
+            fd = os.open(self._file('names', epoch), os.O_RDONLY)
+            try:
+                data = os.pread(fd, journal_bytes - self._journal_offset, self._journal_offset)
+            finally:
+                os.close(fd)
+            self._journal_offset = journal_bytes
+            for line in data.splitlines():
+                entry = json.loads(line)
+                if isinstance(entry, dict):
+                    self._versions[entry['name']] = entry['version']
+                    continue
+                row, name = entry
+                if name is None:
+                    self._pop_last()
+                else:
+                    self._assign(row, name)
+                changed.append(row)
+
+        self._remap(rows)
+        self._generation = generation
+        return changed
+
+    def _remap(self, rows):
+        if rows <= self._mapped_rows:
+            return
+        (_, face_stride), (_, hist_stride) = self._kinds()[:2]
+        self.faces = self._map('faces', face_stride, np.uint8, self.layout.face_pixels)
+        self.histograms = self._map('hists', hist_stride, self.layout.hist_dtype, HIST_BINS)
+        if self.embedding_dim:
+            self.embeddings = self._map('embeds', self._embed_stride, np.float32, self.embedding_dim)
+        else:
+            self.embeddings = np.empty((len(self.faces), 0), dtype=np.float32)
+        self._mapped_rows = len(self.faces)
+
+    def refresh(self):
+        """Pick up writes from other workers; a single header read when nothing changed"""
+        if _GENERATION.unpack_from(self._meta, _GENERATION_OFFSET)[0] == self._generation:
+            return
+        with self._lock:
+            with self._flock(fcntl.LOCK_SH):
+                changed = self._sync()
+        self._notify(list(dict.fromkeys(changed)))
+
+    def _write_row(self, epoch, row, face, hist, embedding):
+        data = {'faces': face, 'hists': hist, 'embeds': embedding}
+        for kind, stride in self._kinds():
+            fd = os.open(self._file(kind, epoch), os.O_RDWR)
+            try:
+                capacity = os.fstat(fd).st_size // stride
+                if row >= capacity:
+                    os.ftruncate(fd, max(row + 1, capacity * 2) * stride)
+                os.pwrite(fd, data[kind].tobytes(), row * stride)
+            finally:
+                os.close(fd)
+
+    # Row primitives for Gallery's changes: data goes straight to the files
+    # (which grow themselves), name changes are recorded for the journal
+    def _grow(self, needed):
+        pass
+
+    def _write(self, row, face, hist, embedding):
+        self._write_row(self._epoch, row, face, hist, embedding)
+
+    def _assign(self, row, name):
+        super()._assign(row, name)
+        if self._journal is not None:
+            self._journal.append([row, name])
+
+    def _pop_last(self):
+        row = len(self.names) - 1
+        super()._pop_last()
+        if self._journal is not None:
+            self._journal.append([row, None])
+
+    def _set_version(self, name, version):
+        super()._set_version(name, version)
+        if self._journal is not None:
+            self._journal.append({'name': name, 'version': version})
+
+    def _apply(self, change, *args):
+        """Run a row change for every worker: catch up, change the files, then publish the journal"""
+        with self._lock:
+            with self._flock(fcntl.LOCK_EX):
+                changed = self._sync()
+                _, _, _, epoch, _, generation, journal_bytes, skipped, _, _, version = self._read_header()
+                # Bumped before any row is written, so every worker's read() sees the overlap
+                _GENERATION.pack_into(self._meta, _GENERATION_OFFSET, generation + 1)
+                self._journal = []
+                try:
+                    touched = change(*args)
+                    entries = self._journal
+                except BaseException:
+                    # Memory no longer matches the published journal: replay it from scratch
+                    self._epoch = self._generation = None
+                    raise
+                finally:
+                    self._journal = None
+                if entries:
+                    journal_bytes = self._append_journal(epoch, journal_bytes, entries)
+                self._write_header(epoch, len(self.names), generation + 2, journal_bytes, skipped, version)
+                # Already applied here, so there's nothing for _sync to replay
+                self._journal_offset = journal_bytes
+                self._generation = generation + 2
+                self._remap(len(self.names))
+        self._notify(list(dict.fromkeys(changed + touched)))
+        return touched
+
+    def _append_journal(self, epoch, journal_bytes, entries):
+        """Write journal entries at the committed end, returning the new journal size"""
+        data = b''.join((json.dumps(entry) + '\n').encode('utf-8') for entry in entries)
+        fd = os.open(self._file('names', epoch), os.O_RDWR)
+        try:
+            os.pwrite(fd, data, journal_bytes)
+        finally:
+            os.close(fd)
+        return journal_bytes + len(data)
+
+    def _rebuild(self, rows, expected_rows, version):
+        """Write (name, face_region, histogram, embedding) rows, complete up to version, to a new epoch (store lock held)"""
+        _, _, _, old_epoch, _, generation, _, _, _, _, _ = self._read_header()
+        epoch = old_epoch + 1
+        count = 0
+        journal_bytes = 0
+        files = {kind: open(self._file(kind, epoch), 'wb') for kind, _ in self._kinds()}
+        try:
+            with open(self._file('names', epoch), 'wb') as names:
+                for name, face_region, histogram, embedding in rows:
+                    face, hist, embedding = self._validate(face_region, histogram, embedding)
+                    data = {'faces': face, 'hists': hist, 'embeds': embedding}
+                    for kind, f in files.items():
+                        f.write(data[kind].tobytes())
+                    journal_bytes += names.write((json.dumps([count, name]) + '\n').encode('utf-8'))
+                    count += 1
+            capacity = max(MIN_CAPACITY, count)
+            for kind, stride in self._kinds():
+                files[kind].truncate(capacity * stride)
+        finally:
+            for f in files.values():
+                f.close()
+
+        # Publishing the header switches every worker to the new files
+        self._write_header(epoch, count, generation + 1, journal_bytes, max(0, expected_rows - count), version)
+        if old_epoch:
+            # Matched by prefix: the old files may have been written with another layout
+            for entry in os.listdir(self.path):
+                if entry.split('.')[0] in {f'{kind}-{old_epoch}' for kind in ('faces', 'hists', 'embeds', 'names')}:
+                    try:
+                        os.remove(os.path.join(self.path, entry))
+                    except FileNotFoundError:
+                        pass
+        return count
+
+    def attach(self, expected_rows, version, load_rows):
+        """Map the store, rebuilding it from load_rows() unless it matches expected_rows and version"""
+        with self._lock:
+            with self._flock(fcntl.LOCK_EX):
+                (_, _, embedding_dim, epoch, rows, _, _, skipped, face_side, hist_bits,
+                 stored_version) = self._read_header()
+                # A store behind the database is left for the caller to catch up
+                # from the change feed; one ahead of it (the database was replaced) is not
+                rebuilt = (epoch == 0 or rows + skipped != expected_rows or embedding_dim != self.embedding_dim
+                           or (face_side, hist_bits) != (self.layout.face_side, self.layout.hist_bits)
+                           or stored_version > version)
+                if rebuilt:
+                    self._rebuild(load_rows(), expected_rows, version)
+                changed = self._sync()
+        self._notify(changed)
+        return rebuilt
+
+    def __len__(self):
+        self.refresh()
+        return len(self.names)
+
+    @property
+    def identities(self):
+        self.refresh()
+        return len(self._rows)
+
+    def _snapshot(self):
+        # Stamped with the generation synced to: a write since then, from
+        # any worker, changes the header generation
+        self.refresh()
+        with self._lock:
+            return self._generation, self._snapshot_locked()
+
+    def _changed(self, stamp):
+        return _GENERATION.unpack_from(self._meta, _GENERATION_OFFSET)[0] != stamp
+
+    def _read_locked(self, reader):
+        # A shared lock on the store holds off other workers' writers too
+        with self._lock:
+            with self._flock(fcntl.LOCK_SH):
+                changed = self._sync()
+                result = reader(*self._snapshot_locked())
+        self._notify(list(dict.fromkeys(changed)))
+        return result
+
+    def stats(self):
+        (_, _, embedding_dim, epoch, rows, generation, journal_bytes, skipped, face_side, hist_bits,
+         version) = self._read_header()
+        return {
+            "path": self.path,
+            "embedding_dim": embedding_dim,
+            "face_side": face_side,
+            "hist_bits": hist_bits,
+            "epoch": epoch,
+            "rows": rows,
+            "generation": generation,
+            "journal_bytes": journal_bytes,
+            "skipped_rows": skipped,
+            "version": version,
+            "mapped_rows": self._mapped_rows
+        }
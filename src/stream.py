@@ -0,0 +1,153 @@
+import asyncio
+import os
+import numpy as np
+from .metrics import Counter
+
+# Face tracking for frame streams: a detection continues a track when its
+# box overlaps the track's last box by at least TRACK_IOU, and a track
+# survives TRACK_MAX_MISSES processed frames without a detection
+TRACK_IOU = float(os.environ.get('SIGHTLINE_TRACK_IOU', 0.3))
+TRACK_MAX_MISSES = int(os.environ.get('SIGHTLINE_TRACK_MAX_MISSES', 5))
+
+# Seconds a track keeps its identity before it is matched against the
+# gallery again (new tracks, and every track after a gallery change, are
+# matched on the next frame regardless)
+TRACK_REMATCH_SECONDS = float(os.environ.get('SIGHTLINE_TRACK_REMATCH_SECONDS', 2.0))
+
+# Run detection on every Nth frame taken off a stream; the frames in
+# between are answered from the current tracks without being decoded
+STREAM_DETECT_EVERY = max(1, int(os.environ.get('SIGHTLINE_STREAM_DETECT_EVERY', 1)))
+
+STREAM_FRAMES = Counter('sightline_stream_frames_total', 'Stream frames by outcome', ('result',))
+STREAM_STATS = {'open': 0, 'opened': 0}
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Intersection over union of every (x, y, w, h) box in boxes_a against every box in boxes_b, (A, B)"""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+    w = np.minimum(ax2[:, None], bx2[None, :]) - np.maximum(a[:, 0][:, None], b[:, 0][None, :])
+    h = np.minimum(ay2[:, None], by2[None, :]) - np.maximum(a[:, 1][:, None], b[:, 1][None, :])
+    inter = np.clip(w, 0, None) * np.clip(h, 0, None)
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+class Track:
+    """One face followed across frames, with the identity it was last matched to"""
+
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.box = box
+        self.hits = 1
+        self.misses = 0
+        self.name = None
+        self.confidence = None
+        self.matched_at = None
+
+    def identify(self, match, now):
+        """Record the best gallery match (None when nothing cleared the threshold)"""
+        self.name = match["name"] if match else None
+        self.confidence = match["confidence"] if match else None
+        self.matched_at = now
+
+    def to_dict(self):
+        return {
+            "track_id": self.id,
+            "face_box": list(self.box),
+            "name": self.name,
+            "confidence": self.confidence,
+            "frames": self.hits
+        }
+
+
+class IoUTracker:
+    """Greedy IoU association of each frame's detections with the tracks of earlier frames"""
+
+    def __init__(self, iou_threshold=TRACK_IOU, max_misses=TRACK_MAX_MISSES, rematch_seconds=TRACK_REMATCH_SECONDS):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.rematch_seconds = rematch_seconds
+        self.tracks = []
+        self._next_id = 1
+        self._generation = None
+
+    def update(self, boxes):
+        """Associate one frame's boxes with the current tracks, returning the tracks started by it"""
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        matched_tracks, matched_boxes = set(), set()
+        if self.tracks and boxes:
+            overlap = iou_matrix([track.box for track in self.tracks], boxes)
+            pairs = np.argwhere(overlap >= self.iou_threshold)
+            order = np.argsort(-overlap[pairs[:, 0], pairs[:, 1]], kind='stable')
+            for t, b in pairs[order]:
+                if t in matched_tracks or b in matched_boxes:
+                    continue
+                track = self.tracks[t]
+                track.box = boxes[b]
+                track.hits += 1
+                track.misses = 0
+                matched_tracks.add(t)
+                matched_boxes.add(b)
+
+        survivors = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+            if track.misses <= self.max_misses:
+                survivors.append(track)
+        started = []
+        for b, box in enumerate(boxes):
+            if b not in matched_boxes:
+                started.append(Track(self._next_id, box))
+                self._next_id += 1
+        self.tracks = survivors + started
+        return started
+
+    def visible(self):
+        """Tracks detected in the last processed frame"""
+        return [track for track in self.tracks if track.misses == 0]
+
+    def due(self, now, generation=None):
+        """Visible tracks to match now: new, stale, or all of them once generation changes"""
+        if generation != self._generation:
+            self._generation = generation
+            return self.visible()
+        return [track for track in self.visible()
+                if track.matched_at is None or now - track.matched_at >= self.rematch_seconds]
+
+
+class LatestFrame:
+    """Single-slot mailbox where a new frame replaces one the worker hasn't taken yet"""
+
+    def __init__(self):
+        self._frame = None
+        self._event = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        if self._frame is not None:
+            self.drop()
+        self._frame = frame
+        self._event.set()
+
+    def drop(self):
+        self.dropped += 1
+        STREAM_FRAMES.inc('dropped')
+
+    def close(self):
+        self.closed = True
+        self._event.set()
+
+    async def get(self):
+        """Wait for the newest frame; None once the stream is closed"""
+        while self._frame is None and not self.closed:
+            self._event.clear()
+            await self._event.wait()
+        if self.closed:
+            return None
+        frame, self._frame = self._frame, None
+        return frame
@@ -0,0 +1,218 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from .executor import QueueFullError
+from .metrics import span
+
+# Largest single upload accepted, and the size of the chunks it is read in
+MAX_UPLOAD_BYTES = int(float(os.environ.get('SIGHTLINE_MAX_UPLOAD_MB', 10)) * 1024 * 1024)
+UPLOAD_CHUNK_BYTES = int(os.environ.get('SIGHTLINE_UPLOAD_CHUNK_KB', 256)) * 1024
+
+# Largest bulk enrollment archive or gallery snapshot accepted. These are
+# processed from the parser's spool file, not held in memory whole.
+MAX_ARCHIVE_BYTES = int(float(os.environ.get('SIGHTLINE_MAX_ARCHIVE_MB', 1024)) * 1024 * 1024)
+
+# Upload bytes one worker holds in memory at once, across every request.
+# A request that doesn't fit waits up to UPLOAD_WAIT_SECONDS for others to
+# finish, then gets the same 503 + Retry-After as a full face queue.
+UPLOAD_BUDGET_BYTES = int(float(os.environ.get('SIGHTLINE_UPLOAD_BUDGET_MB', 64)) * 1024 * 1024)
+UPLOAD_WAIT_SECONDS = float(os.environ.get('SIGHTLINE_UPLOAD_WAIT_SECONDS', 5))
+
+# Multipart framing allowed on top of the file itself when a request is
+# refused from its Content-Length alone
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Leading bytes of the image formats OpenCV decodes
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+)
+ZIP_SIGNATURE = b'PK\x03\x04'
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES"""
+
+
+class UnsupportedUpload(ValueError):
+    """Raised when an upload doesn't start like a supported image"""
+
+
+class UploadBudgetExceeded(QueueFullError):
+    """Raised when the in-flight upload budget stayed full for UPLOAD_WAIT_SECONDS"""
+
+
+class RequestTooLarge(HTTPException):
+    """Raised while the request body is still arriving, once it passes its endpoint's limit"""
+
+    def __init__(self, limit):
+        super().__init__(status_code=413, detail=f"Request body exceeds the {limit} byte limit")
+
+
+def sniff_image_type(head):
+    """Return the image format named by a file's first bytes, or None"""
+    head = bytes(head[:16])
+    for signature, kind in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if len(head) >= 2 and head[:1] == b'P' and head[1:2] in b'123456':
+        return 'pnm'
+    return None
+
+
+class ByteBudget:
+    """Async semaphore counted in bytes; a reservation larger than the whole budget is capped to it"""
+
+    def __init__(self, capacity=UPLOAD_BUDGET_BYTES, timeout=UPLOAD_WAIT_SECONDS):
+        self.capacity = capacity
+        self.timeout = timeout
+        self._condition = asyncio.Condition()
+        self._used = 0
+        self._peak = 0
+        self._waiting = 0
+        self._rejected = 0
+
+    async def acquire(self, size):
+        """Wait until size bytes fit, returning the amount actually reserved"""
+        size = min(size, self.capacity)
+        async with self._condition:
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(
+                    self._condition.wait_for(lambda: self._used + size <= self.capacity), self.timeout
+                )
+            except asyncio.TimeoutError:
+                self._rejected += 1
+                raise UploadBudgetExceeded(f"Upload budget of {self.capacity} bytes is in use")
+            finally:
+                self._waiting -= 1
+            self._used += size
+            self._peak = max(self._peak, self._used)
+        return size
+
+    async def release(self, size):
+        async with self._condition:
+            self._used -= size
+            self._condition.notify_all()
+
+    @property
+    def in_flight(self):
+        return self._used
+
+    def stats(self):
+        return {
+            "budget_bytes": self.capacity,
+            "in_flight_bytes": self._used,
+            "peak_bytes": self._peak,
+            "waiting": self._waiting,
+            "rejected": self._rejected,
+            "max_upload_bytes": MAX_UPLOAD_BYTES
+        }
+
+
+upload_budget = ByteBudget()
+
+
+async def _read_chunks(file, archives):
+    """Read an upload chunk by chunk, checking its header first and its size as it grows"""
+    contents = bytearray()
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        if not contents:
+            is_archive = archives and chunk.startswith(ZIP_SIGNATURE)
+            if not is_archive and sniff_image_type(chunk) is None:
+                raise UnsupportedUpload(f"{file.filename or 'Upload'} is not a supported image")
+        contents += chunk
+        if len(contents) > MAX_UPLOAD_BYTES:
+            raise UploadTooLarge(f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit")
+    if not contents:
+        raise UnsupportedUpload(f"{file.filename or 'Upload'} is empty")
+    return contents
+
+
+async def _read_file(file, archives, per_file_errors):
+    try:
+        return await _read_chunks(file, archives)
+    except UnsupportedUpload as e:
+        if not per_file_errors:
+            raise
+        return e
+
+
+@asynccontextmanager
+async def read_uploads(files, archives=False, per_file_errors=False):
+    """Read uploads into memory, one bytearray per file, while holding their size in the upload budget"""
+    total = 0
+    for file in files:
+        if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+            raise UploadTooLarge(f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit")
+        total += MAX_UPLOAD_BYTES if file.size is None else file.size
+
+    with span('upload_wait'):
+        reserved = await upload_budget.acquire(total)
+    try:
+        with span('upload_read'):
+            contents = [await _read_file(file, archives, per_file_errors) for file in files]
+        yield contents
+    finally:
+        await upload_budget.release(reserved)
+
+
+@asynccontextmanager
+async def read_upload(file):
+    """read_uploads for a single image"""
+    async with read_uploads([file]) as (contents,):
+        yield contents
+
+
+@asynccontextmanager
+async def hold_upload(file, held):
+    """Yield a spooled archive upload's file while holding held bytes of the upload budget"""
+    if file.size is not None and file.size > MAX_ARCHIVE_BYTES:
+        raise UploadTooLarge(f"Upload exceeds the {MAX_ARCHIVE_BYTES} byte limit")
+    with span('upload_wait'):
+        reserved = await upload_budget.acquire(held)
+    try:
+        yield file.file
+    finally:
+        await upload_budget.release(reserved)
+
+
+class BodyLimitMiddleware:
+    """Refuse request bodies over limit_for(method, path) while they arrive, before they are spooled"""
+
+    def __init__(self, app, limit_for):
+        self.app = app
+        self.limit_for = limit_for
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limit_for(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            error = RequestTooLarge(limit)
+            return await JSONResponse(status_code=413, content={"message": error.detail})(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise RequestTooLarge(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -8,17 +8,31 @@ export OPENBLAS_NUM_THREADS=1
 export PYTHONHASHSEED=random
 export PYTHONUNBUFFERED=1
 
+# Face work runs on a bounded thread pool; extra requests get 503 + Retry-After
+export SIGHTLINE_POOL_WORKERS=${SIGHTLINE_POOL_WORKERS:-2}
+export SIGHTLINE_POOL_QUEUE_SIZE=${SIGHTLINE_POOL_QUEUE_SIZE:-8}
+
+# Reject oversized uploads, cap the upload bytes a worker holds at once and
+# only run full GCs when RSS is actually high
+export SIGHTLINE_MAX_UPLOAD_MB=${SIGHTLINE_MAX_UPLOAD_MB:-10}
+export SIGHTLINE_UPLOAD_BUDGET_MB=${SIGHTLINE_UPLOAD_BUDGET_MB:-64}
+export SIGHTLINE_GC_RSS_THRESHOLD_MB=${SIGHTLINE_GC_RSS_THRESHOLD_MB:-320}
+
+# Workers share one memory-mapped copy of the gallery, so registrations on
+# any worker are visible to all of them
+export SIGHTLINE_GALLERY_STORE=${SIGHTLINE_GALLERY_STORE:-data/gallery}
+
 # Set maximum memory for the process (in MB)
 ulimit -v 524288  # 512MB virtual memory limit
 
 # Start the application with memory-efficient settings
 exec gunicorn src.main:app \
     --bind 0.0.0.0:$PORT \
-    --workers 1 \
+    --workers ${SIGHTLINE_WORKERS:-1} \
     --worker-class uvicorn.workers.UvicornWorker \
-    --worker-connections 10 \
-    --max-requests 100 \
-    --max-requests-jitter 10 \
+    --worker-connections 50 \
+    --max-requests 2000 \
+    --max-requests-jitter 200 \
     --timeout 30 \
     --keep-alive 2 \
     --preload
@@ -0,0 +1,31 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import db  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A fresh SQLite file per test; returns its path"""
+    path = str(tmp_path / 'faces.db')
+    monkeypatch.setattr(db, 'DB_PATH', path)
+    monkeypatch.setattr(db, '_local', threading.local())
+    monkeypatch.setattr(db, '_schema_ready', False)
+    return path
+
+
+@pytest.fixture
+def faces_db(database, monkeypatch):
+    """database, plus a fresh resident gallery, probe cache and search indexes"""
+    from src import faces
+    from src.cache import ProbeCache
+    monkeypatch.setattr(faces, '_gallery', None)
+    monkeypatch.setattr(faces, '_next_sync', 0.0)
+    monkeypatch.setattr(faces, '_indexes', {})
+    monkeypatch.setattr(faces, 'probe_cache', ProbeCache())
+    return database
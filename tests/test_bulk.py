@@ -0,0 +1,52 @@
+import io
+import zipfile
+
+import cv2
+import numpy as np
+from fastapi.testclient import TestClient
+
+from benchmarks.synthetic import make_face_image
+from src import bulk, faces, main
+
+
+def _jpeg(image):
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def _archive(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for path, data in entries:
+            archive.writestr(path, data)
+    return buffer.getvalue()
+
+
+def test_failures_are_reported_per_item(faces_db):
+    entries = [
+        ('alice/1.jpg', _jpeg(make_face_image(seed=1))),
+        ('bob.jpg', b'not an image'),
+        ('carol/big.jpg', None),
+        ('dave.jpg', _jpeg(np.full((200, 200, 3), 128, dtype=np.uint8))),
+        ('alice/2.jpg', _jpeg(make_face_image(seed=6))),
+    ]
+    result = bulk.enroll(entries, processes=1, chunk_size=2)
+
+    assert (result['total'], result['registered']) == (5, 2)
+    failed = {item['entry']: item for item in result['failed']}
+    assert sorted(failed) == ['bob.jpg', 'carol/big.jpg', 'dave.jpg']
+    assert failed['carol/big.jpg']['name'] == 'carol'
+    assert all(item['error'] for item in failed.values())
+    # The good images are both templates of alice, and already in the gallery
+    assert faces.list_faces()['registered_faces'] == ['alice']
+    assert faces.get_gallery().identities == 1
+
+
+def test_bulk_endpoint_enrolls_an_archive(faces_db, monkeypatch):
+    monkeypatch.setattr(bulk, 'BULK_PROCESSES', 1)
+    archive = _archive([('alice/1.jpg', _jpeg(make_face_image(seed=1))), ('notes/readme.txt', b'skipped'),
+                        ('bob/1.jpg', b'\xff\xd8\xff broken')])
+    response = TestClient(main.app).post('/register/bulk', files={'file': ('faces.zip', archive, 'application/zip')})
+    assert response.status_code == 200
+    result = response.json()
+    assert (result['total'], result['registered']) == (2, 1)
+    assert [(item['entry'], item['name']) for item in result['failed']] == [('bob/1.jpg', 'bob')]
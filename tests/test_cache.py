@@ -0,0 +1,44 @@
+import cv2
+
+from benchmarks.synthetic import make_face_image
+from src import faces
+from src.cache import ProbeCache
+
+
+def _jpeg(seed):
+    return cv2.imencode('.jpg', make_face_image(seed=seed))[1].tobytes()
+
+
+def _names(result):
+    return [match['name'] for match in result['matches']]
+
+
+def test_put_is_dropped_after_an_invalidation():
+    cache = ProbeCache(max_bytes=1 << 20, ttl=60)
+    generation = cache.generation
+    cache.invalidate()
+    cache.put('key', {'matches': []}, generation)
+    assert cache.get('key') is None
+
+
+def test_gallery_changes_invalidate_cached_results(faces_db):
+    alice, bob = _jpeg(1), _jpeg(2)
+    faces.register_face('carol', _jpeg(4))
+    assert _names(faces.recognize_faces(bob)) == []
+    assert faces.probe_cache.stats()['entries'] == 1
+
+    # add_face
+    faces.register_face('alice', alice)
+    assert faces.probe_cache.stats()['entries'] == 0
+    assert _names(faces.recognize_faces(alice)) == ['alice']
+    assert _names(faces.recognize_faces(bob)) == []
+
+    # update
+    faces.update_face('alice', bob)
+    assert _names(faces.recognize_faces(bob)) == ['alice']
+    assert _names(faces.recognize_faces(alice)) == []
+
+    # unregister
+    faces.unregister_face('alice')
+    assert _names(faces.recognize_faces(bob)) == []
+    assert faces.probe_cache.stats()['invalidations'] >= 3
@@ -0,0 +1,52 @@
+import json
+
+import numpy as np
+
+from benchmarks.synthetic import features_for, make_faces
+from src.codec import FEATURE_FORMAT, LEGACY_FORMAT, decode_features, encode_features, migrate_legacy_features
+from src.db import add_face, get_face_templates
+
+
+def _legacy_blob(features):
+    return json.dumps({
+        'face_region': features['face_region'].tolist(),
+        'histogram': features['histogram'].tolist(),
+        'face_box': list(features['face_box'])
+    }).encode('utf-8')
+
+
+def test_round_trip_without_embedding():
+    features = features_for(make_faces(1)[0])
+    decoded = decode_features(encode_features(features), FEATURE_FORMAT)
+    assert np.array_equal(decoded['face_region'], features['face_region'])
+    assert np.array_equal(decoded['histogram'], features['histogram'])
+    assert decoded['face_box'] == features['face_box']
+    assert 'embedding' not in decoded
+
+
+def test_round_trip_with_embedding():
+    features = features_for(make_faces(1)[0])
+    features['embedding'] = np.linspace(-1, 1, 128, dtype=np.float32)
+    decoded = decode_features(encode_features(features), FEATURE_FORMAT)
+    assert np.array_equal(decoded['embedding'], features['embedding'])
+    assert np.array_equal(decoded['face_region'], features['face_region'])
+
+
+def test_legacy_json_reads_like_binary():
+    features = features_for(make_faces(1)[0])
+    legacy = decode_features(_legacy_blob(features), LEGACY_FORMAT)
+    binary = decode_features(encode_features(features), FEATURE_FORMAT)
+    assert np.array_equal(legacy['face_region'], binary['face_region'])
+    assert np.allclose(legacy['histogram'], binary['histogram'])
+    assert legacy['face_box'] == binary['face_box']
+
+
+def test_migrate_legacy_features(database):
+    features = features_for(make_faces(1)[0])
+    add_face('alice', _legacy_blob(features), LEGACY_FORMAT)
+    assert migrate_legacy_features() == 1
+    assert migrate_legacy_features() == 0
+
+    (_, data, image_format), = get_face_templates('alice')
+    assert image_format == FEATURE_FORMAT
+    assert np.array_equal(decode_features(data, image_format)['face_region'], features['face_region'])
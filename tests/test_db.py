@@ -0,0 +1,48 @@
+import sqlite3
+
+from src import db
+from src.db import (add_face, add_faces, delete_face, get_all_faces, get_face_changes, get_face_templates,
+                    get_version, replace_face_templates)
+
+
+def test_migrates_single_table_schema(database):
+    conn = sqlite3.connect(database)
+    conn.execute('''CREATE TABLE faces (name TEXT PRIMARY KEY, image_data BLOB NOT NULL,
+        image_format TEXT NOT NULL DEFAULT 'jpg')''')
+    conn.executemany('INSERT INTO faces (name, image_data, image_format) VALUES (?, ?, ?)',
+                     [('alice', b'a', 'jpg'), ('bob', b'b', 'jpg')])
+    conn.commit()
+    conn.close()
+
+    assert sorted(get_all_faces()) == ['alice', 'bob']
+    assert [row[1:] for row in get_face_templates('alice')] == [(b'a', 'jpg')]
+    # Rows are versioned by rowid
+    assert [(version, name) for version, name, _ in get_face_changes(0)] == [(1, 'alice'), (2, 'bob')]
+    assert add_face('carol', b'c', 'jpg') == 3
+
+
+def test_face_changes_after_add_replace_delete(database):
+    assert add_face('alice', b'a1', 'jpg') == 1
+    assert add_face('bob', b'b1', 'jpg') == 2
+    assert add_face('alice', b'a2', 'jpg') == 3
+    assert get_face_changes(0) == [(2, 'bob', [(b'b1', 'jpg')]), (3, 'alice', [(b'a1', 'jpg'), (b'a2', 'jpg')])]
+
+    assert replace_face_templates('bob', [(b'b2', 'jpg')]) == 4
+    assert delete_face('alice') == 5
+    assert delete_face('alice') is None
+    assert get_face_changes(3) == [(4, 'bob', [(b'b2', 'jpg')]), (5, 'alice', None)]
+    assert get_face_changes(5) == []
+    assert get_version() == 5
+
+    # Registering a deleted name again clears its tombstone
+    assert add_face('alice', b'a3', 'jpg') == 6
+    assert get_face_changes(4) == [(6, 'alice', [(b'a3', 'jpg')])]
+
+
+def test_add_faces_applies_the_template_cap_once(database, monkeypatch):
+    monkeypatch.setattr(db, 'MAX_TEMPLATES', 2)
+    rows = [('alice', b'a1', 'jpg'), ('bob', b'b1', 'jpg'), ('alice', b'a2', 'jpg'), ('alice', b'a3', 'jpg')]
+    assert add_faces(rows) == 4
+    assert [row[1] for row in get_face_templates('alice')] == [b'a2', b'a3']
+    assert [row[1] for row in get_face_templates('bob')] == [b'b1']
+    assert [(version, name) for version, name, _ in get_face_changes(0)] == [(2, 'bob'), (4, 'alice')]
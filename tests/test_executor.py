@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import main
+from src.executor import BoundedExecutor, QueueFullError, RETRY_AFTER_SECONDS
+
+
+def test_rejects_jobs_beyond_workers_and_queue():
+    pool = BoundedExecutor(max_workers=1, queue_size=1)
+    release = threading.Event()
+    admitted = [pool.submit(release.wait), pool.submit(release.wait)]
+    with pytest.raises(QueueFullError):
+        pool.submit(release.wait)
+    release.set()
+    assert all(future.result(5) for future in admitted)
+    assert pool.stats()['rejected'] == 1
+    # Slots come back once the jobs are done
+    assert pool.submit(lambda: 1).result(5) == 1
+
+
+def test_map_runs_inside_the_pool_bound():
+    pool = BoundedExecutor(max_workers=2, queue_size=0)
+    threads = set()
+
+    def square(x):
+        threads.add(threading.current_thread().name)
+        return x * x
+
+    assert pool.submit(pool.map, square, range(8)).result(5) == [x * x for x in range(8)]
+    assert all(name.startswith('sightline-face') for name in threads)
+
+    # With every other worker busy the batch still finishes on its own slot
+    release = threading.Event()
+    blocker = pool.submit(release.wait)
+    assert pool.submit(pool.map, square, range(4)).result(5) == [0, 1, 4, 9]
+    release.set()
+    blocker.result(5)
+
+
+def test_full_pool_answers_503_with_retry_after(faces_db, monkeypatch):
+    pool = BoundedExecutor(max_workers=1, queue_size=0)
+    monkeypatch.setattr(main, 'face_pool', pool)
+    client = TestClient(main.app)
+    release = threading.Event()
+    blocker = pool.submit(release.wait)
+    try:
+        response = client.delete('/faces/alice')
+    finally:
+        release.set()
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == str(RETRY_AFTER_SECONDS)
+
+    blocker.result(5)
+    assert client.delete('/faces/alice').status_code == 404
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import features_for, make_gallery_features, make_probes
+from src.faces import compare_faces
+from src.gallery import Gallery, FeatureLayout, score_probes
+
+
+def _gallery(count, templates=1, layout=None):
+    names, faces, hists = make_gallery_features(count * templates)
+    gallery = Gallery(embedding_dim=0, layout=layout)
+    for i, (face, hist) in enumerate(zip(faces, hists)):
+        gallery.add(names[i % count], face, hist)
+    return gallery, names[:count], faces
+
+
+@pytest.mark.parametrize('templates', [1, 3])
+def test_scores_match_compare_faces(templates):
+    gallery, names, faces = _gallery(20, templates)
+    _, probes = make_probes(faces, 5)
+    for probe in probes:
+        scored_names, scores = gallery.score(probe)
+        expected = {name: 0.0 for name in names}
+        for row, face in enumerate(faces):
+            name = names[row % len(names)]
+            expected[name] = max(expected[name], compare_faces(probe, features_for(face)))
+        assert scored_names == names
+        assert np.allclose(scores, [expected[name] for name in scored_names], atol=1e-5)
+
+
+@pytest.mark.parametrize('how', ['max', 'mean'])
+@pytest.mark.parametrize('layout', [None, FeatureLayout(50, 8)])
+def test_prefilter_keeps_every_score_above_the_threshold(how, layout, monkeypatch):
+    monkeypatch.setattr('src.gallery.TEMPLATE_AGGREGATION', how)
+    gallery, _, faces = _gallery(200, 2, layout)
+    _, probes = make_probes(faces, 20)
+    threshold = 0.6
+    names, full = gallery.score_many(probes)
+    prefiltered_names, prefiltered = gallery.score_many(probes, threshold)
+    assert prefiltered_names == names
+    # Pruned identities keep an upper bound that doesn't clear the threshold
+    assert np.all(prefiltered >= full - 1e-9)
+    above = full > threshold
+    assert np.array_equal(prefiltered > threshold, above)
+    assert np.allclose(prefiltered[above], full[above])
+
+
+def test_read_reruns_a_pass_that_overlapped_a_change():
+    gallery, names, faces = _gallery(3)
+    probe = features_for(faces[2])
+    passes = []
+
+    def score(row_names, row_faces, hists, embeddings, groups):
+        if not passes:
+            # Moves the last row into the first one's place mid-pass
+            gallery.remove(names[0])
+        passes.append(row_names)
+        scores = groups.aggregate(score_probes([probe], row_faces, hists, embeddings, None, groups))[0]
+        return {name: score for name, score in zip(groups.names, scores) if score > 0.99}
+
+    assert list(gallery.read(score)) == [names[2]]
+    assert len(passes) == 2
@@ -0,0 +1,54 @@
+import numpy as np
+
+from benchmarks.synthetic import features_for, make_gallery_features, make_probes, make_faces
+from src.gallery import Gallery
+from src.index import ExactIndex, IVFIndex, IVF_MIN_TRAIN
+
+
+def _gallery(count):
+    names, faces, hists = make_gallery_features(count)
+    gallery = Gallery(embedding_dim=0)
+    for name, face, hist in zip(names, faces, hists):
+        gallery.add(name, face, hist)
+    return gallery, names, faces
+
+
+def test_ivf_recall_against_exact_search():
+    gallery, _, faces = _gallery(1000)
+    _, probes = make_probes(faces, 50)
+    exact, ivf = ExactIndex(gallery), IVFIndex(gallery)
+    hits = 0
+    for probe in probes:
+        exact_names, exact_scores = exact.search(probe, top_k=1)
+        ivf_names, ivf_scores = ivf.search(probe, top_k=1)
+        if ivf_names == exact_names:
+            hits += 1
+            # Candidates are scored exactly
+            assert np.allclose(ivf_scores, exact_scores)
+    assert ivf.stats()['trained_size'] == 1000
+    assert hits / len(probes) >= 0.9
+
+
+def test_ivf_picks_up_rows_added_after_training():
+    gallery, _, faces = _gallery(IVF_MIN_TRAIN)
+    ivf = IVFIndex(gallery)
+    _, probes = make_probes(faces, 1)
+    ivf.search(probes[0])
+    assert ivf.stats()['trained_size'] == IVF_MIN_TRAIN
+
+    newcomer = make_faces(1, seed=7)[0]
+    features = features_for(newcomer)
+    gallery.add('newcomer', newcomer, features['histogram'])
+    assert ivf.search(features, top_k=1)[0] == ['newcomer']
+
+
+def test_small_galleries_fall_back_to_exact_search():
+    gallery, _, faces = _gallery(IVF_MIN_TRAIN // 4)
+    _, probes = make_probes(faces, 5)
+    exact, ivf = ExactIndex(gallery), IVFIndex(gallery)
+    for probe in probes:
+        exact_names, exact_scores = exact.search(probe)
+        ivf_names, ivf_scores = ivf.search(probe)
+        assert ivf_names == exact_names
+        assert np.allclose(ivf_scores, exact_scores)
+    assert ivf.stats()['trained_size'] == 0
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import make_gallery_features
+from src import faces
+from src.embedding import get_extractor
+from src.gallery import Gallery, FeatureLayout
+from src.snapshot import SnapshotError, read_snapshot, write_snapshot
+
+
+def _rows(layout=None, count=6):
+    names, crops, hists = make_gallery_features(count)
+    gallery = Gallery(embedding_dim=0, layout=layout)
+    for name, face, hist in zip(names, crops, hists):
+        gallery.add(name, face, hist)
+    return gallery.read(lambda names, faces, hists, embeddings, _: (
+        list(names), faces.copy(), hists.copy(), embeddings.copy(), gallery.layout))
+
+
+@pytest.mark.parametrize('compress', [False, True])
+@pytest.mark.parametrize('layout', [None, FeatureLayout(50, 8)])
+def test_round_trip(tmp_path, compress, layout):
+    names, crops, hists, embeddings, layout = _rows(layout)
+    path = str(tmp_path / 'gallery.snap')
+    write_snapshot(path, names, crops, hists, embeddings, layout, 7, compress=compress)
+
+    snapshot = read_snapshot(path)
+    assert snapshot.names == names
+    assert snapshot.version == 7
+    assert snapshot.layout == layout
+    assert snapshot.compressed == compress
+    assert np.array_equal(snapshot.faces, crops)
+    assert np.array_equal(snapshot.histograms, hists)
+    assert snapshot.embeddings.shape == (len(names), 0)
+
+
+def test_damaged_files_are_rejected(tmp_path):
+    names, crops, hists, embeddings, layout = _rows()
+    path = tmp_path / 'gallery.snap'
+    write_snapshot(str(path), names, crops, hists, embeddings, layout, 1)
+    data = bytearray(path.read_bytes())
+
+    flipped = tmp_path / 'flipped.snap'
+    data[-100] ^= 0xFF
+    flipped.write_bytes(bytes(data))
+    with pytest.raises(SnapshotError):
+        read_snapshot(str(flipped))
+
+    truncated = tmp_path / 'truncated.snap'
+    truncated.write_bytes(bytes(data[:len(data) // 2]))
+    with pytest.raises(SnapshotError):
+        read_snapshot(str(truncated))
+
+
+def test_startup_ignores_a_snapshot_of_another_layout(faces_db, tmp_path, monkeypatch):
+    path = str(tmp_path / 'gallery.snap')
+    monkeypatch.setattr(faces, 'SNAPSHOT_PATH', path)
+    write_snapshot(path, *_rows(FeatureLayout(50, 8)), 0)
+    assert faces._gallery_from_snapshot(get_extractor()) is None
+
+    # The default layout is mapped, and gives an empty database its faces back
+    names, *rest = _rows()
+    write_snapshot(path, names, *rest, 0)
+    gallery = faces._gallery_from_snapshot(get_extractor())
+    assert gallery.identities == len(names)
+    assert sorted(faces.list_faces()['registered_faces']) == sorted(names)
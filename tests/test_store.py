@@ -0,0 +1,74 @@
+import numpy as np
+
+from benchmarks.synthetic import make_gallery_features
+from src.store import SharedGallery
+
+
+def _rows(gallery):
+    return gallery.read(lambda names, faces, hists, embeddings, groups: (names, faces.copy(), hists.copy()))
+
+
+def _templates(count, seed=0):
+    _, faces, hists = make_gallery_features(count, seed)
+    return [(face, hist, None) for face, hist in zip(faces, hists)]
+
+
+def test_journal_replays_across_instances(tmp_path):
+    writer = SharedGallery(str(tmp_path))
+    writer.attach(0, 0, lambda: [])
+    reader = SharedGallery(str(tmp_path))
+    assert not reader.attach(0, 0, lambda: [])
+
+    templates = _templates(4)
+    writer.add('alice', *templates[0][:2])
+    writer.add('bob', *templates[1][:2])
+    writer.add('carol', *templates[2][:2])
+    writer.set_templates('alice', [templates[3], templates[0]])
+    writer.remove('bob')
+
+    names, faces, hists = _rows(reader)
+    expected_names, expected_faces, expected_hists = _rows(writer)
+    assert sorted(names) == ['alice', 'alice', 'carol']
+    assert names == expected_names
+    assert np.array_equal(faces, expected_faces)
+    assert np.array_equal(hists, expected_hists)
+
+    # Writes from the other side replay too
+    reader.add('dave', *templates[1][:2])
+    assert _rows(writer)[0] == names + ['dave']
+
+
+def test_stale_versions_are_skipped_by_every_worker(tmp_path):
+    first = SharedGallery(str(tmp_path))
+    first.attach(0, 0, lambda: [])
+    second = SharedGallery(str(tmp_path))
+    second.attach(0, 0, lambda: [])
+
+    new, old = _templates(2)
+    first.set_templates('alice', [new], version=5)
+    second.set_templates('alice', [old], version=4)
+    second.remove('alice', version=3)
+
+    names, faces, _ = _rows(second)
+    assert names == ['alice']
+    assert np.array_equal(faces[0], new[0].ravel())
+
+
+def test_attach_records_and_checks_the_database_version(tmp_path):
+    rows = [('alice', face, hist, None) for face, hist, _ in _templates(1)]
+    store = SharedGallery(str(tmp_path))
+    assert store.attach(1, 3, lambda: rows)
+    assert store.version == 3
+
+    store.advance(4, 6)
+    assert SharedGallery(str(tmp_path)).version == 6
+    # A gap leaves the version where it was, for the change feed to fill
+    store.advance(8, 9)
+    assert store.version == 6
+
+    # Behind the database: left for the caller to catch up
+    assert not SharedGallery(str(tmp_path)).attach(1, 10, lambda: rows)
+    # Ahead of it (the database was replaced): rebuilt at its version
+    replaced = SharedGallery(str(tmp_path))
+    assert replaced.attach(1, 2, lambda: rows)
+    assert replaced.version == 2
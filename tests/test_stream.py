@@ -0,0 +1,66 @@
+import asyncio
+
+from src.stream import IoUTracker, LatestFrame
+
+
+def _ids(tracks):
+    return [track.id for track in tracks]
+
+
+def test_detections_continue_the_best_overlapping_track():
+    tracker = IoUTracker(iou_threshold=0.3)
+    left, right = tracker.update([(0, 0, 100, 100), (300, 0, 100, 100)])
+
+    # Moved a little and listed in the other order: both continue their track
+    assert tracker.update([(310, 5, 100, 100), (10, 0, 100, 100)]) == []
+    assert left.box == (10, 0, 100, 100) and right.box == (310, 5, 100, 100)
+    assert left.hits == right.hits == 2
+
+    # A box between them overlaps neither enough and starts a new track
+    started = tracker.update([(150, 0, 100, 100), (12, 0, 100, 100)])
+    assert _ids(started) == [3]
+    assert _ids(tracker.visible()) == [left.id, 3]
+
+
+def test_tracks_expire_after_max_misses():
+    tracker = IoUTracker(max_misses=2)
+    track, = tracker.update([(0, 0, 100, 100)])
+    tracker.update([])
+    tracker.update([])
+    assert tracker.visible() == [] and tracker.tracks == [track]
+
+    # Seen again within the limit: same track
+    assert tracker.update([(5, 5, 100, 100)]) == []
+    assert track.misses == 0
+
+    for _ in range(3):
+        tracker.update([])
+    assert tracker.tracks == []
+    assert _ids(tracker.update([(5, 5, 100, 100)])) == [2]
+
+
+def test_due_rematches_stale_tracks_and_every_track_after_a_gallery_change():
+    tracker = IoUTracker(rematch_seconds=2.0)
+    first, second = tracker.update([(0, 0, 100, 100), (300, 0, 100, 100)])
+    assert tracker.due(0.0, generation=1) == [first, second]
+    first.identify({"name": "alice", "confidence": 0.9}, 0.0)
+    second.identify(None, 1.0)
+
+    tracker.update([(0, 0, 100, 100), (300, 0, 100, 100)])
+    assert tracker.due(1.5, generation=1) == []
+    assert tracker.due(2.5, generation=1) == [first]
+    # The gallery changed: every visible track is due again
+    assert tracker.due(2.5, generation=2) == [first, second]
+
+
+def test_latest_frame_keeps_only_the_newest():
+    async def scenario():
+        frames = LatestFrame()
+        frames.put(b'1')
+        frames.put(b'2')
+        assert await frames.get() == b'2'
+        assert frames.dropped == 1
+        frames.close()
+        assert await frames.get() is None
+
+    asyncio.run(scenario())
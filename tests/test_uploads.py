@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import cv2
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks.synthetic import make_face_image
+from src import main, uploads
+from src.uploads import ByteBudget, UploadBudgetExceeded, MAX_UPLOAD_BYTES
+
+
+def _jpeg():
+    return cv2.imencode('.jpg', make_face_image(size=200))[1].tobytes()
+
+
+def _chunked_multipart(size):
+    boundary = 'sightline'
+
+    def body():
+        yield (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="big.jpg"\r\n'
+               f'Content-Type: image/jpeg\r\n\r\n').encode()
+        for _ in range(size // 65536 + 1):
+            yield b'\xff' * 65536
+        yield f'\r\n--{boundary}--\r\n'.encode()
+
+    return body(), {'content-type': f'multipart/form-data; boundary={boundary}'}
+
+
+def test_oversized_uploads_get_413(faces_db):
+    client = TestClient(main.app)
+    too_big = b'\xff\xd8\xff' + bytes(MAX_UPLOAD_BYTES)
+    response = client.post('/recognize', files={'file': ('big.jpg', too_big, 'image/jpeg')})
+    assert response.status_code == 413
+
+    # Without a Content-Length the body is cut off while it streams in
+    body, headers = _chunked_multipart(MAX_UPLOAD_BYTES)
+    response = client.post('/recognize', content=body, headers=headers)
+    assert response.status_code == 413
+    assert 'limit' in response.json()['message']
+
+
+def test_non_images_get_415(faces_db):
+    response = TestClient(main.app).post('/register', data={'name': 'alice'},
+                                         files={'file': ('notes.txt', b'not an image', 'text/plain')})
+    assert response.status_code == 415
+    assert response.json()['status'] == 'error'
+
+
+def test_full_upload_budget_waits_then_answers_503(faces_db, monkeypatch):
+    budget = ByteBudget(capacity=1024, timeout=0.2)
+    budget._used = budget.capacity
+    monkeypatch.setattr(uploads, 'upload_budget', budget)
+    start = time.perf_counter()
+    response = TestClient(main.app).post('/recognize', files={'file': ('face.jpg', _jpeg(), 'image/jpeg')})
+    assert response.status_code == 503
+    assert 'retry-after' in response.headers
+    assert time.perf_counter() - start >= 0.2
+    assert budget.stats()['rejected'] == 1
+
+
+def test_budget_admits_a_waiting_upload_once_bytes_are_released():
+    async def scenario():
+        budget = ByteBudget(capacity=100, timeout=1)
+        held = await budget.acquire(80)
+        waiting = asyncio.ensure_future(budget.acquire(50))
+        await asyncio.sleep(0.05)
+        assert not waiting.done() and budget.stats()['waiting'] == 1
+        await budget.release(held)
+        assert await waiting == 50
+        # Larger than the whole budget: capped, so it runs alone
+        await budget.release(50)
+        assert await budget.acquire(500) == 100
+        with pytest.raises(UploadBudgetExceeded):
+            await asyncio.wait_for(budget.acquire(1), 5)
+
+    asyncio.run(scenario())